@@ -0,0 +1,219 @@
+# the headless batch mode: harmonize all images in the given files/directories/globs w/o the gui
+# usage: python batch.py ./resource/test_img/ "./photos/**/*.jpg" -t AUTO -r .5 -j 8
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
+import glob
+import os
+from pathlib import Path
+import sys
+import time
+
+import color_harmonization.harmonic_template as harmonic_template
+import color_harmonization.harmonize as harmonize
+from color_harmonization.tiled_harmonize import DEFAULT_TILE_OVERLAP, DEFAULT_TILE_SIZE, harmonize_tiled
+from utils.general_utils import DEFAULT_SAVE_RES_DIR, DEFAULT_SAVE_VIS_DIR, gut_get_output_fname, gut_load_image, gut_resize_by_ratio, gut_save_image
+from utils.harmonization_utils import (
+    hut_convert_image_into_hsv_w_resizing,
+    hut_load_reference_image_w_resizing,
+    TEMPL_TYPES_MAPPING,
+)
+
+
+# the exit codes
+EXIT_OK = 0
+EXIT_SOME_FAILED = 1
+EXIT_NO_INPUTS = 2
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp',)
+
+
+# parse the template type from either an integer (0 - 7) or a character (i, V, L, I, T, Y, X, AUTO)
+def _parse_template_type(text):
+    if text.isdigit() and 0 <= int(text) < len(TEMPL_TYPES_MAPPING):
+        return int(text)
+    for t, name in enumerate(TEMPL_TYPES_MAPPING):
+        if text == name or (name == 'AUTO' and text.upper() == name):
+            return t
+    raise argparse.ArgumentTypeError(f'Unknown template type: {text}. Use 0 - 7 or one of {", ".join(TEMPL_TYPES_MAPPING)}.')
+
+
+# collect all image files from the given files, directories, or glob patterns (w/o duplicates, in a stable order)
+def _collect_input_files(inputs, recursive):
+    fpaths = []
+    for inp in inputs:
+        if os.path.isdir(inp):
+            pattern = os.path.join(inp, '**', '*') if recursive else os.path.join(inp, '*')
+            candidates = sorted(glob.glob(pattern, recursive=recursive))
+        elif os.path.isfile(inp):
+            candidates = [inp]
+        else:
+            candidates = sorted(glob.glob(inp, recursive=True))
+        fpaths.extend(c for c in candidates if os.path.isfile(c) and Path(c).suffix.lower() in IMAGE_EXTS)
+    return list(dict.fromkeys(fpaths))
+
+
+# the bounding box of the foreground for the non-interactive segmentation: the whole image inset by a margin ratio
+def _get_foreground_rect(im, margin):
+    h, w = im.shape[: 2]
+    dx, dy = int(w * margin), int(h * margin)
+    return dx, dy, max(w - 2 * dx, 1), max(h - 2 * dy, 1)
+
+
+# harmonize a single image file as a whole; return the result & the path where it is saved
+def _harmonize_whole_file(fpath, cfg, summary):
+    img = gut_load_image(fpath)
+    if img is None:
+        raise ValueError('Not a legal image.')
+
+    # convert the image into hsv color space also apply resizing
+    resized_im, hsv = hut_convert_image_into_hsv_w_resizing(img, ratio=cfg['resize_ratio'])
+    summary['shape'] = hsv.shape[: 2]
+    ref_im, ref_hsv = None, None
+    if cfg['ref_im_fpath'] is not None:
+        ref_im, ref_hsv = hut_load_reference_image_w_resizing(cfg['ref_im_fpath'], (resized_im.shape[1], resized_im.shape[0],))
+
+    # tackle w/ paths (the same naming scheme as the gui)
+    fname = gut_get_output_fname(fpath, cfg['resize_ratio'], cfg['template_type'], full_resolution=cfg['full_resolution'])
+    save_res_path = Path(cfg['res_dir'], fname)
+    save_vis_path = Path(cfg['vis_dir'], fname)
+    save_res_path.parent.mkdir(parents=True, exist_ok=True)
+    save_vis_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # do color harmonization
+    result = harmonize.harmonize_image(
+        resized_im, harmonic_template.build_template_list(cfg['template_type']),
+        hsv=hsv,
+        mask=harmonize.get_harmonization_mask(
+            resized_im, cfg['mode'], ref_im=ref_im, show=False,
+            seg_rect=_get_foreground_rect(resized_im if ref_im is None else ref_im, cfg['fg_rect_margin']),
+        ),
+        ref_im=ref_im,
+        ref_hsv=ref_hsv,
+        _lambda=cfg['_lambda'],
+        graph_cut_backend=cfg['graph_cut_backend'],
+    )
+    harmonize.log_harmonization_result(result)
+    if cfg['full_resolution']:
+        result = harmonize.apply_harmonization_result(result, img)
+        summary['shape'] = result.hsv.shape[: 2]
+    harmonize.save_harmonization_visualizations(result, save_vis_path)
+    harmonize.save_harmonization_result(result, save_res_path)
+    return result, save_res_path
+
+
+# harmonize a single image file tile by tile (cf. harmonize_tiled), i.e., w/ the memory of the graph-cut bounded by the tile size;
+# only the normal mode is supported, and only the result is saved (w/o the visualizations); return the result & the path where it is saved
+def _harmonize_file_tiled(fpath, cfg, summary):
+    img = gut_load_image(fpath)
+    if img is None:
+        raise ValueError('Not a legal image.')
+    fname = gut_get_output_fname(fpath, cfg['resize_ratio'], cfg['template_type'], tile_size=cfg['tile_size'])
+    save_res_path = Path(cfg['res_dir'], fname)
+    save_res_path.parent.mkdir(parents=True, exist_ok=True)
+    result = harmonize_tiled(
+        gut_resize_by_ratio(img, cfg['resize_ratio']),
+        harmonic_template.build_template_list(cfg['template_type']),
+        tile_size=cfg['tile_size'],
+        overlap=cfg['tile_overlap'],
+        _lambda=cfg['_lambda'],
+    )
+    summary['shape'] = result.image.shape[: 2]
+    print(f'| {result.template}-TYPE | ALPHA = {result.alpha:.2f} | F-VALUE = {result.f_val:8.2f} | TILE = {cfg["tile_size"]} (+{cfg["tile_overlap"]}) |')
+    gut_save_image(save_res_path, result.image)
+    return result, save_res_path
+
+
+# harmonize a single image file (executed in a worker process)
+def _harmonize_file(fpath, cfg):
+    start_time = time.perf_counter()
+    summary = {
+        'fpath': fpath, 'ok': False, 'shape': None, 'template': None, 'alpha': None, 'f_val': None,
+        'result_path': None, 'message': '', 'elapsed': 0.,
+    }
+    try:
+        with contextlib.ExitStack() as stack:
+            # silence the logs of the harmonization unless verbose (the devnull is closed along w/ the stack)
+            if not cfg['verbose']:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+            result, save_res_path = (_harmonize_file_tiled if cfg['tiled'] else _harmonize_whole_file)(fpath, cfg, summary)
+        summary['template'] = str(result.template)
+        summary['alpha'] = result.alpha
+        summary['f_val'] = result.f_val
+        summary['ok'] = True
+        summary['result_path'] = str(save_res_path)
+    except Exception as e:
+        summary['message'] = f'{type(e).__name__}: {e}'
+    summary['elapsed'] = time.perf_counter() - start_time
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Harmonize images in batch w/o the gui.')
+    parser.add_argument('inputs', nargs='+', help='Image files, directories, or glob patterns.')
+    parser.add_argument('-t', '--template-type', type=_parse_template_type, default=7,
+                        help='0 - 6 or i, V, L, I, T, Y, X for a certain template; 7 or AUTO for the best one (default: AUTO).')
+    parser.add_argument('-r', '--resize-ratio', type=float, default=1.)
+    parser.add_argument('-l', '--lambda', dest='_lambda', type=float, default=.5)
+    parser.add_argument('-F', '--full-resolution', action='store_true',
+                        help='Solve on the resized image but apply the harmonization to the original one.')
+    parser.add_argument('-m', '--mode', choices=('normal', 'background', 'foreground',), default='normal')
+    parser.add_argument('--graph-cut-backend', choices=('auto', 'grid', 'sparse', 'pyramid', 'superpixel', 'networkx',), default='auto',
+                        help='"sparse" solves only on the out-of-sector pixels; "pyramid" solves coarse-to-fine for huge images; '
+                             '"superpixel" solves on ~2000 superpixels (default: auto).')
+    parser.add_argument('--tiled', action='store_true',
+                        help='Harmonize tile by tile w/ a bounded memory (normal mode only, w/o the visualizations; the graph-cut backend is ignored).')
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE, help=f'The side length of the tiles for --tiled (default: {DEFAULT_TILE_SIZE}).')
+    parser.add_argument('--tile-overlap', type=int, default=DEFAULT_TILE_OVERLAP,
+                        help=f'The width of the overlaps around the tiles for --tiled (default: {DEFAULT_TILE_OVERLAP}).')
+    parser.add_argument('--ref', dest='ref_im_fpath', default=None, help='The reference image (optional).')
+    parser.add_argument('--fg-rect-margin', type=float, default=.1,
+                        help='The margin ratio of the foreground box for the background/foreground modes (default: .1).')
+    parser.add_argument('--res-dir', default=DEFAULT_SAVE_RES_DIR)
+    parser.add_argument('--vis-dir', default=DEFAULT_SAVE_VIS_DIR)
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='The number of worker processes.')
+    parser.add_argument('-R', '--recursive', action='store_true', help='Search the given directories recursively.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print the logs of every harmonization process.')
+    args = parser.parse_args(argv)
+    if args.tiled:
+        if args.mode != 'normal':
+            parser.error('--tiled supports the normal mode only (w/o -m background/foreground).')
+        if args.ref_im_fpath is not None:
+            parser.error('--tiled does not support the reference image (--ref).')
+        if args.full_resolution:
+            parser.error('--tiled cannot be used w/ --full-resolution; use --tiled w/ --resize-ratio 1 to harmonize the original image instead.')
+        if not 0 < args.tile_overlap <= args.tile_size:
+            parser.error('--tile-overlap must be positive and not larger than --tile-size.')
+
+    fpaths = _collect_input_files(args.inputs, args.recursive)
+    if len(fpaths) == 0:
+        print('No input images found.', file=sys.stderr)
+        return EXIT_NO_INPUTS
+    cfg = {k: getattr(args, k) for k in (
+        'template_type', 'resize_ratio', 'full_resolution', '_lambda', 'graph_cut_backend', 'mode', 'ref_im_fpath', 'fg_rect_margin', 'res_dir', 'vis_dir', 'verbose',
+        'tiled', 'tile_size', 'tile_overlap',
+    )}
+
+    # fan the jobs out over the process pool
+    print(f'| BATCH | # IMAGES = {len(fpaths)} | # WORKERS = {args.workers} | '
+          f'TEMPLATE-TYPE = {TEMPL_TYPES_MAPPING[args.template_type]} | RATIO = {args.resize_ratio:.2f} | MODE = {args.mode} |')
+    n_failed = 0
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        futures = [executor.submit(_harmonize_file, fpath, cfg) for fpath in fpaths]
+        for k, future in enumerate(as_completed(futures)):
+            summary = future.result()
+            if summary['ok']:
+                shape = f'{summary["shape"][1]} x {summary["shape"][0]}'
+                print(f'[{k + 1}/{len(fpaths)}] | OK     | {summary["fpath"]} | {shape} | {summary["template"]}-TYPE | '
+                      f'ALPHA = {summary["alpha"]:6.2f} | F-VALUE = {summary["f_val"]:8.2f} | {summary["elapsed"]:.2f}s | -> {summary["result_path"]}')
+            else:
+                n_failed += 1
+                print(f'[{k + 1}/{len(fpaths)}] | FAILED | {summary["fpath"]} | {summary["elapsed"]:.2f}s | {summary["message"]}')
+    print(f'| DONE | {len(fpaths) - n_failed} succeeded | {n_failed} failed | {time.perf_counter() - start_time:.2f}s |')
+    return EXIT_OK if n_failed == 0 else EXIT_SOME_FAILED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+# benchmark the dedicated grid min-cut solver (flat & coarse-to-fine) against networkx on the graph-cut problems of a test image
+# usage (at the root of the project): python -m benchmarks.bench_max_flow [--widths 32 64 128 256 512 1024] [--nx-max-pixels 20000]
+
+import argparse
+import time
+
+import numpy as np
+
+from color_harmonization.harmonic_template import Template_X
+from color_harmonization.harmonize import (
+    _build_graph_capacities,
+    _find_closest_borders_of_sectors_naively,
+    _solve_min_cut_by_networkx,
+    _solve_min_cut_by_pyramid,
+    LABEL_NOT_MOVING,
+)
+from color_harmonization.max_flow import solve_grid_min_cut
+from utils.general_utils import gut_load_image
+from utils.harmonization_utils import hut_convert_image_into_hsv_w_resizing
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the grid min-cut solver against networkx.')
+    parser.add_argument('--image', default='./resource/test_img/fig1.png')
+    parser.add_argument('--widths', type=int, nargs='+', default=[32, 64, 128, 256, 512, 1024])
+    parser.add_argument('--nx-max-pixels', type=int, default=20000, help='Skip networkx for images larger than this.')
+    parser.add_argument('--alpha', type=float, default=40.)
+    args = parser.parse_args()
+
+    im = gut_load_image(args.image)
+    templ = Template_X()
+    print(f'| {"SHAPE":>12} | {"# PIXELS":>10} | {"NETWORKX":>10} | {"GRID":>10} | {"SPEED-UP":>9} | SAME PARTITION | {"PYRAMID":>10} | SAME MOVING LABELS |')
+    for width in args.widths:
+        _, hsv = hut_convert_image_into_hsv_w_resizing(im, ratio=width / im.shape[1])
+        V, D = _find_closest_borders_of_sectors_naively(hsv, templ, args.alpha)
+        cap_h, cap_v, cap_s, cap_t = _build_graph_capacities(hsv, V, D, _lambda=.5)
+
+        t = time.perf_counter()
+        _, grid_partition = solve_grid_min_cut(cap_h, cap_v, cap_s, cap_t)
+        grid_time = time.perf_counter() - t
+
+        t = time.perf_counter()
+        pyramid_partition = _solve_min_cut_by_pyramid(hsv, V, D, _lambda=.5)
+        pyramid_time = time.perf_counter() - t
+        moving = V != LABEL_NOT_MOVING
+        same_moving = bool(np.array_equal(grid_partition[moving], pyramid_partition[moving]))
+
+        nx_time, same = None, None
+        if hsv.shape[0] * hsv.shape[1] <= args.nx_max_pixels:
+            t = time.perf_counter()
+            _, nx_partition = _solve_min_cut_by_networkx(cap_h, cap_v, cap_s, cap_t)
+            nx_time = time.perf_counter() - t
+            same = bool(np.array_equal(grid_partition, nx_partition))
+
+        shape = f'{hsv.shape[0]} x {hsv.shape[1]}'
+        nx_text = '-' if nx_time is None else f'{nx_time:9.3f}s'
+        speed_up = '-' if nx_time is None else f'{nx_time / grid_time:8.1f}x'
+        print(f'| {shape:>12} | {hsv.shape[0] * hsv.shape[1]:>10,} | {nx_text:>10} | {grid_time:9.3f}s | {speed_up:>9} | {"-" if same is None else same!s:>14} | {pyramid_time:9.3f}s | {same_moving!s:>18} |')
+
+
+if __name__ == '__main__':
+    main()
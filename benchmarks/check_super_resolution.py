@@ -0,0 +1,97 @@
+# check the tiled super resolution & its worker process w/ the stub backend (bicubic interpolation, hence no torch nor the model needed)
+# usage (at the root of the project): python -m benchmarks.check_super_resolution [--image ./resource/test_img/fig1.png] [--outscale 2.5]
+
+import argparse
+from threading import Lock
+import time
+
+import cv2
+import numpy as np
+
+from color_harmonization.super_resolution import StubBackend, SuperResolutionWorker, upscale_tiled
+from utils.general_utils import gut_load_image
+
+
+# the maximal mean absolute difference (in the intensities of [0, 255]) between the tiled & the whole-image results
+MAX_MEAN_ABS_DIFF = 1.
+
+
+# the stub keeping its per-call state on the instance (as RealESRGANer.enhance does), which fails if called concurrently
+class _NonReentrantStubBackend(StubBackend):
+    reentrant = False
+
+    def __init__(self):
+        self._lock = Lock()
+        self.img = None
+        self.n_calls = 0
+        self.max_concurrent_calls = 0
+        self._n_running = 0
+
+    def upscale(self, im, outscale):
+        with self._lock:
+            self._n_running += 1
+            self.max_concurrent_calls = max(self.max_concurrent_calls, self._n_running)
+        self.img = im
+        # give the other threads the chance to overwrite the state
+        time.sleep(.005)
+        sr = super().upscale(self.img, outscale)
+        assert self.img is im, 'The non-reentrant backend is called concurrently.'
+        with self._lock:
+            self._n_running -= 1
+            self.n_calls += 1
+        return sr
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the tiled super resolution & its worker process w/ the stub backend.')
+    parser.add_argument('--image', default='./resource/test_img/fig1.png')
+    parser.add_argument('--outscale', type=float, default=2.5)
+    parser.add_argument('--tile-size', type=int, default=64)
+    parser.add_argument('--tile-overlap', type=int, default=8)
+    args = parser.parse_args()
+
+    im = np.ascontiguousarray(gut_load_image(args.image)[..., : 3])
+    h, w = im.shape[: 2]
+    out_shape = (round(h * args.outscale), round(w * args.outscale),) + im.shape[2:]
+
+    # the tiled result should be (nearly) the same as resizing the whole image, w/o any seams between the tiles
+    expected = cv2.resize(StubBackend().upscale(im, args.outscale), out_shape[1::-1], interpolation=cv2.INTER_LINEAR)
+    out = np.zeros(out_shape, dtype=im.dtype)
+    assert upscale_tiled(StubBackend(), im, out, args.outscale, tile_size=args.tile_size, overlap=args.tile_overlap)
+    diff = np.abs(out.astype(np.float32) - expected).mean()
+    print(f'| TILED | SHAPE = {im.shape} -> {out.shape} | MEAN ABS DIFF = {diff:.3f} |')
+    assert diff <= MAX_MEAN_ABS_DIFF, f'The tiled result differs from the whole-image one by {diff:.3f} on average.'
+
+    # the non-reentrant backend is called one tile at a time, even w/ several threads
+    backend = _NonReentrantStubBackend()
+    serial_out = np.zeros(out_shape, dtype=im.dtype)
+    assert upscale_tiled(backend, im, serial_out, args.outscale, tile_size=args.tile_size, overlap=args.tile_overlap, n_workers=4)
+    assert backend.max_concurrent_calls == 1, f'The non-reentrant backend is called by {backend.max_concurrent_calls} threads concurrently.'
+    assert np.array_equal(serial_out, out), 'The result of the non-reentrant backend differs from the reentrant one.'
+    print(f'| TILED | NON-REENTRANT | # CALLS = {backend.n_calls} | SERIALIZED |')
+
+    # canceled between the tiles
+    assert not upscale_tiled(StubBackend(), im, out, args.outscale, tile_size=args.tile_size, overlap=args.tile_overlap, is_canceled=lambda: True)
+
+    worker = SuperResolutionWorker(backend='stub', tile_size=args.tile_size, tile_overlap=args.tile_overlap)
+    try:
+        t = time.perf_counter()
+        request = worker.submit(im, out_shape, args.outscale)
+        assert request.wait(60.), 'The job of the worker timed out.'
+        assert request.state == 'done', f'The job of the worker ended w/ "{request.state}": {request.error}'
+        assert np.array_equal(request.image, out), 'The result of the worker differs from the tiled one.'
+        print(f'| WORKER | DONE | {time.perf_counter() - t:.2f} SEC (INCL. STARTING THE PROCESS) |')
+
+        # cancel a job right after submitting it (either skipped while queued, or stopped between the tiles)
+        request = worker.submit(im, out_shape, args.outscale)
+        worker.cancel(request)
+        assert request.wait(60.), 'The canceled job of the worker timed out.'
+        assert request.state == 'canceled', f'The canceled job of the worker ended w/ "{request.state}": {request.error}'
+        print('| WORKER | CANCELED |')
+    finally:
+        worker.shutdown()
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+from threading import Lock
+
+import color_harmonization.harmonic_template as harmonic_template
+import color_harmonization.harmonize as harmonize
+from color_harmonization.harmonize import GraphCutState
+from color_harmonization.result_cache import make_cache_key, ResultCache
+from color_harmonization.shared_array import get_shared_array, release_shared_arrays
+
+
+# the default number of worker processes (each one is a single-worker pool, i.e., a shard, cf. submit_computation)
+DEFAULT_N_COMPUTE_WORKERS = os.cpu_count() or 1
+# the maximal number of graph-cut states kept by every worker process (the least-recently-used ones are dropped beyond it)
+WORKER_MAX_GRAPH_CUT_STATES = 4
+
+# the single-worker pools (the shards) of worker processes (created at the first use)
+_POOLS = None
+_POOL_LOCK = Lock()
+
+# the graph-cut states of images kept by the current worker process (keyed by the window names)
+_WORKER_GRAPH_CUT_STATES = OrderedDict()
+# the on-disk cache of the harmonization results (shared by all processes through the files)
+_WORKER_RESULT_CACHE = ResultCache()
+
+
+# get the single-worker pool of a shard (re-created if broken, e.g., its worker process has been killed);
+# the workers are spawned (rather than forked) since the gui process runs several threads
+def get_compute_pool(shard, renew=False):
+    global _POOLS
+    with _POOL_LOCK:
+        if _POOLS is None:
+            _POOLS = [None] * DEFAULT_N_COMPUTE_WORKERS
+        if renew and _POOLS[shard] is not None:
+            _POOLS[shard].shutdown(wait=False, cancel_futures=True)
+            _POOLS[shard] = None
+        if _POOLS[shard] is None:
+            _POOLS[shard] = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        return _POOLS[shard]
+
+
+# shut all pools of worker processes down (the queued computations are canceled)
+def shutdown_compute_pool():
+    global _POOLS
+    with _POOL_LOCK:
+        for pool in _POOLS or []:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        _POOLS = None
+
+
+# submit a computation to a worker process; return the future
+# the computations of the same shard key (e.g., the window name of an image) always go to the same worker, which keeps the graph-cut state of it,
+# at the cost of the balance: the ones whose keys share a shard are queued behind each other even if the other workers are idle
+def submit_computation(fn, *args, shard_key=None, **kwargs):
+    shard = hash(shard_key) % DEFAULT_N_COMPUTE_WORKERS
+    try:
+        return get_compute_pool(shard).submit(fn, *args, **kwargs)
+    except BrokenProcessPool:
+        return get_compute_pool(shard, renew=True).submit(fn, *args, **kwargs)
+
+
+# get the graph-cut state of an image kept by the current worker process (created at the first time),
+# where all computations of an image are routed to the same worker (cf. submit_computation)
+def _get_worker_graph_cut_state(win_name):
+    state = _WORKER_GRAPH_CUT_STATES.pop(win_name, None) or GraphCutState()
+    _WORKER_GRAPH_CUT_STATES[win_name] = state
+    if len(_WORKER_GRAPH_CUT_STATES) > WORKER_MAX_GRAPH_CUT_STATES:
+        _WORKER_GRAPH_CUT_STATES.popitem(last=False)
+    return state
+
+
+# do color harmonization on the arrays (viewing the shared arrays) in a worker process, and write the result into out; return the final visualization
+def _harmonize_arrays(win_name, out, resized_im, hsv, template_type, vis_save_path, result_save_path, raw_im, ref_im, ref_hsv, mask, mode, cache_settings, settings):
+    cache_key = make_cache_key(raw_im if raw_im is not None else resized_im, ref_im=ref_im, mask=mask, mode=mode, **cache_settings, **settings)
+    out[...], final_vis = harmonize.harmonize(
+        resized_im, hsv, harmonic_template.build_template_list(template_type),
+        vis_save_path=vis_save_path,
+        result_save_path=result_save_path,
+        ref_im=ref_im,
+        ref_hsv=ref_hsv,
+        mode=mode,
+        show=False,
+        full_res_im=raw_im,
+        mask=mask,
+        result_cache=_WORKER_RESULT_CACHE,
+        cache_key=cache_key,
+        state=_get_worker_graph_cut_state(win_name),
+        return_final_vis=True,
+        **settings,
+    )
+    return final_vis
+
+
+# do color harmonization in a worker process, where all images are shared arrays (or None's) and the result is written into out,
+# i.e., into the buffer of the gui process directly (the raw image is only needed for the full-resolution result;
+# cache_settings are the other settings in the key of the result cache); return the final visualization (to be shown by the gui process)
+def harmonize_in_worker(
+        win_name,
+        out,
+        resized_im,
+        hsv,
+        template_type,
+        vis_save_path,
+        result_save_path,
+        raw_im=None,
+        ref_im=None,
+        ref_hsv=None,
+        mask=None,
+        mode='normal',
+        cache_settings=None,
+        **settings,
+):
+    shared_list = (out, resized_im, hsv, raw_im, ref_im, ref_hsv, mask,)
+    try:
+        return _harmonize_arrays(
+            win_name, *(get_shared_array(shared) for shared in shared_list[: 3]), template_type, vis_save_path, result_save_path,
+            *(get_shared_array(shared) for shared in shared_list[3:]), mode, cache_settings or dict(), settings)
+    finally:
+        # close the mappings of the worker (the blocks are owned by the gui process)
+        release_shared_arrays(*shared_list)
@@ -1,35 +1,71 @@
-import copy
+import numpy as np
 
 from color_harmonization.harmonic_sector import Sector
-from utils.harmonization_utils import hut_calc_arc_len, hut_canonicalize_deg
+from utils.harmonization_utils import (
+    hut_calc_arc_len,
+    hut_calc_arc_len_array,
+    hut_canonicalize_deg,
+    hut_canonicalize_deg_array,
+    hut_map_template_type,
+)
 
 
 # the base class for harmonic templates
 class HarmonicTemplate_Base:
     def __init__(self):
-        self._sector_list = []
+        # the sectors are stored as compact arrays of their start degrees and ranges
+        self._sector_starts = np.zeros((0,), dtype=np.float64)
+        self._sector_ranges = np.zeros((0,), dtype=np.float64)
     
     def add_sector(self, start_deg, range_deg):
-        self._sector_list.append(Sector(start_deg, range_deg))
+        self._sector_starts = np.append(self._sector_starts, float(start_deg))
+        self._sector_ranges = np.append(self._sector_ranges, float(range_deg))
     
     @property
     def sectors(self):
-        return copy.deepcopy(self._sector_list)
+        return [self.get_sector(idx) for idx in range(self.num_sectors)]
+    
+    # the start degrees of all sectors (w/o the alpha)
+    @property
+    def sector_starts(self):
+        return self._sector_starts.copy()
+    
+    # the ranges of all sectors
+    @property
+    def sector_ranges(self):
+        return self._sector_ranges.copy()
+    
+    @property
+    def num_sectors(self):
+        return len(self._sector_starts)
+    
+    # get the sector by its index (a brand-new object, so the template itself cannot be modified through it)
+    def get_sector(self, idx):
+        return Sector(float(self._sector_starts[idx]), float(self._sector_ranges[idx]))
+    
+    # the centres of arcs of all sectors (w/o the alpha)
+    @property
+    def sector_centres(self):
+        return hut_canonicalize_deg_array(self._sector_starts + (self._sector_ranges / 2.))
+    
+    # the arc-lengths of all sectors
+    @property
+    def sector_arc_lens(self):
+        return hut_calc_arc_len_array(self._sector_ranges)
     
     # check if the given degree w/ an alpha (offset) is in any sectors
     def is_in(self, inp_deg, alpha=0.):
         inp_deg = hut_canonicalize_deg(inp_deg)
-        for sector in self._sector_list:
-            start = sector.get_start_deg() + alpha
-            start = hut_canonicalize_deg(start)
-            end = start + sector.range_deg
+        for idx, (start, range_deg,) in enumerate(zip(self._sector_starts.tolist(), self._sector_ranges.tolist())):
+            start = hut_canonicalize_deg(start + alpha)
+            end = start + range_deg
             if end < 180:
                 if start <= inp_deg <= end:
-                    return True, copy.deepcopy(sector)
+                    return True, self.get_sector(idx)
             else:
                 end = hut_canonicalize_deg(end)
                 if start <= inp_deg or inp_deg <= end:
-                    return True, copy.deepcopy(sector)
+                    return True, self.get_sector(idx)
         return False, None
     
     # obtain the minimal distance and moving direction from the given degree w/ an alpha (offset) to any sectors
@@ -39,10 +75,9 @@ class HarmonicTemplate_Base:
         _is_in, _ = self.is_in(inp_deg, alpha=alpha)
         min_dis = float('inf')
         move_dir = 0
-        for sector in self._sector_list:
-            start = sector.get_start_deg() + alpha
-            start = hut_canonicalize_deg(start)
-            end = start + sector.range_deg
+        for start, range_deg in zip(self._sector_starts.tolist(), self._sector_ranges.tolist()):
+            start = hut_canonicalize_deg(start + alpha)
+            end = start + range_deg
             l_to_start = hut_calc_arc_len(inp_deg, start)
             l_to_end = hut_calc_arc_len(inp_deg, end)
             if l_to_start < min_dis:
@@ -61,21 +96,77 @@ class HarmonicTemplate_Base:
             return 0, sect
         inp_deg = hut_canonicalize_deg(inp_deg)
         min_dis = float('inf')
-        ret_sect = None
-        for sector in self._sector_list:
-            start = sector.get_start_deg() + alpha
-            start = hut_canonicalize_deg(start)
+        ret_idx = None
+        for idx, (start, range_deg,) in enumerate(zip(self._sector_starts.tolist(), self._sector_ranges.tolist())):
+            start = hut_canonicalize_deg(start + alpha)
             # clockwisely
             if move_dir == 1:
                 _dis = 180. - (inp_deg - start) if start < inp_deg else start - inp_deg
             # counterclockwisely
             else: # elif move_dir == 0:
-                end = hut_canonicalize_deg(start + sector.range_deg)
+                end = hut_canonicalize_deg(start + range_deg)
                 _dis = inp_deg - end if end < inp_deg else 180. - (end - inp_deg)
             if _dis < min_dis:
                 min_dis = _dis
-                ret_sect = sector
-        return hut_calc_arc_len(min_dis), copy.deepcopy(ret_sect)
+                ret_idx = idx
+        return hut_calc_arc_len(min_dis), self.get_sector(ret_idx)
+    
+    # get the rotated start degrees and the (un-canonicalized) end degrees of all sectors w/ an alpha (offset)
+    def _get_rotated_borders(self, alpha):
+        starts = hut_canonicalize_deg_array(self._sector_starts + alpha)
+        ends = starts + self._sector_ranges
+        return starts, ends
+    
+    # the array version of is_in:
+    # return the boolean membership and the index of the containing sector (-1 if none) of every given degree
+    def is_in_array(self, inp_degs, alpha=0.):
+        inp_degs = hut_canonicalize_deg_array(inp_degs)[..., np.newaxis]
+        starts, ends = self._get_rotated_borders(alpha)
+        inside = np.where(
+            ends < 180,
+            (starts <= inp_degs) & (inp_degs <= ends),
+            (starts <= inp_degs) | (inp_degs <= hut_canonicalize_deg_array(ends)),
+        )
+        _is_in = np.any(inside, axis=-1)
+        # the first containing sector is taken, which is the same as the scalar version
+        sector_idx = np.where(_is_in, np.argmax(inside, axis=-1), -1)
+        return _is_in, sector_idx
+    
+    # the array version of get_min_dis:
+    # return the minimal distances and the moving directions (-1 or 1) of every given degree
+    def get_min_dis_array(self, inp_degs, alpha=0.):
+        _is_in, _ = self.is_in_array(inp_degs, alpha=alpha)
+        inp_degs = hut_canonicalize_deg_array(inp_degs)[..., np.newaxis]
+        starts, ends = self._get_rotated_borders(alpha)
+        l_to_start = hut_calc_arc_len_array(inp_degs, starts)
+        l_to_end = hut_calc_arc_len_array(inp_degs, ends)
+        # interleave the distances as [start_0, end_0, start_1, end_1, ...] so that ties are broken as the scalar version
+        dis = np.stack((l_to_start, l_to_end,), axis=-1).reshape(*l_to_start.shape[: -1], -1)
+        arg = np.argmin(dis, axis=-1)
+        min_dis = np.take_along_axis(dis, arg[..., np.newaxis], axis=-1)[..., 0]
+        # moving to a start: -1 if inside else 1; moving to an end: 1 if inside else -1
+        move_dir = np.where((arg % 2 == 0) == _is_in, -1, 1).astype(np.int8)
+        return min_dis, move_dir
+    
+    # the array version of find_nearest_sector_by_certain_dir:
+    # return the distances and the indices of the nearest sectors along the given direction(s) (1: clockwise; 0: counterclockwise)
+    def find_nearest_sector_by_certain_dir_array(self, inp_degs, alpha, move_dir):
+        move_dir = np.asarray(move_dir)
+        assert np.all((move_dir == 0) | (move_dir == 1))
+        _is_in, in_sector_idx = self.is_in_array(inp_degs, alpha=alpha)
+        inp_degs = hut_canonicalize_deg_array(inp_degs)[..., np.newaxis]
+        starts, ends = self._get_rotated_borders(alpha)
+        ends = hut_canonicalize_deg_array(ends)
+        # clockwisely
+        dis_cw = np.where(starts < inp_degs, 180. - (inp_degs - starts), starts - inp_degs)
+        # counterclockwisely
+        dis_ccw = np.where(ends < inp_degs, inp_degs - ends, 180. - (ends - inp_degs))
+        dis = np.where(move_dir[..., np.newaxis] == 1, dis_cw, dis_ccw)
+        arg = np.argmin(dis, axis=-1)
+        min_dis = np.take_along_axis(dis, arg[..., np.newaxis], axis=-1)[..., 0]
+        ret_dis = np.where(_is_in, 0., hut_calc_arc_len_array(min_dis))
+        ret_idx = np.where(_is_in, in_sector_idx, arg)
+        return ret_dis, ret_idx
 
 
 # i-type
@@ -153,3 +244,16 @@ class Template_X(HarmonicTemplate_Base):
 
 
 # no N-type implemented (nor discussed in the original paper)
+
+
+# build the list of harmonic templates by the template type (0 - 6: a certain type; 7: AUTO, i.e., all types)
+def build_template_list(template_type):
+    types_list = tuple(range(7)) if template_type == 7 else (template_type,)
+    templ_list = []
+    for _t in types_list:
+        t_type = hut_map_template_type(_t)
+        try:
+            templ_list.append(globals()[f'Template_{t_type}']())
+        except KeyError:
+            print(f'No such template (type-{t_type}) existed.', end='')
+    return templ_list
@@ -1,4 +1,8 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import copy
+import hashlib
+import os
 from pathlib import Path
 from typing import List
 
@@ -8,17 +12,48 @@ import numpy as np
 import scipy
 
 from color_harmonization.harmonic_template import HarmonicTemplate_Base
-from seg import apply_interactive_segmentation
-from utils.general_utils import gut_resize_by_ratio
+from color_harmonization.max_flow import (
+    arrange_grid_capacities,
+    build_flow_graph,
+    build_grid_flow_graph,
+    solve_grid_min_cut,
+    solve_min_cut,
+)
+from color_harmonization.superpixels import compute_superpixels, DEFAULT_N_SUPERPIXELS, get_superpixel_adjacency
+from color_harmonization.template_lut import DEFAULT_ALPHA_RESOLUTION, get_template_lut
+from seg import apply_interactive_segmentation, get_segmentation_visualization
+from utils.general_utils import gut_resize_by_ratio, gut_save_image
 from utils.harmonization_utils import (
     hut_add_opaque_channel,
     hut_calc_arc_len,
+    hut_calc_arc_len_array,
     hut_canonicalize_deg,
+    hut_canonicalize_deg_array,
+    hut_convert_image_into_hsv_w_resizing,
     hut_draw_ring_shaped_histogram,
     hut_visualize_histogram,
 )
 
 
+# the labels of the pre-labelled map V
+LABEL_CCW = 0  # moving counterclockwisely
+LABEL_CW = 1  # moving clockwisely
+LABEL_NOT_MOVING = 2  # already inside a sector
+
+# the "auto" graph-cut backend uses the pyramid (coarse-to-fine) one for images w/ at least this number of pixels
+PYRAMID_MIN_PIXELS = 4_000_000
+# the "auto" graph-cut backend uses the sparse one for images w/ at most this fraction of moving (out-of-sector) pixels
+SPARSE_MAX_MOVING_FRACTION = .5
+# the maximal side length of the coarsest level of the pyramid
+PYRAMID_COARSEST_SIZE = 256
+# the radius of the narrow band around the cut boundary which is re-solved at every finer level
+PYRAMID_BAND_RADIUS = 2
+# the graph-cut state warm-starts the solver from the last flows only if at most this fraction of the pre-labelled map V is changed
+WARM_START_MAX_CHANGED_FRACTION = .25
+# the number of the last cuts kept by the graph-cut state
+GRAPH_CUT_STATE_MAX_CUTS = 8
+
+
 # calculate the histogram of hues from an image in the hsv space
 def _calc_hue_histogram(hsv_im, mask):
     # take out hues only from the hsv space
@@ -34,9 +69,9 @@ def _calc_hue_histogram(hsv_im, mask):
     return hist
 
 
-# do an optimization for finding an alpha value that could minimize the distance
-def _search_alpha_value(hsv, templ: HarmonicTemplate_Base, mask):
-    print('| Searching for ALPHA... ', end='')
+# calculate the saturation-weighted histogram of hues (and the number of counted pixels) from an image in the hsv space
+def _calc_saturation_weighted_hue_histogram(hsv, mask):
+    # take out hues and saturations only from the hsv space
     if mask is None:
         flattened_hsv = hsv.reshape(-1, 3)
     else:
@@ -44,227 +79,844 @@ def _search_alpha_value(hsv, templ: HarmonicTemplate_Base, mask):
         flattened_hsv = hsv[_y, _x].reshape(-1, 3)
     H = flattened_hsv[:, 0]
     S = flattened_hsv[:, 1]
+    # accumulate the saturations into 180 hue-bins (the range of hues is 0 to 180)
+    weighted_hist = np.bincount(H, weights=S, minlength=180)[: 180].astype(np.float64)
+    return weighted_hist, len(H)
+
+
+# evaluate the objective function F(alpha) on all alphas of the grid at once (from the saturation-weighted histogram)
+def _sweep_alpha_values(weighted_hist, n_pixels, templ: HarmonicTemplate_Base, alpha_resolution=DEFAULT_ALPHA_RESOLUTION):
+    lut = get_template_lut(templ, alpha_resolution=alpha_resolution)
+    # the distance-table of the template is not shift-invariant (arc-lengths are not measured around the wheel),
+    # hence F is taken as a product of the [# alphas, 180] table and the histogram rather than a circular correlation
+    f_curve = lut.min_dis @ weighted_hist / max(n_pixels, 1)
+    return lut.alphas, f_curve
+
+
+# evaluate the objective functions of several templates on all alphas of the grid at once,
+# i.e., a single product of the stacked [# templates * # alphas, 180] tables and the histogram
+# return the sampled alphas and the values of the objective functions in [# templates, # alphas]
+def _sweep_alpha_values_of_templates(weighted_hist, n_pixels, templ_list: List[HarmonicTemplate_Base], alpha_resolution=DEFAULT_ALPHA_RESOLUTION):
+    luts = [get_template_lut(templ, alpha_resolution=alpha_resolution) for templ in templ_list]
+    f_curves = np.concatenate([lut.min_dis for lut in luts], axis=0) @ weighted_hist / max(n_pixels, 1)
+    return luts[0].alphas, f_curves.reshape(len(luts), -1)
+
+
+# the objective function F(alpha) of a template on the saturation-weighted histogram
+def _get_objective_function(weighted_hist, n_pixels, templ: HarmonicTemplate_Base, alpha_resolution=DEFAULT_ALPHA_RESOLUTION):
+    hue_bins = np.nonzero(weighted_hist)[0]
+    weights = weighted_hist[hue_bins]
+    lut = get_template_lut(templ, alpha_resolution=alpha_resolution)
+    return lambda alpha: np.dot(lut.get_min_dis_row(alpha)[hue_bins], weights) / max(n_pixels, 1)
+
+
+# refine the best alpha on the grid between its two neighbouring alphas
+def _refine_alpha_value(F, x_root, f_val, alpha_resolution=DEFAULT_ALPHA_RESOLUTION):
+    step = 1. / alpha_resolution
+    res = scipy.optimize.minimize_scalar(F, bounds=(x_root - step, x_root + step,), method='bounded')
+    return res.x if res.fun < f_val else x_root
+
+
+# a lower bound of F(alpha) between the two neighbouring alphas of the best alpha (w/ the value f_val) on the grid,
+# since every distance changes by at most one arc-length unit per degree of alpha, unless a border of sectors crosses the hue 0
+# (where the distances jump as they are not measured around the wheel); -inf if there is such a crossing in between
+def _calc_refinement_lower_bound(weighted_hist, n_pixels, templ: HarmonicTemplate_Base, x_root, f_val, alpha_resolution=DEFAULT_ALPHA_RESOLUTION):
+    step = 1. / alpha_resolution
+    starts, ranges = templ.sector_starts, templ.sector_ranges
+    jump_alphas = np.concatenate((-starts, -(starts + ranges),)) % 180.
+    if np.any(np.abs((jump_alphas - x_root + 90.) % 180. - 90.) <= step):
+        return -np.inf
+    # every alpha in between is at most a half step away from an alpha on the grid, where F is not less than f_val
+    return f_val - hut_calc_arc_len(step / 2.) * np.sum(weighted_hist) / max(n_pixels, 1)
+
+
+# do an optimization for finding an alpha value that could minimize the distance
+# method: "sweep" evaluates all alphas on the grid (& optionally refines the best one locally); "brent" uses brent's method only
+def _search_alpha_value(hsv, templ: HarmonicTemplate_Base, mask, alpha_resolution=DEFAULT_ALPHA_RESOLUTION, method='sweep', refine=True):
+    # since hues are quantized into 180 bins, the objective function F(alpha) = mean(dis(H, alpha) * S) could be
+    # evaluated on the saturation-weighted histogram, i.e., in O(180) instead of O(# pixels)
+    weighted_hist, n_pixels = _calc_saturation_weighted_hue_histogram(hsv, mask)
+    return _search_alpha_value_by_histogram(weighted_hist, n_pixels, templ, alpha_resolution=alpha_resolution, method=method, refine=refine)
+
 
-    F = lambda alpha: np.mean(np.array([templ.get_min_dis(h, alpha)[0] for h in H]) * S)
-    x_root = scipy.optimize.brent(F, brack=(0., 180.,))
+# do the optimization of alpha on the saturation-weighted histogram of hues (cf. _search_alpha_value)
+def _search_alpha_value_by_histogram(
+        weighted_hist, n_pixels, templ: HarmonicTemplate_Base, alpha_resolution=DEFAULT_ALPHA_RESOLUTION, method='sweep', refine=True):
+    assert method in ('sweep', 'brent',), 'The method of the alpha-search must be either "sweep" or "brent".'
+    F = _get_objective_function(weighted_hist, n_pixels, templ, alpha_resolution=alpha_resolution)
+    alpha_curve = None
+    if method == 'sweep':
+        # the global minimum on the grid (the first one, if tied)
+        alpha_curve = _sweep_alpha_values(weighted_hist, n_pixels, templ, alpha_resolution=alpha_resolution)
+        alphas, f_curve = alpha_curve
+        best_idx = int(np.argmin(f_curve))
+        x_root, f_val = float(alphas[best_idx]), float(f_curve[best_idx])
+        # refine it between the two neighbouring alphas on the grid
+        if refine:
+            x_root = _refine_alpha_value(F, x_root, f_val, alpha_resolution=alpha_resolution)
+    else: # elif method == 'brent':
+        x_root = scipy.optimize.brent(F, brack=(0., 180.,))
     x_root = hut_canonicalize_deg(x_root)
     # x_root = scipy.optimize.brentq(F, a=-180., b=180.)
     f_val = F(x_root)
-    print(f'| ALPHA = {x_root:6.2f} (in the range of [0, 180]) | F-VALUE = {f_val:8.2f} |')
-    return x_root, f_val
+    return x_root, f_val, alpha_curve
+
+
+# search for the best alpha of every template and choose the template w/ the minimal objective function value
+# w/ the "sweep" method, all templates are swept at once, and the templates are refined in the ascending order of their minima on the grid,
+# where the ones whose lower bounds cannot beat the best value so far are pruned (i.e., their alphas are kept on the grid)
+# return the best (template, alpha, f-value, alpha-curve) and the (template, alpha, f-value) of all templates
+def _choose_template_by_histogram(
+        weighted_hist, n_pixels, templ_list: List[HarmonicTemplate_Base], alpha_resolution=DEFAULT_ALPHA_RESOLUTION, method='sweep', refine=True):
+    assert method in ('sweep', 'brent',), 'The method of the alpha-search must be either "sweep" or "brent".'
+    if method == 'brent' or len(templ_list) == 1:
+        results = [
+            _search_alpha_value_by_histogram(weighted_hist, n_pixels, templ, alpha_resolution=alpha_resolution, method=method, refine=refine)
+            for templ in templ_list
+        ]
+    else: # elif method == 'sweep':
+        alphas, f_curves = _sweep_alpha_values_of_templates(weighted_hist, n_pixels, templ_list, alpha_resolution=alpha_resolution)
+        # the global minima on the grid (the first ones, if tied)
+        best_idxs = np.argmin(f_curves, axis=1)
+        grid_f_vals = f_curves[np.arange(len(templ_list)), best_idxs]
+        results = [None] * len(templ_list)
+        best_f_val = np.inf
+        for k in np.argsort(grid_f_vals, kind='stable').tolist():
+            templ = templ_list[k]
+            F = _get_objective_function(weighted_hist, n_pixels, templ, alpha_resolution=alpha_resolution)
+            x_root, f_val = float(alphas[best_idxs[k]]), float(grid_f_vals[k])
+            if refine and _calc_refinement_lower_bound(
+                    weighted_hist, n_pixels, templ, x_root, f_val, alpha_resolution=alpha_resolution) <= best_f_val:
+                x_root = _refine_alpha_value(F, x_root, f_val, alpha_resolution=alpha_resolution)
+            x_root = hut_canonicalize_deg(x_root)
+            f_val = F(x_root)
+            best_f_val = min(best_f_val, f_val)
+            results[k] = (x_root, f_val, (alphas, f_curves[k],),)
+
+    candidates = []
+    best = None
+    for templ, (alpha, f_val, alpha_curve,) in zip(templ_list, results):
+        candidates.append((templ, alpha, f_val,))
+        if best is None or f_val < best[2]:
+            best = (templ, alpha, f_val, alpha_curve,)
+    return best, candidates
 
 
 # naively find the closest borders of sectors (without the help of the graph-cut method)
-def _find_closest_borders_of_sectors_naively(hsv, templ: HarmonicTemplate_Base, alpha):
-    # V: the pre-labelled map
-    V = np.full(hsv.shape[: 2], .5, dtype=np.float32)
+def _find_closest_borders_of_sectors_naively(hsv, templ: HarmonicTemplate_Base, alpha, alpha_resolution=DEFAULT_ALPHA_RESOLUTION):
+    # look up the table of all 180 hues w/ this alpha and index it by the hue-plane
+    hue_table = get_template_lut(templ, alpha_resolution=alpha_resolution).get_hue_table(alpha)
+    hues = hsv[:, :, 0]
+    is_in = hue_table.is_in[hues]
+    # V: the pre-labelled map (LABEL_CCW, LABEL_CW, or LABEL_NOT_MOVING)
+    V = np.where(is_in, LABEL_NOT_MOVING, np.where(hue_table.move_dir[hues] == -1, LABEL_CCW, LABEL_CW)).astype(np.uint8)
     # D: the minimal distances corresponding to the labels
-    D = np.full(hsv.shape[: 2], 0., dtype=np.float32)
-    for (y, x,), hue in np.ndenumerate(hsv[:, :, 0]):
-        if not templ.is_in(hue, alpha)[0]:
-            min_dis, move_dir = templ.get_min_dis(hue, alpha)
-            D[y, x] = min_dis
-            V[y, x] = 0 if move_dir == -1 else 1
+    D = np.where(is_in, 0., hue_table.min_dis[hues]).astype(np.float32)
     return V, D
 
 
-def _apply_graph_cut(hsv, templ: HarmonicTemplate_Base, alpha, _lambda, V, D, mask=None):
+# build the weights of all n-links, i.e., max-saturation / hue-distance, which depend on neither the template nor alpha
+# return w_h between (y, x) & (y, x + 1) in [h, w - 1] and w_v between (y, x) & (y + 1, x) in [h - 1, w]
+def _build_n_link_weights(hsv):
+    hues = hsv[:, :, 0]
+    sats = hsv[:, :, 1]
+    w_h = np.maximum(sats[:, 1:], sats[:, : -1]) / (hut_calc_arc_len_array(hues[:, 1:], hues[:, : -1]) + 1e-6)
+    w_v = np.maximum(sats[1:, :], sats[: -1, :]) / (hut_calc_arc_len_array(hues[1:, :], hues[: -1, :]) + 1e-6)
+    return w_h, w_v
 
-    ''' step 1. build a graph '''
-    
-    # construct a graph
+
+# build the capacities of all n-links by the B (E2) function, i.e., label-mismatch * max-saturation / hue-distance
+# return cap_h between (y, x) & (y, x + 1) in [h, w - 1] and cap_v between (y, x) & (y + 1, x) in [h - 1, w]
+def _build_n_link_capacities(hsv, V, n_link_weights=None):
+    w_h, w_v = _build_n_link_weights(hsv) if n_link_weights is None else n_link_weights
+    cap_h = (V[:, 1:] != V[:, : -1]) * w_h
+    cap_v = (V[1:, :] != V[: -1, :]) * w_v
+    return cap_h, cap_v
+
+
+# calculate the K-value, i.e., one plus the maximal sum of capacities of n-links of any node
+def _calc_k_value(cap_h, cap_v):
+    k = np.zeros((cap_v.shape[0] + 1, cap_h.shape[1] + 1,), dtype=np.float64)
+    k[:, 1:] += cap_h
+    k[:, : -1] += cap_h
+    k[1:, :] += cap_v
+    k[: -1, :] += cap_v
+    return np.max(k, initial=0.) + 1.
+
+
+# build the capacities of all links to S and T (t-links), where the not-moving ones are given by the R (E1) function
+def _build_t_link_capacities(hsv, V, D, _lambda, K):
+    e1 = (_lambda * D * hsv[:, :, 1]).astype(np.float64)
+    # move clockwisely: linked to S only; move counterclockwisely: linked to T only; not moving: linked to both by E1
+    cap_s = np.where(V == LABEL_CW, K, np.where(V == LABEL_NOT_MOVING, e1, 0.))
+    cap_t = np.where(V == LABEL_CCW, K, np.where(V == LABEL_NOT_MOVING, e1, 0.))
+    return cap_s, cap_t
+
+
+# build the capacities of all n-links & t-links of the graph for the graph-cut method
+def _build_graph_capacities(hsv, V, D, _lambda, n_link_weights=None):
+    cap_h, cap_v = _build_n_link_capacities(hsv, V, n_link_weights=n_link_weights)
+    K = _calc_k_value(cap_h, cap_v)
+    cap_s, cap_t = _build_t_link_capacities(hsv, V, D, _lambda, K)
+    return cap_h, cap_v, cap_s, cap_t
+
+
+# build the table of new hues in the shape of [180, 2] for a template w/ an alpha,
+# where the second axis is the moving direction decided by the graph-cut (0: counterclockwisely; 1: clockwisely)
+def _build_hue_remap_table(templ: HarmonicTemplate_Base, alpha, alpha_resolution=DEFAULT_ALPHA_RESOLUTION):
+    gaussian_fn = lambda x, mu, sigma: 1. / (np.sqrt(2. * np.pi) * sigma) * np.exp(-np.power((x - mu) / sigma, 2.) / 2.)
+    hue_table = get_template_lut(templ, alpha_resolution=alpha_resolution).get_hue_table(alpha)
+    hues = np.arange(180, dtype=np.float64)
+    remap_table = np.empty((180, 2,), dtype=np.uint8)
+    for move_dir, sector_idx in ((0, hue_table.nearest_sector_idx_ccw,), (1, hue_table.nearest_sector_idx_cw,),):
+        # shift the hue toward the nearest sector along the direction
+        c = templ.sector_centres[sector_idx] + alpha
+        w = templ.sector_arc_lens[sector_idx]
+        g = gaussian_fn(hut_calc_arc_len_array(hues, c), mu=0., sigma=1.)
+        new_hues = np.trunc(c + (w / 2.) * (1. - g))
+        # hues already inside sectors are kept
+        remap_table[:, move_dir] = np.where(hue_table.is_in, hues, hut_canonicalize_deg_array(new_hues)).astype(np.uint8)
+    return remap_table
+
+
+# find the minimum cut by networkx (the reference implementation; slow & memory-consuming for large images)
+def _solve_min_cut_by_networkx(cap_h, cap_v, cap_s, cap_t):
+    h, w = cap_s.shape
     g = nx.DiGraph()
-    # build all n-links
-    for ((y, x,), hue,), ((_, _,), sat,) in zip(np.ndenumerate(hsv[:, :, 0]), np.ndenumerate(hsv[:, :, 1])):
-        id = y * hsv.shape[1] + x
-        g.add_node(id)
-        if y > 0:
-            neighbour_id = (y - 1) * hsv.shape[1] + x
-            # B (E2) function
-            edge_weight = (1 if V[y, x] != V[y - 1, x] else 0) * max(sat, hsv[y - 1, x, 1]) / \
-                            (hut_calc_arc_len(hue, hsv[y - 1, x, 0]) + 1e-6)
-            g.add_edge(id, neighbour_id, capacity=edge_weight)
-            g.add_edge(neighbour_id, id, capacity=edge_weight)
-        if x > 0:
-            neighbour_id = y * hsv.shape[1] + (x - 1)
-            # B (E2) function
-            edge_weight = (1 if V[y, x] != V[y, x - 1] else 0) * max(sat, hsv[y, x - 1, 1]) / \
-                            (hut_calc_arc_len(hue, hsv[y, x - 1, 0]) + 1e-6)
-            g.add_edge(id, neighbour_id, capacity=edge_weight)
-            g.add_edge(neighbour_id, id, capacity=edge_weight)
-    # calculate the K-value
-    capacities = nx.get_edge_attributes(g, 'capacity')
-    K = 0.
-    for (y, x,), hue in np.ndenumerate(hsv[:, :, 0]):
-        id = y * hsv.shape[1] + x
-        edges = g.edges(id)
-        k = sum([capacities[e] for e in edges])
-        if k > K:
-            K = k
-    K += 1.
-    # build all links to S and T
+    g.add_nodes_from(range(h * w))
+    for (y, x,), edge_weight in np.ndenumerate(cap_h):
+        g.add_edge(y * w + x, y * w + x + 1, capacity=edge_weight)
+        g.add_edge(y * w + x + 1, y * w + x, capacity=edge_weight)
+    for (y, x,), edge_weight in np.ndenumerate(cap_v):
+        g.add_edge(y * w + x, (y + 1) * w + x, capacity=edge_weight)
+        g.add_edge((y + 1) * w + x, y * w + x, capacity=edge_weight)
     g.add_node('S')
     g.add_node('T')
-    for (y, x,), hue in np.ndenumerate(hsv[:, :, 0]):
-        id = y * hsv.shape[1] + x
-        # move clockwisely
-        if V[y, x] == 1:
-            edge_weight_S = K
-            edge_weight_T = 0.
-        # move counterclockwisely
-        elif V[y, x] == 0:
-            edge_weight_S = 0.
-            edge_weight_T = K
-        # not moving (V[y, x] == .5)
+    for (y, x,), edge_weight_S in np.ndenumerate(cap_s):
+        g.add_edge('S', y * w + x, capacity=edge_weight_S)
+        g.add_edge(y * w + x, 'T', capacity=cap_t[y, x])
+    cut_value, (reachable, _,) = nx.minimum_cut(g, 'S', 'T')
+    source_side = np.zeros((h * w,), dtype=bool)
+    source_side[[id for id in reachable if id != 'S']] = True
+    return cut_value, source_side.reshape(h, w)
+
+
+# build the capacities of the n-links between the pixels of the flat indices a & b by the B (E2) function (cf. _build_n_link_capacities)
+def _build_n_link_capacities_of_pairs(hues, sats, V, a, b):
+    return (V[a] != V[b]) * np.maximum(sats[a], sats[b]) / (hut_calc_arc_len_array(hues[a], hues[b]) + 1e-6)
+
+
+# solve the min-cut only on a subset of pixels (the sorted flat indices), while all the other pixels are fixed to their sides
+# (the n-links to the fixed pixels become t-links, i.e., to S if the fixed one is at the S-side; otherwise to T)
+# return the sides of the subset of pixels (True: the S-side)
+def _solve_min_cut_on_pixels(hsv, V, D, _lambda, source_side, nodes):
+    h, w = V.shape
+    hues, sats = hsv[:, :, 0].reshape(-1), hsv[:, :, 1].reshape(-1)
+    flat_V, flat_D, flat_side = V.reshape(-1), D.reshape(-1), source_side.reshape(-1)
+    ys, xs = nodes // w, nodes % w
+    n = len(nodes)
+    u, v, cap_uv = [], [], []
+    cap_s_fixed = np.zeros((n,), dtype=np.float64)
+    cap_t_fixed = np.zeros((n,), dtype=np.float64)
+    # the neighbours at the right, the bottom, the left, and the top
+    for valid, offset, counted_by_other in (
+            (xs + 1 < w, 1, False,), (ys + 1 < h, w, False,), (xs > 0, -1, True,), (ys > 0, -w, True,),):
+        owners = np.flatnonzero(valid)
+        neighbours = nodes[owners] + offset
+        pos = np.minimum(np.searchsorted(nodes, neighbours), n - 1)
+        in_band = nodes[pos] == neighbours
+        caps = _build_n_link_capacities_of_pairs(hues, sats, flat_V, nodes[owners], neighbours)
+        # the n-links inside the band (the ones to the left & the top are already counted by the neighbours)
+        if not counted_by_other:
+            u.append(owners[in_band])
+            v.append(pos[in_band])
+            cap_uv.append(caps[in_band])
+        # the n-links to the fixed pixels
+        fixed = ~in_band
+        to_s = flat_side[neighbours[fixed]]
+        np.add.at(cap_s_fixed, owners[fixed][to_s], caps[fixed][to_s])
+        np.add.at(cap_t_fixed, owners[fixed][~to_s], caps[fixed][~to_s])
+    u, v, cap_uv = np.concatenate(u), np.concatenate(v), np.concatenate(cap_uv)
+
+    # the K-value of the sub-graph, i.e., one plus the maximal sum of capacities of n-links of any node
+    degree = np.bincount(u, weights=cap_uv, minlength=n) + np.bincount(v, weights=cap_uv, minlength=n) + cap_s_fixed + cap_t_fixed
+    K = np.max(degree, initial=0.) + 1.
+    # the t-links by the R (E1) function (cf. _build_t_link_capacities)
+    band_V = flat_V[nodes]
+    e1 = _lambda * flat_D[nodes].astype(np.float64) * sats[nodes]
+    cap_s = np.where(band_V == LABEL_CW, K, np.where(band_V == LABEL_NOT_MOVING, e1, 0.)) + cap_s_fixed
+    cap_t = np.where(band_V == LABEL_CCW, K, np.where(band_V == LABEL_NOT_MOVING, e1, 0.)) + cap_t_fixed
+
+    graph = build_flow_graph(n, u, v)
+    _, nodes_side = solve_min_cut(graph, graph.arrange_capacities(cap_uv), cap_s, cap_t)
+    return nodes_side
+
+
+# re-solve the min-cut only inside a band of pixels, while all pixels outside the band are fixed to their sides
+def _solve_min_cut_in_band(hsv, V, D, _lambda, source_side, band):
+    nodes = np.flatnonzero(band)
+    ret = source_side.copy()
+    ret.reshape(-1)[nodes] = _solve_min_cut_on_pixels(hsv, V, D, _lambda, source_side, nodes)
+    return ret
+
+
+# find the minimum cut only on the connected components of the moving (out-of-sector) pixels plus a one-pixel border,
+# since the not-moving pixels elsewhere have neither t-links (D = 0) nor n-links (the same labels) and are put at the S-side directly
+# (the components are exactly independent; they are grouped by sizes & solved in parallel)
+def _solve_min_cut_by_components(hsv, V, D, _lambda, n_workers=None):
+    h, w = V.shape
+    source_side = np.ones((h, w,), dtype=bool)
+    region = cv2.dilate((V != LABEL_NOT_MOVING).astype(np.uint8), cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3,)))
+    n_components, comp_labels, stats, _ = cv2.connectedComponentsWithStats(region, connectivity=4)
+    if n_components <= 1:
+        return source_side
+
+    # distribute the components (the label 0 is the background) into groups w/ similar numbers of pixels
+    n_workers = n_workers or os.cpu_count() or 1
+    sizes = stats[1:, cv2.CC_STAT_AREA]
+    n_groups = min(n_workers, n_components - 1)
+    group_of_comp = np.zeros((n_components,), dtype=np.int64)
+    group_sizes = np.zeros((n_groups,), dtype=np.int64)
+    for comp in np.argsort(-sizes, kind='stable') + 1:
+        g = int(np.argmin(group_sizes))
+        group_of_comp[comp] = g
+        group_sizes[g] += sizes[comp - 1]
+    flat_comp_labels = comp_labels.reshape(-1)
+    pixels = np.flatnonzero(flat_comp_labels)
+    groups_of_pixels = group_of_comp[flat_comp_labels[pixels]]
+    nodes_list = [pixels[groups_of_pixels == g] for g in range(n_groups)]
+
+    # solve all groups (in parallel)
+    solve_fn = lambda nodes: _solve_min_cut_on_pixels(hsv, V, D, _lambda, source_side, nodes)
+    if n_groups == 1:
+        sides_list = [solve_fn(nodes_list[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=n_groups) as executor:
+            sides_list = list(executor.map(solve_fn, nodes_list))
+    for nodes, sides in zip(nodes_list, sides_list):
+        source_side.reshape(-1)[nodes] = sides
+    return source_side
+
+
+# find the minimum cut on the adjacency graph of superpixels instead of the pixel grid, and broadcast the sides back to pixels
+# (every superpixel is represented by its saturation-weighted circular mean hue & its mean saturation, and then pre-labelled by them;
+# the n-links are weighted by the lengths of the shared boundaries, and the t-links by the numbers of pixels)
+def _solve_min_cut_by_superpixels(hsv, templ: HarmonicTemplate_Base, alpha, _lambda, alpha_resolution=DEFAULT_ALPHA_RESOLUTION, n_superpixels=DEFAULT_N_SUPERPIXELS):
+    sp_labels = compute_superpixels(hsv, n_segments=n_superpixels)
+    flat_sp_labels = sp_labels.reshape(-1)
+    n = int(flat_sp_labels.max()) + 1
+    counts = np.bincount(flat_sp_labels, minlength=n)
+
+    # the representative hsv of every superpixel (in the shape of [1, # superpixels, 3] as an image)
+    theta = hsv[:, :, 0].reshape(-1).astype(np.float64) * (2. * np.pi / 180.)
+    sats = hsv[:, :, 1].reshape(-1).astype(np.float64)
+    mean_theta = np.arctan2(
+        np.bincount(flat_sp_labels, weights=sats * np.sin(theta), minlength=n),
+        np.bincount(flat_sp_labels, weights=sats * np.cos(theta), minlength=n),
+    )
+    sp_hsv = np.zeros((1, n, 3,), dtype=np.uint8)
+    sp_hsv[0, :, 0] = np.round(mean_theta * (180. / (2. * np.pi))).astype(np.int64) % 180
+    sp_hsv[0, :, 1] = np.round(np.bincount(flat_sp_labels, weights=sats, minlength=n) / counts).astype(np.uint8)
+
+    # pre-label the superpixels and build the graph of them
+    sp_V, sp_D = _find_closest_borders_of_sectors_naively(sp_hsv, templ, alpha, alpha_resolution=alpha_resolution)
+    a, b, boundary_lens = get_superpixel_adjacency(sp_labels)
+    cap_ab = boundary_lens * _build_n_link_capacities_of_pairs(sp_hsv[0, :, 0], sp_hsv[0, :, 1], sp_V[0], a, b)
+    degree = np.bincount(a, weights=cap_ab, minlength=n) + np.bincount(b, weights=cap_ab, minlength=n)
+    K = np.max(degree, initial=0.) + 1.
+    cap_s, cap_t = _build_t_link_capacities(sp_hsv, sp_V, sp_D * counts, _lambda, K)
+
+    graph = build_flow_graph(n, a, b)
+    _, sp_side = solve_min_cut(graph, graph.arrange_capacities(cap_ab), cap_s.reshape(-1), cap_t.reshape(-1))
+    return sp_side[sp_labels]
+
+
+# find the minimum cut in a coarse-to-fine manner: solve the whole graph at the coarsest level of a pyramid (by sub-sampling),
+# then at every finer level, re-solve only inside a narrow band around the boundary of the upsampled cut
+# (hence the solving time & memory are roughly linear to the length of the boundary instead of the number of pixels)
+def _solve_min_cut_by_pyramid(hsv, V, D, _lambda, coarsest_size=PYRAMID_COARSEST_SIZE, band_radius=PYRAMID_BAND_RADIUS):
+    h, w = V.shape
+    n_levels = 0
+    while max(h, w) > coarsest_size * (2 ** n_levels):
+        n_levels += 1
+
+    # solve the coarsest level entirely
+    step = 2 ** n_levels
+    coarse_hsv, coarse_V, coarse_D = hsv[:: step, :: step], V[:: step, :: step], D[:: step, :: step]
+    cap_h, cap_v, cap_s, cap_t = _build_graph_capacities(coarse_hsv, coarse_V, coarse_D, _lambda)
+    _, source_side = solve_grid_min_cut(cap_h, cap_v, cap_s, cap_t)
+
+    # refine level by level
+    kernel = np.ones((2 * band_radius + 1, 2 * band_radius + 1,), dtype=np.uint8)
+    for level in range(n_levels - 1, -1, -1):
+        step = 2 ** level
+        level_V = V[:: step, :: step]
+        lh, lw = level_V.shape
+        source_side = np.repeat(np.repeat(source_side, 2, axis=0), 2, axis=1)[: lh, : lw]
+        # the band around the boundary of the cut, and around the pixels which contradict their hard-constraints
+        # (e.g., the small regions missed at the coarser level)
+        boundary = ((level_V == LABEL_CW) & ~source_side) | ((level_V == LABEL_CCW) & source_side)
+        boundary = boundary.astype(np.uint8)
+        diff_h = source_side[:, 1:] != source_side[:, : -1]
+        diff_v = source_side[1:, :] != source_side[: -1, :]
+        boundary[:, 1:] |= diff_h
+        boundary[:, : -1] |= diff_h
+        boundary[1:, :] |= diff_v
+        boundary[: -1, :] |= diff_v
+        band = cv2.dilate(boundary, kernel).astype(bool)
+        if np.any(band):
+            source_side = _solve_min_cut_in_band(hsv[:: step, :: step], level_V, D[:: step, :: step], _lambda, source_side, band)
+    return source_side
+
+
+# the intermediate state of the graph-cut of an image, which is kept between the runs w/ different settings (e.g., lambda, the template, or alpha):
+# the n-link weights & the flow network only depend on the image, the cuts of the last few solves are kept by their capacities,
+# and the (grid) solver is warm-started from the flows of the last solve if the pre-labelled map V is not changed much
+class GraphCutState:
+    def __init__(self):
+        self.hsv = None
+        self.n_link_weights = None
+        self.graph = None
+        # the basis image & the mask of the cached saturation-weighted histogram of hues
+        self._hist_basis_hsv = None
+        self._hist_mask = None
+        self._hist = None
+        # the cuts (the S-sides) of the last solves, keyed by the hashes of their capacities (the least-recently-used one first)
+        self._cuts = OrderedDict()
+        # the pre-labelled map & the flows of the last solve
+        self._V = None
+        self._flows = None
+
+    # bind the state to an image in the hsv space (everything kept is dropped if it is another image)
+    def bind(self, hsv):
+        if self.hsv is not None and self.hsv.shape == hsv.shape and np.array_equal(self.hsv, hsv):
+            return
+        self.__init__()
+        h, w = hsv.shape[: 2]
+        self.hsv = hsv.copy()
+        self.n_link_weights = _build_n_link_weights(hsv)
+        self.graph = build_grid_flow_graph(h, w)
+
+    # get the saturation-weighted histogram of hues of the basis image w/ the mask (re-computed only if either one is changed)
+    def get_weighted_histogram(self, basis_hsv, mask):
+        if self._hist is None or \
+                not _is_same_array(self._hist_basis_hsv, basis_hsv) or not _is_same_array(self._hist_mask, mask):
+            self._hist_basis_hsv = basis_hsv.copy()
+            self._hist_mask = None if mask is None else mask.copy()
+            self._hist = _calc_saturation_weighted_hue_histogram(basis_hsv, mask)
+        return self._hist
+
+    # find the minimum cut of the bound image w/ the pre-labelled map V, the distances D & lambda; return the S-side in [h, w]
+    def solve_min_cut(self, V, D, _lambda):
+        h, w = self.hsv.shape[: 2]
+        cap_h, cap_v, cap_s, cap_t = _build_graph_capacities(self.hsv, V, D, _lambda, n_link_weights=self.n_link_weights)
+        caps = (arrange_grid_capacities(self.graph, cap_h, cap_v), cap_s.reshape(-1), cap_t.reshape(-1),)
+        key = hashlib.blake2b(b''.join(memoryview(np.ascontiguousarray(cap)).cast('B') for cap in caps), digest_size=16).digest()
+        if key in self._cuts:
+            self._cuts.move_to_end(key)
+            return self._cuts[key].reshape(h, w)
+
+        warm = self._V is not None and np.count_nonzero(self._V != V) <= WARM_START_MAX_CHANGED_FRACTION * V.size
+        _, source_side, self._flows = solve_min_cut(
+            self.graph, *caps, init_flows=(self._flows if warm else None), return_flows=True)
+        self._V = V.copy()
+        self._cuts[key] = source_side
+        if len(self._cuts) > GRAPH_CUT_STATE_MAX_CUTS:
+            self._cuts.popitem(last=False)
+        return source_side.reshape(h, w)
+
+
+# check if two arrays (or None's) are the same
+def _is_same_array(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return a.shape == b.shape and np.array_equal(a, b)
+
+
+# backend: "grid" uses the dedicated grid min-cut solver; "networkx" uses networkx.minimum_cut;
+#          "sparse" solves only on the components of moving pixels (the same cut as "grid"); "pyramid" solves coarse-to-fine (for huge images);
+#          "superpixel" solves on the adjacency graph of superpixels (a few thousands of nodes, at the cost of the precision of boundaries);
+#          "auto" uses the pyramid one for images w/ >= PYRAMID_MIN_PIXELS pixels, or the sparse one for mostly harmonic images, or the grid one
+# state: the graph-cut state bound to the image, if given, the grid & the sparse backends (which give the same cut) are replaced by
+#        the grid solver warm-started from the state, while the other ones (e.g., the pyramid one chosen by "auto" for huge images) ignore it
+# return the new image in the hsv space & the label map of the moving directions (LABEL_CCW, LABEL_CW, or LABEL_NOT_MOVING)
+def _apply_graph_cut(
+        hsv, templ: HarmonicTemplate_Base, alpha, _lambda, V, D, mask=None, backend='grid', alpha_resolution=DEFAULT_ALPHA_RESOLUTION, state=None):
+    assert backend in ('grid', 'networkx', 'sparse', 'pyramid', 'superpixel', 'auto',), \
+        'The graph-cut backend must be either "grid", "networkx", "sparse", "pyramid", "superpixel", or "auto".'
+    h, w = hsv.shape[: 2]
+    if backend == 'auto':
+        if h * w >= PYRAMID_MIN_PIXELS:
+            backend = 'pyramid'
+        elif np.count_nonzero(V != LABEL_NOT_MOVING) <= SPARSE_MAX_MOVING_FRACTION * h * w:
+            backend = 'sparse'
         else:
-            # R (E1) function
-            edge_weight_S = _lambda * D[y, x] * hsv[y, x, 1]
-            edge_weight_T = edge_weight_S
-        g.add_edge('S', id, capacity=edge_weight_S)
-        g.add_edge(id, 'T', capacity=edge_weight_T)
+            backend = 'grid'
+
+    if state is not None and backend in ('grid', 'sparse',):
+        # re-use the kept parts of the graph & warm-start from the previous flows
+        reachable = state.solve_min_cut(V, D, _lambda)
+    elif backend == 'pyramid':
+        # build the (sub-)graphs level by level & exert min-cut algorithm on them
+        reachable = _solve_min_cut_by_pyramid(hsv, V, D, _lambda)
+    elif backend == 'sparse':
+        # build the sub-graphs of the components of moving pixels & exert min-cut algorithm on them
+        reachable = _solve_min_cut_by_components(hsv, V, D, _lambda)
+    elif backend == 'superpixel':
+        # build the graph of superpixels & exert min-cut algorithm on it
+        reachable = _solve_min_cut_by_superpixels(hsv, templ, alpha, _lambda, alpha_resolution=alpha_resolution)
+    else:
+        ''' step 1. build a graph '''
     
-    ''' Step 2. exert min-cut algorithm '''
+        cap_h, cap_v, cap_s, cap_t = _build_graph_capacities(hsv, V, D, _lambda)
     
-    print(f'| Start MIN-CUT... |')
-    cut_value, partition = nx.minimum_cut(g, 'S', 'T')
-    # S is in reachable (clockwise-moving); T is in non-reachable (counterclockwise-moving)
-    reachable, non_reachable = partition
-    # cutset = set()
-    # for u, nbrs in ((n, g[n]) for n in reachable):
-    #     cutset.update((u, v) for v in nbrs if v in non_reachable)
-    print(f'Reachable     -> {len(reachable)}')
-    print(f'Non-reachable -> {len(non_reachable)}')
+        ''' Step 2. exert min-cut algorithm '''
+    
+        if backend == 'grid':
+            cut_value, reachable = solve_grid_min_cut(cap_h, cap_v, cap_s, cap_t)
+        else: # elif backend == 'networkx':
+            cut_value, reachable = _solve_min_cut_by_networkx(cap_h, cap_v, cap_s, cap_t)
+    # reachable: the S-side (clockwise-moving); otherwise: the T-side (counterclockwise-moving)
 
     ''' Step 3. do color-shifting '''
-    gaussian_fn = lambda x, mu, sigma: 1. / (np.sqrt(2. * np.pi) * sigma) * np.exp(-np.power((x - mu) / sigma, 2.) / 2.)
-    ret_hsv = copy.deepcopy(hsv)
-    for (y, x,), hue in np.ndenumerate(hsv[:, :, 0]):
-        if mask is not None and mask[y, x] == 1:
-            continue
-        if templ.is_in(hue, alpha)[0]:
-            continue
-        id = y * hsv.shape[1] + x
-        assert (id in reachable) ^ (id in non_reachable)
-        if id in reachable:
-            _, sect = templ.find_nearest_sector_by_certain_dir(hue, alpha, move_dir=1)
-        if id in non_reachable:
-            _, sect = templ.find_nearest_sector_by_certain_dir(hue, alpha, move_dir=0)
-        
-        c = sect.centre_of_arc + alpha
-        w = sect.arc_len
-        g = gaussian_fn(hut_calc_arc_len(hue, c), mu=0., sigma=1.)
-
-        new_hue = int(c + (w / 2.) * (1. - g))
-        ret_hsv[y, x, 0] = new_hue
     
-    return ret_hsv
+    # look up the new hues by the hues and the sides of the cut (0: the T-side; 1: the S-side)
+    remap_table = _build_hue_remap_table(templ, alpha, alpha_resolution=alpha_resolution)
+    new_hues = remap_table[hsv[:, :, 0], reachable.astype(np.uint8)]
+    labels = np.where(V == LABEL_NOT_MOVING, LABEL_NOT_MOVING, np.where(reachable, LABEL_CW, LABEL_CCW)).astype(np.uint8)
+    ret_hsv = hsv.copy()
+    if mask is None:
+        ret_hsv[:, :, 0] = new_hues
+    else:
+        ret_hsv[:, :, 0] = np.where(mask == 1, hsv[:, :, 0], new_hues)
+        labels[mask == 1] = LABEL_NOT_MOVING
+    
+    return ret_hsv, labels
 
 
-# do color harmonization on an image in the hsv space with a specific harmonic template
-def harmonize(
+# the result of a color harmonization process
+class HarmonizationResult:
+    def __init__(self, image, hsv, template, alpha, f_val, labels, candidates, alpha_curve, raw_im, raw_hsv, ref_im, basis_hsv, mask, alpha_resolution):
+        # the harmonized image (bgr) & the harmonized one in the hsv space
+        self.image = image
+        self.hsv = hsv
+        # the chosen template, the rotation (alpha) of it, and the value of the objective function w/ them
+        self.template = template
+        self.alpha = alpha
+        self.f_val = f_val
+        # the label map of the moving directions (LABEL_CCW, LABEL_CW, or LABEL_NOT_MOVING) in [h, w]
+        self.labels = labels
+        # the (template, alpha, f-value) of all tried templates
+        self.candidates = candidates
+        # the sampled alphas & the values of the objective function of the chosen template (None if not swept)
+        self.alpha_curve = alpha_curve
+        # the raw image (& in the hsv space), the reference image (None if not given), the image in the hsv space whose hues are harmonized to, and the mask
+        self.raw_im = raw_im
+        self.raw_hsv = raw_hsv
+        self.ref_im = ref_im
+        self._basis_hsv = basis_hsv
+        self.mask = mask
+        self.alpha_resolution = alpha_resolution
+        self._raw_hue_hist = None
+        self._new_hue_hist = None
+
+    # the histogram of hues which are harmonized to (computed on the first access)
+    @property
+    def raw_hue_hist(self):
+        if self._raw_hue_hist is None:
+            self._raw_hue_hist = _calc_hue_histogram(self._basis_hsv, mask=self.mask)
+        return self._raw_hue_hist
+
+    # the histogram of hues of the harmonized image (computed on the first access)
+    @property
+    def new_hue_hist(self):
+        if self._new_hue_hist is None:
+            self._new_hue_hist = _calc_hue_histogram(cv2.cvtColor(self.image, cv2.COLOR_BGR2HSV), mask=None)
+        return self._new_hue_hist
+
+
+# do color harmonization on an image w/ the best one of the harmonic templates (w/o any side-effects, i.e., no logs, windows, or files)
+# mask: the pixels w/ mask == 1 are the ones harmonized to (of the reference image, if given) and are kept unchanged (of the raw image, if no reference)
+# state: the graph-cut state kept for the image between runs, if given (cf. GraphCutState)
+def harmonize_image(
         raw_im,
-        hsv,
         templ_list: List[HarmonicTemplate_Base],
-        vis_save_path,
-        result_save_path,
+        hsv=None,
+        mask=None,
         ref_im=None,
         ref_hsv=None,
         _lambda=.5,
-        mode='normal',
-        **_,
+        alpha_resolution=DEFAULT_ALPHA_RESOLUTION,
+        alpha_search='sweep',
+        refine_alpha=True,
+        graph_cut_backend='auto',
+        state: GraphCutState = None,
 ):
-    assert mode in ('background', 'foreground', 'normal',), 'The processing mode must be either "normal", "background", or "foreground".'
+    assert len(templ_list) > 0, 'At least one harmonic template is needed.'
+    if hsv is None:
+        hsv = cv2.cvtColor(raw_im, cv2.COLOR_BGR2HSV)
+    if ref_im is not None and ref_hsv is None:
+        ref_hsv = cv2.cvtColor(ref_im, cv2.COLOR_BGR2HSV)
+    basis_hsv = hsv if ref_hsv is None else ref_hsv
 
-    vis_save_path = Path(vis_save_path)
-    vis_parent, vis_stem, vis_ext = vis_save_path.parent, vis_save_path.stem, vis_save_path.suffix
-
-    mask = None
-    if mode != 'normal':
-        mask = apply_interactive_segmentation(
-            raw_im if ref_im is None else ref_im,
-            mode=mode,
-            win_name=f'{vis_stem}{vis_ext}',
-            plotout=True,
-        )
-    if mode == 'foreground':
-        mask = 1 - mask
-    
-    
-    # get the histogram on hues (hue: 0 - 180, sat: 0 - 255, val: 0 - 255,)
-    if ref_im is None:
-        hue_hist = _calc_hue_histogram(hsv, mask=mask)
-    else:
-        hue_hist = _calc_hue_histogram(ref_hsv, mask=mask)
+    if state is not None:
+        state.bind(hsv)
 
-    # search for the best alpha (and the best template, if the template-type is AUTO)
-    best_alpha, best_templ, min_objective_f_value = 0., None, float('inf')
-    for templ in templ_list:
-        if len(templ_list) > 1:
-            print(f'| TRYING THE TEMPLATE: {templ}-TYPE... |')
-        if ref_im is None:
-            alpha, f_val = _search_alpha_value(hsv, templ, mask=mask)
-        else:
-            alpha, f_val = _search_alpha_value(ref_hsv, templ, mask=mask)
-        if f_val < min_objective_f_value:
-            best_alpha = alpha
-            best_templ = templ
-            min_objective_f_value = f_val
-    alpha = best_alpha
-    templ = best_templ
-    if len(templ_list) > 1:
-        print(f'| The best alpha is {alpha:.2f} from the template {templ}-type w/ the minimal objective function value of {min_objective_f_value:.2f} |')
-    if ref_im is None:
-        hut_visualize_histogram(hue_hist, templ, 0., raw_im, save_path=str(vis_parent / f'{vis_stem}_1-raw{vis_ext}'), show=False)
-        hut_visualize_histogram(hue_hist, templ, alpha, raw_im, save_path=str(vis_parent / f'{vis_stem}_2-sectors-rotated{vis_ext}'), show=False)
-    else:
-        hut_visualize_histogram(hue_hist, templ, 0., ref_im, save_path=str(vis_parent / f'{vis_stem}_1-raw{vis_ext}'), show=False)
-        hut_visualize_histogram(hue_hist, templ, alpha, ref_im, save_path=str(vis_parent / f'{vis_stem}_2-sectors-rotated{vis_ext}'), show=False)
+    # search for the best alpha (and the best template, if there're several templates)
+    weighted_hist, n_pixels = _calc_saturation_weighted_hue_histogram(basis_hsv, mask) if state is None else \
+        state.get_weighted_histogram(basis_hsv, mask)
+    (templ, alpha, f_val, alpha_curve,), candidates = _choose_template_by_histogram(
+        weighted_hist, n_pixels, templ_list, alpha_resolution=alpha_resolution, method=alpha_search, refine=refine_alpha)
 
     # pre-select the nearest borders of sectors
-    V, D = _find_closest_borders_of_sectors_naively(hsv, templ, alpha)
-    print('0.5', np.where(V == .5)[0].__len__())
-    print('  0', np.where(V == 0)[0].__len__())
-    print('  1', np.where(V == 1)[0].__len__())
-    print('all', np.prod(V.shape))
+    V, D = _find_closest_borders_of_sectors_naively(hsv, templ, alpha, alpha_resolution=alpha_resolution)
 
     # optimize the color-shifting with the help of the graph-cut image segmentation method
-    new_hsv = _apply_graph_cut(hsv, templ, alpha, _lambda, V, D, mask=(mask if ref_im is None else None))
+    new_hsv, labels = _apply_graph_cut(
+        hsv, templ, alpha, _lambda, V, D, mask=(mask if ref_hsv is None else None),
+        backend=graph_cut_backend, alpha_resolution=alpha_resolution, state=state)
 
     # re-construct the color-harmonized image
     new_im = cv2.cvtColor(new_hsv, cv2.COLOR_HSV2BGR)
-    ret_im = copy.deepcopy(new_im)
-    new_hsv = cv2.cvtColor(new_im, cv2.COLOR_BGR2HSV)
-    new_hue_hist = _calc_hue_histogram(new_hsv, mask=None)
-    hut_visualize_histogram(new_hue_hist, templ, alpha, new_im, save_path=str(vis_parent / f'{vis_stem}_3-harmonized{vis_ext}'), show=False)
+    return HarmonizationResult(
+        new_im, new_hsv, templ, alpha, f_val, labels, candidates, alpha_curve, raw_im, hsv, ref_im, basis_hsv, mask, alpha_resolution)
 
-    # do visualization
+
+# upsample the label map solved at a low resolution to a high resolution, guided by the hues of the high-resolution image,
+# i.e., every moving pixel is voted by the 2x2 nearest low-resolution moving pixels, weighted by the bilinear weights & the similarities of hues
+# (the pixels w/o any voters, or w/ tied votes, fall back to the naive labels V)
+def _upsample_labels(labels, low_hues, high_hues, V, hue_sigma=8.):
+    h, w = labels.shape
+    H, W = high_hues.shape
+    # the coordinates of the high-resolution pixels on the low-resolution grid
+    fy = np.clip((np.arange(H) + .5) * h / H - .5, 0., h - 1.)
+    fx = np.clip((np.arange(W) + .5) * w / W - .5, 0., w - 1.)
+    y0, x0 = np.floor(fy).astype(np.int64), np.floor(fx).astype(np.int64)
+    y1, x1 = np.minimum(y0 + 1, h - 1), np.minimum(x0 + 1, w - 1)
+    wy, wx = fy - y0, fx - x0
+    votes = np.zeros((H, W,), dtype=np.float64)
+    high_hues = high_hues.astype(np.float64)
+    for ys, wys in ((y0, 1. - wy,), (y1, wy,),):
+        for xs, wxs in ((x0, 1. - wx,), (x1, wx,),):
+            voter_labels = labels[np.ix_(ys, xs)]
+            hue_dis = np.abs(low_hues[np.ix_(ys, xs)].astype(np.float64) - high_hues)
+            hue_dis = np.minimum(hue_dis, 180. - hue_dis)
+            weights = np.outer(wys, wxs) * np.exp(-np.square(hue_dis / hue_sigma) / 2.)
+            # clockwise votes are positive; counterclockwise ones are negative; not-moving ones do not vote
+            votes += np.where(voter_labels == LABEL_CW, weights, np.where(voter_labels == LABEL_CCW, -weights, 0.))
+    ret = np.where(votes > 0., LABEL_CW, np.where(votes < 0., LABEL_CCW, V)).astype(np.uint8)
+    ret[V == LABEL_NOT_MOVING] = LABEL_NOT_MOVING
+    return ret
+
+
+# apply a harmonization result solved at a low resolution to the image at a high (e.g., the original) resolution,
+# i.e., the template, alpha, and the upsampled labels are reused, and the hue-remapping is done on the high-resolution pixels
+def apply_harmonization_result(result: HarmonizationResult, high_res_im):
+    high_res_im, high_hsv = hut_convert_image_into_hsv_w_resizing(high_res_im)
+    templ, alpha, alpha_resolution = result.template, result.alpha, result.alpha_resolution
+    H, W = high_hsv.shape[: 2]
+
+    # upsample the label map
+    V, _ = _find_closest_borders_of_sectors_naively(high_hsv, templ, alpha, alpha_resolution=alpha_resolution)
+    labels = _upsample_labels(result.labels, result.raw_hsv[:, :, 0], high_hsv[:, :, 0], V)
+    mask, basis_hsv = result.mask, result._basis_hsv
+    if result.ref_im is None:
+        basis_hsv = high_hsv
+        if mask is not None:
+            mask = cv2.resize(mask, (W, H,), interpolation=cv2.INTER_NEAREST)
+            labels[mask == 1] = LABEL_NOT_MOVING
+
+    # do color-shifting on the high-resolution pixels
+    hues = high_hsv[:, :, 0]
+    remap_table = _build_hue_remap_table(templ, alpha, alpha_resolution=alpha_resolution)
+    new_hsv = high_hsv.copy()
+    new_hsv[:, :, 0] = np.where(labels == LABEL_NOT_MOVING, hues, remap_table[hues, (labels == LABEL_CW).astype(np.uint8)])
+    new_im = cv2.cvtColor(new_hsv, cv2.COLOR_HSV2BGR)
+    return HarmonizationResult(
+        new_im, new_hsv, templ, alpha, result.f_val, labels, result.candidates, result.alpha_curve,
+        high_res_im, high_hsv, result.ref_im, basis_hsv, mask, alpha_resolution)
+
+
+# print the logs of a harmonization result
+def log_harmonization_result(result: HarmonizationResult):
+    for templ, alpha, f_val in result.candidates:
+        print(f'| {templ}-TYPE | ALPHA = {alpha:6.2f} (in the range of [0, 180]) | F-VALUE = {f_val:8.2f} |')
+    if len(result.candidates) > 1:
+        print(f'| The best alpha is {result.alpha:.2f} from the template {result.template}-type '
+              f'w/ the minimal objective function value of {result.f_val:.2f} |')
+    print('NOT-MOVING', np.count_nonzero(result.labels == LABEL_NOT_MOVING))
+    print('       CCW', np.count_nonzero(result.labels == LABEL_CCW))
+    print('        CW', np.count_nonzero(result.labels == LABEL_CW))
+    print('       ALL', result.labels.size)
+
+
+# render the visualizations of a harmonization result:
+# the raw histogram, the one w/ the rotated sectors, the harmonized one, and the final comparison of them
+def render_harmonization_visualizations(result: HarmonizationResult):
+    templ, alpha = result.template, result.alpha
+    basis_im = result.raw_im if result.ref_im is None else result.ref_im
+    hue_hist, new_hue_hist = result.raw_hue_hist, result.new_hue_hist
+    vis_dict = {
+        '1-raw': hut_visualize_histogram(hue_hist, templ, 0., basis_im, show=False),
+        '2-sectors-rotated': hut_visualize_histogram(hue_hist, templ, alpha, basis_im, show=False),
+        '3-harmonized': hut_visualize_histogram(new_hue_hist, templ, alpha, result.image, show=False),
+    }
+
+    # stack the histograms w/ the images
     raw_hist_vis = hut_draw_ring_shaped_histogram(hue_hist, templ, alpha)
     new_hist_vis = hut_draw_ring_shaped_histogram(new_hue_hist, templ, alpha)
-    vis_h = max(raw_im.shape[0], 400)
+    new_im = result.image
+    vis_h = max(basis_im.shape[0], 400)
     ratio = vis_h / raw_hist_vis.shape[0]
     raw_hist_vis = gut_resize_by_ratio(raw_hist_vis, ratio=ratio)
     new_hist_vis = gut_resize_by_ratio(new_hist_vis, ratio=ratio)
-    if ref_im is None:
-        if vis_h != raw_im.shape[0]:
-            raw_im = cv2.resize(raw_im, (int(raw_hist_vis.shape[0] / raw_im.shape[0] * raw_im.shape[1]), raw_hist_vis.shape[0],))
-            new_im = cv2.resize(new_im, (int(raw_hist_vis.shape[0] / new_im.shape[0] * new_im.shape[1]), raw_hist_vis.shape[0],))
-        raw_im = hut_add_opaque_channel(raw_im)
-    else:
-        if vis_h != ref_im.shape[0]:
-            ref_im = cv2.resize(ref_im, (int(raw_hist_vis.shape[0] / ref_im.shape[0] * ref_im.shape[1]), raw_hist_vis.shape[0],))
-            new_im = cv2.resize(new_im, (int(raw_hist_vis.shape[0] / new_im.shape[0] * new_im.shape[1]), raw_hist_vis.shape[0],))
-        ref_im = hut_add_opaque_channel(ref_im)
+    if vis_h != basis_im.shape[0]:
+        basis_im = cv2.resize(basis_im, (int(raw_hist_vis.shape[0] / basis_im.shape[0] * basis_im.shape[1]), raw_hist_vis.shape[0],))
+    # the harmonized image might be at another resolution (e.g., the full one) than the basis image
+    if new_im.shape[: 2] != basis_im.shape[: 2]:
+        new_im = cv2.resize(new_im, (basis_im.shape[1], basis_im.shape[0],))
+    basis_im = hut_add_opaque_channel(basis_im)
     new_im = hut_add_opaque_channel(new_im)
-    final_vis = np.vstack((
-        np.hstack((raw_hist_vis, raw_im if ref_im is None else ref_im,)),
-        hut_add_opaque_channel(np.zeros((10, raw_hist_vis.shape[1] + (raw_im.shape[1] if ref_im is None else ref_im.shape[1]), 3,), dtype=np.uint8)),
+    vis_dict['4-final'] = np.vstack((
+        np.hstack((raw_hist_vis, basis_im,)),
+        hut_add_opaque_channel(np.zeros((10, raw_hist_vis.shape[1] + basis_im.shape[1], 3,), dtype=np.uint8)),
         np.hstack((new_hist_vis, new_im,)),
     ))
-    cv2.imwrite(str(vis_parent / f'{vis_stem}_4-final{vis_ext}'), final_vis)
-    cv2.imshow('Result', final_vis)
-    # cv2.waitKey(0)
+    return vis_dict
+
+
+# save the visualizations of a harmonization result as "{stem}_{name}{ext}" beside the given path (raise OSError if failed)
+def save_harmonization_visualizations(result: HarmonizationResult, vis_save_path):
+    vis_save_path = Path(vis_save_path)
+    vis_parent, vis_stem, vis_ext = vis_save_path.parent, vis_save_path.stem, vis_save_path.suffix
+    vis_dict = render_harmonization_visualizations(result)
+    for name, vis in vis_dict.items():
+        gut_save_image(vis_parent / f'{vis_stem}_{name}{vis_ext}', vis)
+    return vis_dict
+
+
+# save the harmonized image of a harmonization result (raise OSError if failed)
+def save_harmonization_result(result: HarmonizationResult, result_save_path):
+    gut_save_image(result_save_path, result.image)
+
+
+# get the mask of the pixels harmonized to by the processing mode (None for the normal mode)
+# (the foreground is segmented interactively, unless the bounding box of it is given)
+def get_harmonization_mask(raw_im, mode, ref_im=None, win_name='', show=True, seg_rect=None):
+    assert mode in ('background', 'foreground', 'normal',), 'The processing mode must be either "normal", "background", or "foreground".'
+    if mode == 'normal':
+        return None
+    mask = apply_interactive_segmentation(
+        raw_im if ref_im is None else ref_im,
+        mode=mode,
+        win_name=win_name,
+        plotout=show,
+        rect=seg_rect,
+    )
+    if mode == 'foreground':
+        mask = 1 - mask
+    return mask
+
+
+# get the visualization of the mask of a processing mode (cf. get_harmonization_mask), i.e., the segmentation of the image (or the reference one)
+def render_harmonization_mask_visualization(raw_im, mode, mask, ref_im=None):
+    return get_segmentation_visualization(raw_im if ref_im is None else ref_im, 1 - mask if mode == 'foreground' else mask, mode)
+
+
+# restore a harmonization result from a cached one (cf. result_cache.py) w/ the same inputs as harmonize_image (& apply_harmonization_result)
+def restore_harmonization_result(
+        cached, raw_im, hsv=None, mask=None, ref_im=None, ref_hsv=None, alpha_resolution=DEFAULT_ALPHA_RESOLUTION, full_res_im=None):
+    raw_im, raw_hsv = hut_convert_image_into_hsv_w_resizing(raw_im) if hsv is None else (raw_im, hsv,)
+    if ref_im is not None and ref_hsv is None:
+        ref_im, ref_hsv = hut_convert_image_into_hsv_w_resizing(ref_im)
+    if full_res_im is not None:
+        raw_im, raw_hsv = hut_convert_image_into_hsv_w_resizing(full_res_im)
+        if ref_im is None and mask is not None:
+            mask = cv2.resize(mask, (raw_hsv.shape[1], raw_hsv.shape[0],), interpolation=cv2.INTER_NEAREST)
+    basis_hsv = raw_hsv if ref_im is None else ref_hsv
+    return HarmonizationResult(
+        cached.image, cv2.cvtColor(cached.image, cv2.COLOR_BGR2HSV), cached.template, cached.alpha, cached.f_val, cached.labels,
+        cached.candidates, cached.alpha_curve, raw_im, raw_hsv, ref_im, basis_hsv, mask, alpha_resolution)
+
+
+# do color harmonization on an image in the hsv space with a specific harmonic template
+# (the segmentation, the logs, the visualizations, and the result are all done as well; use harmonize_image for the computation only)
+# full_res_im: if given, the harmonization solved on the (resized) raw image is applied to it, and the result is at its resolution
+# mask: the mask of the processing mode, if already segmented (otherwise it is segmented here)
+# result_cache & cache_key: if given, the result is looked up in (& stored into) the cache w/ the key instead of being computed
+# state: the graph-cut state kept for the image between runs, if given (cf. GraphCutState)
+# return_final_vis: return the final visualization as well (e.g., to be shown by the caller instead of w/ show)
+def harmonize(
+        raw_im,
+        hsv,
+        templ_list: List[HarmonicTemplate_Base],
+        vis_save_path,
+        result_save_path,
+        ref_im=None,
+        ref_hsv=None,
+        _lambda=.5,
+        mode='normal',
+        alpha_resolution=DEFAULT_ALPHA_RESOLUTION,
+        alpha_search='sweep',
+        refine_alpha=True,
+        graph_cut_backend='auto',
+        seg_rect=None,
+        show=True,
+        full_res_im=None,
+        mask=None,
+        result_cache=None,
+        cache_key=None,
+        state=None,
+        return_final_vis=False,
+        **_,
+):
+    assert mode in ('background', 'foreground', 'normal',), 'The processing mode must be either "normal", "background", or "foreground".'
+
+    if mask is None:
+        mask = get_harmonization_mask(raw_im, mode, ref_im=ref_im, win_name=Path(vis_save_path).name, show=show, seg_rect=seg_rect)
+
+    # look up the cache
+    cached = None if result_cache is None else result_cache.get(cache_key)
+    if cached is not None:
+        print(f'| LOADED FROM THE RESULT CACHE ({cache_key}) |')
+        result = restore_harmonization_result(
+            cached, raw_im, hsv=hsv, mask=mask, ref_im=ref_im, ref_hsv=ref_hsv, alpha_resolution=alpha_resolution, full_res_im=full_res_im)
+        log_harmonization_result(result)
+    else:
+        # do the computation
+        if len(templ_list) > 1:
+            print(f'| TRYING THE TEMPLATES: {", ".join(f"{templ}-TYPE" for templ in templ_list)}... |')
+        print(f'| Searching for ALPHA & start MIN-CUT ({graph_cut_backend})... |')
+        result = harmonize_image(
+            raw_im, templ_list,
+            hsv=hsv,
+            mask=mask,
+            ref_im=ref_im,
+            ref_hsv=ref_hsv,
+            _lambda=_lambda,
+            alpha_resolution=alpha_resolution,
+            alpha_search=alpha_search,
+            refine_alpha=refine_alpha,
+            graph_cut_backend=graph_cut_backend,
+            state=state,
+        )
+        log_harmonization_result(result)
+        # apply it to the image at the full resolution, if given
+        if full_res_im is not None:
+            result = apply_harmonization_result(result, full_res_im)
+            print(f'| APPLIED TO THE FULL RESOLUTION | SHAPE = {result.hsv.shape} |')
+        if result_cache is not None:
+            result_cache.put(
+                cache_key, result.image, result.labels, result.template, result.alpha, result.f_val, result.candidates, result.alpha_curve)
+
+    # do visualization
+    vis_dict = save_harmonization_visualizations(result, vis_save_path)
+    if show:
+        cv2.imshow('Result', vis_dict['4-final'])
     
     # save the result
-    cv2.imwrite(str(result_save_path), ret_im)
+    save_harmonization_result(result, result_save_path)
 
-    return ret_im
+    if return_final_vis:
+        return copy.deepcopy(result.image), vis_dict['4-final']
+    return copy.deepcopy(result.image)
@@ -0,0 +1,152 @@
+from enum import Enum
+import heapq
+import itertools
+import os
+from threading import Condition, Event, Lock, Thread
+
+
+# the priorities of jobs (the smaller, the earlier): the ones of the selected (foreground) images go before the batch ones
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+# the default number of workers
+DEFAULT_MAX_WORKERS = os.cpu_count() or 1
+
+
+# the states of a job
+class JobState(Enum):
+    QUEUED = 'Queued'
+    RUNNING = 'Running'
+    DONE = 'Done'
+    CANCELED = 'Canceled'
+    FAILED = 'Failed'
+
+
+# raised (by Job.check_canceled) inside a running job which has been canceled
+class JobCanceledError(Exception):
+    pass
+
+
+# a job submitted to the scheduler, whose target is called w/ the job itself as the first argument,
+# so that it could report its progress & check whether it has been canceled (the cancellation of a running job is cooperative)
+class Job:
+    def __init__(self, job_id, priority, name, target, args, kwargs, on_progress=None):
+        self.job_id = job_id
+        self.priority = priority
+        self.name = name
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        # the callback of the progress (a fraction in [0, 1] & a message), which is called from the worker thread
+        self.on_progress = on_progress
+        self.state = JobState.QUEUED
+        self.result = None
+        self.exception = None
+        self._canceled = Event()
+        self._finished = Event()
+        self._lock = Lock()
+
+    @property
+    def is_canceled(self):
+        return self._canceled.is_set()
+
+    # cancel the job; return True if it is canceled before running (otherwise it stops at its next check, if still running)
+    def cancel(self):
+        with self._lock:
+            self._canceled.set()
+            if self.state != JobState.QUEUED:
+                return False
+            self.state = JobState.CANCELED
+        self._finished.set()
+        return True
+
+    # raise JobCanceledError if the job has been canceled (called by the target at its checkpoints)
+    def check_canceled(self):
+        if self._canceled.is_set():
+            raise JobCanceledError(f'The job {self.name} has been canceled.')
+
+    # report the progress of the job (called by the target)
+    def report_progress(self, progress, msg=''):
+        if self.on_progress is not None:
+            self.on_progress(int(round(progress * 100.)), msg)
+
+    # wait until the job is finished (done, canceled, or failed); return False if timed out
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def _run(self):
+        with self._lock:
+            if self.state != JobState.QUEUED:
+                return
+            self.state = JobState.RUNNING
+        try:
+            self.result = self.target(self, *self.args, **self.kwargs)
+            self.state = JobState.DONE
+        except JobCanceledError:
+            self.state = JobState.CANCELED
+        except BaseException as e:
+            self.exception = e
+            self.state = JobState.FAILED
+        finally:
+            self._finished.set()
+
+    def __lt__(self, other):
+        return (self.priority, self.job_id,) < (other.priority, other.job_id,)
+
+
+# the scheduler of jobs w/ a bounded pool of worker threads & a priority queue
+# (the workers are started on demand & kept as daemons)
+class JobScheduler:
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        assert max_workers > 0, 'The number of workers must be positive.'
+        self.max_workers = max_workers
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = Condition()
+        self._workers = []
+        self._n_idle = 0
+        self._running = set()
+        self._shutdown = False
+
+    # the number of queued (not yet running) jobs
+    @property
+    def n_pending(self):
+        with self._cond:
+            return sum(1 for job in self._queue if job.state == JobState.QUEUED)
+
+    # submit a job calling target(job, *args, **kwargs); return the job
+    def submit(self, target, *args, priority=PRIORITY_BATCH, name='', on_progress=None, **kwargs):
+        with self._cond:
+            assert not self._shutdown, 'The scheduler has been shut down.'
+            job = Job(next(self._counter), priority, name, target, args, kwargs, on_progress=on_progress)
+            heapq.heappush(self._queue, job)
+            if len(self._queue) > self._n_idle and len(self._workers) < self.max_workers:
+                worker = Thread(target=self._work, name=f'job-worker-{len(self._workers)}', daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._cond.notify()
+        return job
+
+    # stop accepting jobs & cancel all queued ones (the running ones are canceled as well if cancel_running)
+    def shutdown(self, cancel_running=False):
+        with self._cond:
+            self._shutdown = True
+            jobs = list(self._queue) + (list(self._running) if cancel_running else [])
+            self._queue.clear()
+            self._cond.notify_all()
+        for job in jobs:
+            job.cancel()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._n_idle += 1
+                while not self._queue and not self._shutdown:
+                    self._cond.wait()
+                self._n_idle -= 1
+                if not self._queue:
+                    return
+                job = heapq.heappop(self._queue)
+                self._running.add(job)
+            job._run()
+            with self._cond:
+                self._running.discard(job)
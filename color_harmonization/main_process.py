@@ -1,3 +1,4 @@
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import os
 from pathlib import Path
 from threading import Lock
@@ -6,20 +7,35 @@ from threading import Lock
 from collections.abc import Callable
 
 import cv2
+import numpy as np
 from PyQt5 import QtCore
 
-import color_harmonization.harmonic_template as harmonic_template
+from color_harmonization.compute_pool import harmonize_in_worker, shutdown_compute_pool, submit_computation
 import color_harmonization.harmonize as harmonize
+from color_harmonization.job_scheduler import JobCanceledError, JobScheduler, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from color_harmonization.shared_array import release_shared_arrays, SharedArray
+from color_harmonization.super_resolution import SuperResolutionWorker
+from color_harmonization.template_lut import DEFAULT_ALPHA_RESOLUTION
 from enums.colors import Colors
 from enums.process_status import ProcessStatus
 from loaded_image_obj import LoadedImagesDict
+from seg import get_segmentation_window_name
 from ui.qt_ui.global_config_panel.global_config_panel import GlobalConfigPanel
-from utils.general_utils import gut_load_image
-from utils.harmonization_utils import hut_convert_image_into_hsv_w_resizing, hut_map_template_type, TEMPL_TYPES_MAPPING
+from utils.general_utils import gut_get_output_fname, gut_load_image, gut_read_image_metadata
+from utils.harmonization_utils import (
+    hut_load_reference_image_w_resizing,
+    hut_map_template_type,
+)
 
 
-# the thread lock
-_PROCESS_LOCK = Lock()
+# the lock for the interactive segmentation, since its windows (& key-waitings) could not be shared by several jobs at once
+_SEGMENTATION_LOCK = Lock()
+# the scheduler of the loading & the harmonization jobs, where the latter prepare the inputs & wait for the computations in the worker processes
+_SCHEDULER = JobScheduler()
+# the interval (in seconds) of checking the cancellation while waiting for a computation
+COMPUTATION_POLL_INTERVAL = .1
+# the long-lived worker process of the super resolution (started at the first job)
+_SR_WORKER = SuperResolutionWorker()
 
 
 # the dummy function for singaling when the harmonization process is done
@@ -27,140 +43,290 @@ def dummy_func():
     pass
 
 
-class ProcessThread(QtCore.QThread):
+# the signals of the harmonization jobs of a loaded image
+# (created in the gui thread, hence the signals emitted by the workers are handled in the gui thread)
+class ProcessSignals(QtCore.QObject):
     signal_process_done = QtCore.pyqtSignal(ProcessStatus, str, tuple, type(dummy_func))
+    # the progress (in percentage) & the message of the current step
+    signal_progress = QtCore.pyqtSignal(int, str)
 
-    def __init__(self, parent, target, args, kwargs):
-        super().__init__(parent)
-        self.target = target
-        self.args = args
-        self.kwargs = kwargs
-    
-    def run(self):
-        self.target(
-            self,
-            *self.args,
-            **self.kwargs,
+
+# stop the scheduler & all worker processes (when the application is closed)
+def shutdown_processes():
+    _SCHEDULER.shutdown(cancel_running=True)
+    _SR_WORKER.shutdown()
+    shutdown_compute_pool()
+
+
+# submit a loading job of an image file to the scheduler, i.e., decode it in a worker thread; return the job
+# reduction: decode it at the scale of 1/reduction (cf. gut_load_image)
+def submit_loading_process(win_name, fpath, signals, reduction=1, source_text='local', priority=PRIORITY_INTERACTIVE):
+    return _SCHEDULER.submit(
+        do_loading_process, win_name, fpath, signals,
+        priority=priority,
+        name=f'{win_name} (loading)',
+        on_progress=signals.signal_progress.emit,
+        reduction=reduction,
+        source_text=source_text,
+    )
+
+
+# decode an image file & add it into the loaded images w/ its pyramid (as a job of the scheduler, cf. submit_loading_process)
+def do_loading_process(job, win_name, fpath, signals, reduction=1, source_text='local'):
+    try:
+        job.report_progress(0., 'decoding')
+        img = gut_load_image(fpath, reduction=reduction)
+        if img is None:
+            raise ValueError('It is not a legal image.')
+        job.check_canceled()
+        job.report_progress(.8, 'building the preview')
+        LoadedImagesDict.add_processed_image(win_name, img)
+        # keep the true size of the source for the full-resolution harmonization & the super resolution (from its header, w/o decoding it)
+        if reduction != 1:
+            metadata = gut_read_image_metadata(fpath)
+            source_size = metadata['size'] if metadata is not None else (img.shape[1] * reduction, img.shape[0] * reduction,)
+            LoadedImagesDict.update_source(win_name, fpath, reduction=reduction, source_size=source_size)
+        job.report_progress(1., 'done')
+        reduction_text = '' if reduction == 1 else f' (decoded at the scale of 1/{reduction}, while the full-resolution & the SR\'d outputs keep the size of the file)'
+        signals.signal_process_done.emit(
+            ProcessStatus.LOADED,
+            f'The image <i>{fpath}</i> has been loaded from {source_text}{reduction_text}.',
+            Colors.LOG_LOAD_IMAGE,
+            dummy_func,
         )
+    except JobCanceledError:
+        raise
+    except BaseException as e:
+        signals.signal_process_done.emit(
+            ProcessStatus.ERROR,
+            f'Failed to load the image <i>{fpath}</i>: {e}',
+            Colors.LOG_ERROR,
+            dummy_func,
+        )
+
 
+# submit a harmonization job of a loaded image to the scheduler; return the job (for the cancellation)
+def submit_process(win_name, img, signals, mode, priority=PRIORITY_BATCH, **process_cfg):
+    return _SCHEDULER.submit(
+        do_process, win_name, img, signals, mode,
+        priority=priority,
+        name=win_name,
+        on_progress=signals.signal_progress.emit,
+        **process_cfg,
+    )
+
+
+# wait for a computation in a worker process while checking whether the job is canceled
+# (a canceled computation which has been started cannot be interrupted, hence it is left to finish & its result is dropped)
+def _wait_for_computation(job, future):
+    reported_running = False
+    while True:
+        try:
+            return future.result(timeout=COMPUTATION_POLL_INTERVAL)
+        except FutureTimeoutError:
+            pass
+        if not reported_running and future.running():
+            job.report_progress(.3, 'harmonizing')
+            reported_running = True
+        if job.is_canceled:
+            future.cancel()
+            job.check_canceled()
 
-# start doing the color harmonization process
-def do_process(curr_thread, win_name, img, widget, mode, resize_ratio, template_type, ref_im_fpath=None):
+
+# start doing the color harmonization process (as a job of the scheduler, cf. submit_process)
+# full_resolution: solve on the resized image but apply the harmonization to the original one, i.e., no need to do super resolution afterward
+# (the original one is re-decoded at the full scale of its source if it is loaded at a reduced scale)
+# resize_ratio: relative to the loaded image, hence the outputs are named by the ratio relative to the source
+# (the result is looked up in the result cache first by the contents of the images & all settings)
+def do_process(job, win_name, img, signals, mode, resize_ratio, template_type, ref_im_fpath=None, full_resolution=False, _lambda=.5):
     assert mode in ('background', 'foreground', 'normal',), 'The processing mode must be either "normal", "background", or "foreground".'
     if img is None:
         return
-    if widget.process_status in (ProcessStatus.ERROR, ProcessStatus.LOADING, ProcessStatus.PROCESSING,):
-        return
-    # acquire the lock and release it after finishing the task (before the key-waiting)
-    if _PROCESS_LOCK.locked():
-        curr_thread.signal_process_done.emit(
-            ProcessStatus.WAITING,
-            f'Waiting for another harmonization done for the selected one <i>{win_name}</i>.',
-            Colors.LOG_WARNING,
+    try:
+        ''' start '''
+
+        print(f'| PROCESS | {win_name} | {mode} | {img.shape} | {resize_ratio:.2f} | {template_type} | LAMBDA = {_lambda:.2f} | FULL-RES = {full_resolution} |')
+        signals.signal_process_done.emit(
+            ProcessStatus.PROCESSING,
+            f'The process of the loaded image <i>{win_name}</i> has been started.',
+            Colors.LOG_GENERAL,
             dummy_func,
         )
-    with _PROCESS_LOCK:
+
+        ''' harmonize '''
+        
+        job.report_progress(0., 'preparing')
+        # get the resized image & its hsv one from the pyramid of the image (resized from its nearest level, if not cached)
+        resized_im, hsv = LoadedImagesDict.get_resized_image_w_hsv(win_name, resize_ratio)
+        if ref_im_fpath is not None:
+            ref_im, ref_hsv = hut_load_reference_image_w_resizing(ref_im_fpath, (resized_im.shape[1], resized_im.shape[0],))
+            print(f'| REF = {ref_im_fpath} | ', end='')
+        else:
+            ref_im, ref_hsv = None, None
+            print(f'| REF = NONE | ', end='')
+
+        print(f'| SHAPE (AFT RSZ) = {hsv.shape} | '
+              f'# PIXELS = {hsv.shape[0] * hsv.shape[1]} | TEMPLATE-TYPE = {hut_map_template_type(template_type)} |')
+        
+        # tackle w/ paths
+        reduction = LoadedImagesDict.get_decoding_reduction(win_name)
+        fname = gut_get_output_fname(win_name, resize_ratio / reduction, template_type, full_resolution=full_resolution)
+        save_res_path = Path(GlobalConfigPanel.save_res_dir, fname)
+        save_vis_path = Path(GlobalConfigPanel.save_vis_dir, fname)
+        save_res_path.parent.mkdir(parents=True, exist_ok=True)
+        save_vis_path.parent.mkdir(parents=True, exist_ok=True)
+        LoadedImagesDict.update_save_path(win_name, str(save_res_path))
+
+        # segment the image (if needed) first, since the mask is a part of the key of the result cache
+        # (the interactive segmentation is done by one job at a time, and its visualization is shown w/ the result by the gui thread)
+        if mode != 'normal':
+            job.report_progress(.1, 'segmenting')
+            with _SEGMENTATION_LOCK:
+                job.check_canceled()
+                mask = harmonize.get_harmonization_mask(resized_im, mode, ref_im=ref_im, win_name=save_vis_path.name, show=False)
+            seg_vis = harmonize.render_harmonization_mask_visualization(resized_im, mode, mask, ref_im=ref_im)
+        else:
+            mask, seg_vis = None, None
+        settings = dict(
+            _lambda=_lambda,
+            alpha_resolution=DEFAULT_ALPHA_RESOLUTION,
+            alpha_search='sweep',
+            refine_alpha=True,
+            # the graph-cut states of the images warm-start the grid solver when only some settings are changed,
+            # unless "auto" chooses the pyramid backend for a huge image (cf. _apply_graph_cut)
+            graph_cut_backend='auto',
+        )
+
+        # do color harmonization in a worker process w/ all images passed through the shared memory, and the result written into a buffer
+        # shared w/ this process (the result window is shown by the gui thread when done)
+        job.check_canceled()
+        if full_resolution and reduction != 1:
+            job.report_progress(.15, 'decoding at the full scale')
+            img = LoadedImagesDict.get_source_image(win_name)
+            job.check_canceled()
+        job.report_progress(.2, 'waiting for a worker')
+        out = SharedArray((img if full_resolution else resized_im).shape[: 2] + (3,), np.uint8)
+        inputs = [SharedArray.from_array(arr) for arr in (resized_im, hsv, img if full_resolution else None, ref_im, ref_hsv, mask,)]
         try:
-            ''' start '''
-
-            print(f'| PROCESS | {win_name} | {mode} | {img.shape} | {resize_ratio:.2f} | {template_type} |')
-            widget.notify_status_change(ProcessStatus.PROCESSING)
-
-            ''' harmonize '''
-            
-            # convert the image into hsv color space also apply resizing
-            resized_im, hsv = hut_convert_image_into_hsv_w_resizing(img, ratio=resize_ratio)
-            if ref_im_fpath is not None:
-                ref_im = gut_load_image(ref_im_fpath)
-                ref_im = cv2.resize(ref_im, (resized_im.shape[1], resized_im.shape[0],))
-                ref_im, ref_hsv = hut_convert_image_into_hsv_w_resizing(ref_im)
-                print(f'| REF = {ref_im_fpath} | ', end='')
-            else:
-                ref_im, ref_hsv = None, None
-                print(f'| REF = NONE | ', end='')
-
-            # choose a harmonic template
-            types_list = tuple(range(7)) if template_type == 7 else (template_type,)
-            templ_list = []
-            for _t in types_list:
-                t_type = hut_map_template_type(_t)
-                try:
-                    templ_list.append(getattr(harmonic_template, f'Template_{t_type}')())
-                except AttributeError:
-                    print(f'No such template (type-{t_type}) existed.', end='')
-            
-            print(f'| SHAPE (AFT RSZ) = {hsv.shape} | '
-                  f'# PIXELS = {hsv.shape[0] * hsv.shape[1]} | TEMPLATE-TYPE = {"AUTO" if template_type == 7 else t_type} |')
-            
-            # tackle w/ paths
-            fname = f'{Path(win_name).stem}_ratio={resize_ratio:.2f}_type={template_type}{Path(win_name).suffix}'
-            save_res_path = Path(GlobalConfigPanel.save_res_dir, fname)
-            save_vis_path = Path(GlobalConfigPanel.save_vis_dir, fname)
-            save_res_path.parent.mkdir(parents=True, exist_ok=True)
-            save_vis_path.parent.mkdir(parents=True, exist_ok=True)
-            LoadedImagesDict.update_save_path(win_name, str(save_res_path))
-
-            # do color harmonization
-            harmonized = harmonize.harmonize(
-                resized_im, hsv, templ_list,
+            future = submit_computation(
+                harmonize_in_worker,
+                win_name, out, inputs[0], inputs[1], template_type,
+                # all computations of the image go to the same worker, which keeps its graph-cut state
+                shard_key=win_name,
                 vis_save_path=save_vis_path,
                 result_save_path=save_res_path,
-                ref_im=ref_im,
-                ref_hsv=ref_hsv,
+                raw_im=inputs[2],
+                ref_im=inputs[3],
+                ref_hsv=inputs[4],
+                mask=inputs[5],
                 mode=mode,
+                cache_settings=dict(resize_ratio=resize_ratio, template_type=template_type, full_resolution=full_resolution),
+                **settings,
             )
-            # update the processed image
-            LoadedImagesDict.update_processed_image(win_name, harmonized)
-            print()
-            print('=====================================================')
-            print()
-            
-            ''' done '''
-
-            curr_thread.signal_process_done.emit(
-                ProcessStatus.DONE,
-                f'The process of the loaded image <i>{win_name}</i> has been done.',
-                Colors.LOG_PROCESS_DONE,
-                dummy_func,
-            )
-
-            # set the mouse callback to activate some user events
-            # cv2.setMouseCallback(win_name, mouse_callback, (win_name, widget,))
-        except BaseException as e:
-            curr_thread.signal_process_done.emit(
-                ProcessStatus.ERROR,
-                f'Error happened when processing color harmonization on the image <i>{win_name}</i>: {e}',
-                Colors.LOG_ERROR,
-                dummy_func,
-            )
-    # wait for user's action to keep the cv-window
-    cv2.waitKey(0)
-
-
-# start doing the super resolution process
-# (this process cannot be executed parallelly with the harmonization process within the same image; thus no thread lock needed)
-def do_super_resolution_process(curr_thread, win_name, done_callback, resize_ratio, **_):
-    # deal w/ paths
-    saved_path = Path(LoadedImagesDict.get_save_path(win_name))
-    sr_out_dir = str(saved_path.parent)
-    sr_out_path = os.path.join(sr_out_dir, f'{saved_path.stem}_sr{saved_path.suffix}')
-    # update the save-path of the sr'd image
-    LoadedImagesDict.update_sr_out_path(win_name, sr_out_path)
-    # determine the outscale
-    outscale = int(1. / resize_ratio) + 1
-    # apply super resolution
-    return_code = os.system(f'python ./Real-ESRGAN/inference_realesrgan.py -n RealESRGAN_x4plus -i \"{str(saved_path)}\" -o \"{sr_out_dir}\" -s {outscale} --suffix sr --fp32 ')
-    if return_code == 0:
-        # make sure the sr'd image has the same size as the raw one
-        sr, raw = gut_load_image(sr_out_path), LoadedImagesDict.get_original_image(win_name)
-        if sr.shape != raw.shape:
-            sr = cv2.resize(sr, (raw.shape[1], raw.shape[0],))
-            cv2.imwrite(sr_out_path, sr)
-        sr, raw = gut_load_image(sr_out_path), LoadedImagesDict.get_original_image(win_name)
+            final_vis = _wait_for_computation(job, future)
+            job.check_canceled()
+        except BaseException:
+            out.release()
+            raise
+        finally:
+            release_shared_arrays(*inputs)
+        # update the processed image (w/o copying it out of the shared buffer)
+        LoadedImagesDict.update_processed_image(win_name, out.array, buffer=out)
+        job.report_progress(1., 'done')
+        print()
+        print('=====================================================')
+        print()
         
-        curr_thread.signal_process_done.emit(
+        ''' done '''
+
+        def __show_result():
+            if seg_vis is not None:
+                cv2.imshow(get_segmentation_window_name(mode, save_vis_path.name), seg_vis)
+            cv2.imshow('Result', final_vis)
+        signals.signal_process_done.emit(
+            ProcessStatus.DONE,
+            f'The process of the loaded image <i>{win_name}</i> has been done.',
+            Colors.LOG_PROCESS_DONE,
+            __show_result,
+        )
+    except JobCanceledError:
+        signals.signal_process_done.emit(
+            ProcessStatus.CANCELED,
+            f'The process of the loaded image <i>{win_name}</i> has been canceled.',
+            Colors.LOG_WARNING,
+            dummy_func,
+        )
+        raise
+    except BaseException as e:
+        signals.signal_process_done.emit(
+            ProcessStatus.ERROR,
+            f'Error happened when processing color harmonization on the image <i>{win_name}</i>: {e}',
+            Colors.LOG_ERROR,
+            dummy_func,
+        )
+
+
+# submit a super resolution job of a loaded image to the scheduler; return the job (for the cancellation)
+def submit_super_resolution_process(win_name, signals, done_callback, priority=PRIORITY_BATCH, **process_cfg):
+    return _SCHEDULER.submit(
+        do_super_resolution_process, win_name, signals, done_callback,
+        priority=priority,
+        name=f'{win_name} (SR)',
+        on_progress=signals.signal_progress.emit,
+        **process_cfg,
+    )
+
+
+# start doing the super resolution process on the processed image (as a job of the scheduler, cf. submit_super_resolution_process)
+# by the long-lived worker process, which keeps the model loaded between the jobs
+# (this process cannot be executed parallelly with the harmonization process within the same image)
+def do_super_resolution_process(job, win_name, signals, done_callback, resize_ratio, **_):
+    try:
+        # deal w/ paths
+        saved_path = Path(LoadedImagesDict.get_save_path(win_name))
+        sr_out_path = saved_path.parent / f'{saved_path.stem}_sr{saved_path.suffix}'
+        # determine the outscale (relative to the source, even if the image is decoded at a reduced scale)
+        outscale = int(LoadedImagesDict.get_decoding_reduction(win_name) / resize_ratio) + 1
+        # apply super resolution on the processed image in memory, and make sure the sr'd image has the same size as the source one
+        job.report_progress(0., 'waiting for the SR worker')
+        processed = LoadedImagesDict.get_processed_image(win_name)
+        raw_w, raw_h = LoadedImagesDict.get_size_of_source_image(win_name)
+        request = _SR_WORKER.submit(processed, (raw_h, raw_w,) + processed.shape[2:], outscale)
+        while not request.wait(COMPUTATION_POLL_INTERVAL):
+            if job.is_canceled:
+                _SR_WORKER.cancel(request)
+                request.wait()
+                job.check_canceled()
+        if request.state == 'canceled':
+            raise JobCanceledError(f'The job {job.name} has been canceled.')
+        if request.state != 'done':
+            raise RuntimeError(request.error)
+        job.report_progress(.9, 'saving')
+        sr = request.image
+        cv2.imwrite(str(sr_out_path), sr)
+        # update the sr'd image (w/ its save-path)
+        LoadedImagesDict.update_sr_image(win_name, sr, buffer=request.out)
+        LoadedImagesDict.update_sr_out_path(win_name, sr_out_path)
+        job.report_progress(1., 'done')
+
+        signals.signal_process_done.emit(
             ProcessStatus.WAITING,
             f'The SR\'d (scale={outscale}) image has been saved to <i>{sr_out_path}</i>.',
             Colors.LOG_PROCESS_DONE,
             done_callback,
         )
+    except JobCanceledError:
+        signals.signal_process_done.emit(
+            ProcessStatus.CANCELED,
+            f'The super resolution of the loaded image <i>{win_name}</i> has been canceled.',
+            Colors.LOG_WARNING,
+            dummy_func,
+        )
+        raise
+    except BaseException as e:
+        signals.signal_process_done.emit(
+            ProcessStatus.ERROR,
+            f'Error happened when processing super resolution on the image <i>{win_name}</i>: {e}',
+            Colors.LOG_ERROR,
+            dummy_func,
+        )
@@ -0,0 +1,195 @@
+import numpy as np
+
+
+# the topology of a flow network stored as flat arrays (directed edges grouped by their tails, i.e., the csr layout)
+class FlowGraph:
+    def __init__(self, n_nodes, tails, heads, rev, indptr, order):
+        self.n_nodes = n_nodes
+        # the tail & head of every directed edge
+        self.tails = tails
+        self.heads = heads
+        # the index of the reverse edge of every directed edge
+        self.rev = rev
+        # the out-edges of the node u are edges[indptr[u]: indptr[u + 1]]
+        self.indptr = indptr
+        # the mapping from the csr layout to the order of edges given when building the graph
+        self._order = order
+
+    @property
+    def n_edges(self):
+        return len(self.tails)
+
+    # arrange the capacities of the given edges (u -> v & v -> u, in the order when building) into the csr layout
+    def arrange_capacities(self, cap_uv, cap_vu=None):
+        if cap_vu is None:
+            cap_vu = cap_uv
+        return np.concatenate((
+            np.asarray(cap_uv, dtype=np.float64).reshape(-1),
+            np.asarray(cap_vu, dtype=np.float64).reshape(-1),
+        ))[self._order]
+
+    # the out-edges of the given nodes & the positions (in the given nodes) of their tails
+    def gather_out_edges(self, nodes):
+        starts = self.indptr[nodes]
+        counts = self.indptr[nodes + 1] - starts
+        owners = np.repeat(np.arange(len(nodes)), counts)
+        edges = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return edges, owners
+
+
+# build a flow network w/ the edge-pairs (u[k] <-> v[k])
+def build_flow_graph(n_nodes, u, v):
+    u = np.asarray(u, dtype=np.int64).reshape(-1)
+    v = np.asarray(v, dtype=np.int64).reshape(-1)
+    n_pairs = len(u)
+    # the first half are u -> v and the second half are v -> u
+    tails = np.concatenate((u, v,))
+    heads = np.concatenate((v, u,))
+    rev = np.concatenate((np.arange(n_pairs) + n_pairs, np.arange(n_pairs),))
+    # group edges by their tails
+    order = np.argsort(tails, kind='stable')
+    inv_order = np.empty_like(order)
+    inv_order[order] = np.arange(len(order))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(tails, minlength=n_nodes)),)).astype(np.int64)
+    return FlowGraph(n_nodes, tails[order], heads[order], inv_order[rev[order]], indptr, order)
+
+
+# build a 4-connected flow network of an image in the shape of [h, w]
+# (the node of the pixel (y, x) is y * w + x; edges are given as all horizontal pairs followed by all vertical pairs)
+def build_grid_flow_graph(h, w):
+    ids = np.arange(h * w, dtype=np.int64).reshape(h, w)
+    u = np.concatenate((ids[:, : -1].reshape(-1), ids[: -1, :].reshape(-1),))
+    v = np.concatenate((ids[:, 1:].reshape(-1), ids[1:, :].reshape(-1),))
+    return build_flow_graph(h * w, u, v)
+
+
+# arrange the (symmetric) n-link capacities of a 4-connected flow network into the csr layout
+# cap_h: [h, w - 1] between (y, x) & (y, x + 1); cap_v: [h - 1, w] between (y, x) & (y + 1, x)
+def arrange_grid_capacities(graph: FlowGraph, cap_h, cap_v):
+    caps = np.concatenate((np.asarray(cap_h).reshape(-1), np.asarray(cap_v).reshape(-1),))
+    return graph.arrange_capacities(caps)
+
+
+# label every node by its distance (in # edges) to the sink in the residual network; unreachable ones are labelled n_nodes + 1
+def _calc_distances_to_sink(graph: FlowGraph, res, res_t, eps):
+    unreachable = graph.n_nodes + 1
+    dist = np.full(graph.n_nodes, unreachable, dtype=np.int64)
+    frontier = np.nonzero(res_t > eps)[0]
+    dist[frontier] = 1
+    d = 1
+    while frontier.size > 0:
+        # the node u could reach the frontier node v if the residual of u -> v, i.e., the reverse of v -> u, is positive
+        edges, _ = graph.gather_out_edges(frontier)
+        edges = edges[res[graph.rev[edges]] > eps]
+        candidates = graph.heads[edges]
+        frontier = np.unique(candidates[dist[candidates] == unreachable])
+        d += 1
+        dist[frontier] = d
+    return dist
+
+
+# warm-start from the (net) flows of all directed edges of a previous solve w/ other capacities on the same flow network:
+# the flows are clipped into the new capacities, and the nodes w/ more outflows than inflows get the deficits from s,
+# which are added to their links to t as well (adding the same value to both t-links of a node does not change the minimum cuts)
+# return the residual capacities, the links from s & to t, and the total added value
+def _warm_start(graph: FlowGraph, edge_caps, cap_s, cap_t, flows):
+    flows = np.clip(flows, -edge_caps[graph.rev], edge_caps)
+    # make the flows of every pair of reverse edges anti-symmetric again
+    flows = np.where(np.arange(graph.n_edges) < graph.rev, flows, -flows[graph.rev])
+    res = edge_caps - flows
+    inflows = -np.bincount(graph.tails, weights=flows, minlength=graph.n_nodes)
+    deficits = np.maximum(-(cap_s + inflows), 0.)
+    return res, cap_s + inflows + deficits, cap_t + deficits, float(np.sum(deficits))
+
+
+# find the minimum s-t cut of a flow network by a vectorized (synchronous) push-relabel method
+# edge_caps: the capacities of all directed edges in the csr layout; cap_s & cap_t: the capacities of the links from s & to t
+# init_flows: the (net) flows of all directed edges of a previous solve on the same network to warm-start from (cf. _warm_start)
+# return the max-flow value & the node partition, where the source side are the nodes which cannot reach t in the residual network
+# (the same partition as networkx.minimum_cut gives), w/ the (net) flows of all directed edges if return_flows
+def solve_min_cut(graph: FlowGraph, edge_caps, cap_s, cap_t, eps=None, init_flows=None, return_flows=False):
+    n = graph.n_nodes
+    unreachable = n + 1
+    edge_caps = np.asarray(edge_caps, dtype=np.float64)
+    res = edge_caps.copy()
+    cap_s = np.asarray(cap_s, dtype=np.float64).reshape(-1)
+    cap_t = np.asarray(cap_t, dtype=np.float64).reshape(-1)
+    if eps is None:
+        eps = 1e-12 * max(1., np.max(res, initial=0.), np.max(cap_s, initial=0.), np.max(cap_t, initial=0.))
+    shift = 0.
+    if init_flows is not None:
+        res, cap_s, cap_t, shift = _warm_start(graph, edge_caps, cap_s, cap_t, init_flows)
+
+    # the flow s -> u -> t could be sent directly
+    direct = np.minimum(cap_s, cap_t)
+    flow_value = float(np.sum(direct)) - shift
+    # saturate all links from s (the initial preflow)
+    excess = cap_s - direct
+    res_t = cap_t - direct
+
+    # the heights (distance labels)
+    heights = _calc_distances_to_sink(graph, res, res_t, eps)
+    work_since_relabel = 0
+    # the active nodes (w/ excess & still possible to reach t), which are tracked incrementally
+    active = np.nonzero((excess > eps) & (heights < unreachable))[0]
+    while active.size > 0:
+        # push to the sink
+        to_t = active[(heights[active] == 1) & (res_t[active] > eps)]
+        pushed = np.minimum(excess[to_t], res_t[to_t])
+        excess[to_t] -= pushed
+        res_t[to_t] -= pushed
+        flow_value += float(np.sum(pushed))
+        active = active[excess[active] > eps]
+        if active.size == 0:
+            break
+
+        # push along all admissible edges at once, in proportion to their residuals
+        edges, owners = graph.gather_out_edges(active)
+        work_since_relabel += len(edges)
+        admissible = (res[edges] > eps) & (heights[active][owners] == heights[graph.heads[edges]] + 1)
+        adm_edges, adm_owners = edges[admissible], owners[admissible]
+        total_res = np.bincount(adm_owners, weights=res[adm_edges], minlength=len(active))
+        has_adm = total_res > 0.
+        ratio = np.ones(len(active))
+        ratio[has_adm] = np.minimum(1., excess[active][has_adm] / total_res[has_adm])
+        push = res[adm_edges] * ratio[adm_owners]
+        res[adm_edges] -= push
+        res[graph.rev[adm_edges]] += push
+        excess[active] = np.where(ratio < 1., 0., np.maximum(excess[active] - total_res, 0.))
+        receivers = graph.heads[adm_edges]
+        np.add.at(excess, receivers, push)
+
+        # relabel the nodes still w/ excess: one plus the minimal height of the residual neighbours (the sink is at height 0)
+        still = excess[active] > eps
+        relabelled = active[still]
+        in_still = still[owners]
+        r_edges, r_owners = edges[in_still], np.cumsum(still)[owners[in_still]] - 1
+        min_heights = np.full(len(relabelled), unreachable - 1, dtype=np.int64)
+        np.minimum.at(min_heights, r_owners, np.where(res[r_edges] > eps, heights[graph.heads[r_edges]], unreachable - 1))
+        min_heights[res_t[relabelled] > eps] = 0
+        heights[relabelled] = np.maximum(heights[relabelled], min_heights + 1)
+
+        # re-calculate the exact distances periodically (the global-relabelling heuristic)
+        if work_since_relabel > graph.n_edges + n:
+            heights = _calc_distances_to_sink(graph, res, res_t, eps)
+            work_since_relabel = 0
+
+        # the next active nodes could only be the relabelled ones & the ones which have received flows
+        active = np.unique(np.concatenate((relabelled, receivers,)))
+        active = active[(excess[active] > eps) & (heights[active] < unreachable)]
+
+    # the nodes which could still reach t are in the sink side
+    source_side = _calc_distances_to_sink(graph, res, res_t, eps) == unreachable
+    if return_flows:
+        return flow_value, source_side, edge_caps - res
+    return flow_value, source_side
+
+
+# find the minimum s-t cut of a 4-connected image grid in the shape of [h, w]
+# cap_h: [h, w - 1]; cap_v: [h - 1, w]; cap_s & cap_t: [h, w]; return the max-flow value & the source-side mask in [h, w]
+def solve_grid_min_cut(cap_h, cap_v, cap_s, cap_t, graph: FlowGraph = None):
+    h, w = np.shape(cap_s)
+    if graph is None:
+        graph = build_grid_flow_graph(h, w)
+    flow_value, source_side = solve_min_cut(graph, arrange_grid_capacities(graph, cap_h, cap_v), cap_s, cap_t)
+    return flow_value, source_side.reshape(h, w)
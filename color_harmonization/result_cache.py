@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+
+from color_harmonization.harmonic_template import build_template_list, HarmonicTemplate_Base
+from utils.harmonization_utils import TEMPL_TYPES_MAPPING
+
+
+# the directory for persisting the harmonization results
+DEFAULT_RESULT_CACHE_DIR = './outputs/result_cache/'
+# the maximal total size of the persisted results (the least-recently-used ones are evicted beyond it)
+DEFAULT_RESULT_CACHE_MAX_BYTES = 1 << 30
+# bump this if the layout of the persisted results (or the algorithm producing them) is changed
+# (2: the resized images are served by the resolution pyramids, whose ratios of 1/2 or less differ from the direct resizing)
+_RESULT_CACHE_VERSION = 2
+
+
+# hash the content (w/ the shape & the type) of an array, or None
+def _hash_array(arr):
+    if arr is None:
+        return 'none'
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{arr.shape}|{arr.dtype.str}|'.encode())
+    h.update(memoryview(arr).cast('B'))
+    return h.hexdigest()
+
+
+# make the key of a harmonization job by the content of the image, the reference image & the mask, and all other settings
+def make_cache_key(im, ref_im=None, mask=None, **settings):
+    content = json.dumps({
+        'version': _RESULT_CACHE_VERSION,
+        'image': _hash_array(im),
+        'ref_image': _hash_array(ref_im),
+        'mask': _hash_array(mask),
+        **settings,
+    }, sort_keys=True, default=str)
+    return hashlib.blake2b(content.encode(), digest_size=20).hexdigest()
+
+
+# get the index of a template type by the template
+def _get_template_type(templ: HarmonicTemplate_Base):
+    return TEMPL_TYPES_MAPPING.index(str(templ))
+
+
+# a cached harmonization result, i.e., the parts which cannot be re-computed cheaply from the inputs
+class CachedResult:
+    def __init__(self, image, labels, template, alpha, f_val, candidates, alpha_curve):
+        # the harmonized image (bgr) & the label map of the moving directions
+        self.image = image
+        self.labels = labels
+        # the chosen template, the rotation (alpha) of it, and the value of the objective function w/ them
+        self.template = template
+        self.alpha = alpha
+        self.f_val = f_val
+        # the (template, alpha, f-value) of all tried templates
+        self.candidates = candidates
+        # the sampled alphas & the values of the objective function of the chosen template (None if not swept)
+        self.alpha_curve = alpha_curve
+
+
+# the on-disk cache of harmonization results keyed by the content of the inputs & the settings,
+# where the total size is bounded by evicting the least-recently-used (by the modified-times of the files) ones
+class ResultCache:
+    def __init__(self, cache_dir=DEFAULT_RESULT_CACHE_DIR, max_bytes=DEFAULT_RESULT_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+
+    def _get_fpath(self, key):
+        return self.cache_dir / f'{key}.npz'
+
+    # all persisted results (w/o the temporary files being written)
+    def _iter_fpaths(self):
+        return (fpath for fpath in self.cache_dir.glob('*.npz') if not fpath.name.endswith('.tmp.npz'))
+
+    # get the cached result of a key (& mark it as recently-used); return None if missing or out-of-date
+    def get(self, key):
+        fpath = self._get_fpath(key)
+        with self._lock:
+            if not fpath.is_file():
+                return None
+            try:
+                with np.load(fpath) as f:
+                    if int(f['version']) != _RESULT_CACHE_VERSION:
+                        return None
+                    image, labels = f['image'], f['labels']
+                    templ = build_template_list(int(f['template_type']))[0]
+                    alpha, f_val = float(f['alpha']), float(f['f_val'])
+                    candidates = [
+                        (build_template_list(int(t))[0], float(a), float(v),)
+                        for t, a, v in zip(f['cand_types'], f['cand_alphas'], f['cand_f_vals'])
+                    ]
+                    alpha_curve = (f['curve_alphas'], f['curve_f_vals'],) if f['curve_alphas'].size > 0 else None
+                os.utime(fpath)
+            except (OSError, KeyError, ValueError):
+                return None
+        return CachedResult(image, labels, templ, alpha, f_val, candidates, alpha_curve)
+
+    # persist the result of a key & evict the least-recently-used ones if needed
+    def put(self, key, image, labels, template, alpha, f_val, candidates, alpha_curve=None):
+        fpath = self._get_fpath(key)
+        curve_alphas, curve_f_vals = (np.zeros((0,)), np.zeros((0,)),) if alpha_curve is None else alpha_curve
+        with self._lock:
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                # write to a temporary file first and then replace, in case that several processes store the same result at once
+                tmp_fpath = fpath.with_name(f'{fpath.stem}.{os.getpid()}.tmp.npz')
+                np.savez(
+                    tmp_fpath,
+                    version=_RESULT_CACHE_VERSION,
+                    image=image,
+                    labels=labels,
+                    template_type=_get_template_type(template),
+                    alpha=alpha,
+                    f_val=f_val,
+                    cand_types=np.array([_get_template_type(templ) for templ, _, _ in candidates], dtype=np.int32),
+                    cand_alphas=np.array([alpha for _, alpha, _ in candidates], dtype=np.float64),
+                    cand_f_vals=np.array([f_val for _, _, f_val in candidates], dtype=np.float64),
+                    curve_alphas=curve_alphas,
+                    curve_f_vals=curve_f_vals,
+                )
+                os.replace(tmp_fpath, fpath)
+                self._evict()
+            except OSError as e:
+                print(f'| Failed to save the harmonization result into the cache: {e} |')
+
+    # remove all cached results
+    def clear(self):
+        with self._lock:
+            for fpath in self._iter_fpaths():
+                fpath.unlink(missing_ok=True)
+
+    # remove the least-recently-used results until the total size is within the bound
+    def _evict(self):
+        entries = []
+        for fpath in self._iter_fpaths():
+            try:
+                stat = fpath.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, fpath,))
+        total = sum(size for _, size, _ in entries)
+        for _, size, fpath in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            fpath.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,101 @@
+import ctypes
+from multiprocessing import shared_memory
+from threading import Lock
+
+import numpy as np
+
+
+# the shared memories which are released but still viewed by some arrays (closed later, once the views are gone)
+_PENDING_CLOSES = []
+_PENDING_CLOSES_LOCK = Lock()
+
+
+# try closing the released shared memories whose views are gone
+def _close_pending():
+    with _PENDING_CLOSES_LOCK:
+        still_pending = []
+        for shm in _PENDING_CLOSES:
+            try:
+                shm.close()
+            except BufferError:
+                still_pending.append(shm)
+        _PENDING_CLOSES[:] = still_pending
+
+
+# attach to an existing shared array by its descriptor (used for unpickling, i.e., in the worker processes)
+def _attach_shared_array(name, shape, dtype):
+    return SharedArray(shape, dtype, name=name)
+
+
+# a numpy array backed by a block of shared memory, which could be passed to other processes w/o copying the content
+# (it is pickled as its descriptor, i.e., the name, the shape & the type, and attached to the same block by the receiver);
+# the creator owns the block & unlinks it when released, while the attachers only close their mappings
+class SharedArray:
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.is_owner = name is None
+        n_items = int(np.prod(self.shape, dtype=np.int64))
+        n_bytes = max(n_items * self.dtype.itemsize, 1)
+        if self.is_owner:
+            _close_pending()
+            self._shm = shared_memory.SharedMemory(create=True, size=n_bytes)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        # view the block through a ctypes array, which holds the buffer of the block as long as any array views it
+        # (hence the block cannot be closed, i.e., unmapped, under the arrays)
+        self._c_buf = (ctypes.c_byte * n_bytes).from_buffer(self._shm.buf)
+        self.array = np.frombuffer(self._c_buf, dtype=self.dtype, count=n_items).reshape(self.shape)
+
+    # create a shared array w/ the content of an array (or None)
+    @classmethod
+    def from_array(cls, arr):
+        if arr is None:
+            return None
+        shared = cls(arr.shape, arr.dtype)
+        shared.array[...] = arr
+        return shared
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    # close the mapping (& unlink the block if owned); the arrays viewing it stay valid until they are gone
+    def release(self):
+        if getattr(self, '_shm', None) is None:
+            return
+        shm, self._shm, self._c_buf, self.array = self._shm, None, None, None
+        _close_pending()
+        if self.is_owner:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        try:
+            shm.close()
+        except BufferError:
+            with _PENDING_CLOSES_LOCK:
+                _PENDING_CLOSES.append(shm)
+
+    # (the shared array is released when it is garbage-collected, if not yet)
+    def __del__(self):
+        self.release()
+
+    def __reduce__(self):
+        assert self._shm is not None, 'A released shared array cannot be passed.'
+        return _attach_shared_array, (self.name, self.shape, self.dtype.str,)
+
+    def __repr__(self):
+        return f'SharedArray(name={self.name if self._shm is not None else None}, shape={self.shape}, dtype={self.dtype})'
+
+
+# get the array of a shared array (or None)
+def get_shared_array(shared):
+    return None if shared is None else shared.array
+
+
+# release all given shared arrays (Nones are skipped)
+def release_shared_arrays(*shared_list):
+    for shared in shared_list:
+        if shared is not None:
+            shared.release()
@@ -0,0 +1,341 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import itertools
+import multiprocessing
+import os
+from threading import Event, Lock, Thread
+
+import cv2
+import numpy as np
+
+from color_harmonization.shared_array import get_shared_array, release_shared_arrays, SharedArray
+
+
+# the directory of the Real-ESRGAN repository & the model used by the super resolution
+REAL_ESRGAN_DIR = './Real-ESRGAN/'
+REAL_ESRGAN_MODEL_NAME = 'RealESRGAN_x4plus'
+REAL_ESRGAN_MODEL_URL = 'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth'
+# the backend of the super resolution: "realesrgan" or "stub" (bicubic interpolation, for testing w/o torch & the model),
+# which could be selected by the environment variable below (Real-ESRGAN falls back to the stub if torch or Real-ESRGAN is not installed)
+SR_BACKEND_ENV_VAR = 'COLOR_HARMONIZATION_SR_BACKEND'
+DEFAULT_SR_BACKEND = os.environ.get(SR_BACKEND_ENV_VAR, 'realesrgan')
+# the side length of the tiles (w/o the overlaps) & the width of the overlaps around every tile, both in the pixels of the source image
+DEFAULT_SR_TILE_SIZE = 256
+DEFAULT_SR_TILE_OVERLAP = 16
+# the number of threads sr-ing the tiles concurrently
+DEFAULT_SR_TILE_WORKERS = 2
+
+
+# the super resolution by Real-ESRGAN (the model is loaded once when the backend is created)
+class RealESRGANBackend:
+    # RealESRGANer.enhance keeps the per-call state (the padded input, the output, ...) on the instance, hence not thread-safe
+    reentrant = False
+
+    def __init__(self):
+        from basicsr.archs.rrdbnet_arch import RRDBNet
+        from basicsr.utils.download_util import load_file_from_url
+        from realesrgan import RealESRGANer
+
+        model_dir = os.path.join(REAL_ESRGAN_DIR, 'weights')
+        model_path = os.path.join(model_dir, f'{REAL_ESRGAN_MODEL_NAME}.pth')
+        if not os.path.isfile(model_path):
+            model_path = load_file_from_url(url=REAL_ESRGAN_MODEL_URL, model_dir=model_dir, progress=True, file_name=None)
+        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
+        # the same settings as "inference_realesrgan.py -n RealESRGAN_x4plus --fp32"
+        # (w/o the tiling of Real-ESRGAN itself, since the images are tiled by upscale_tiled already)
+        self.upsampler = RealESRGANer(scale=4, model_path=model_path, model=model, tile=0, tile_pad=10, pre_pad=0, half=False)
+
+    def upscale(self, im, outscale):
+        sr, _ = self.upsampler.enhance(im, outscale=outscale)
+        return sr
+
+
+# the stand-in of the super resolution by bicubic interpolation
+class StubBackend:
+    reentrant = True
+
+    def upscale(self, im, outscale):
+        return cv2.resize(im, (int(im.shape[1] * outscale), int(im.shape[0] * outscale),), interpolation=cv2.INTER_CUBIC)
+
+
+SR_BACKENDS = {
+    'realesrgan': RealESRGANBackend,
+    'stub': StubBackend,
+}
+
+
+# the weights of the pixels in [start, end) for blending w/ the already-written ones, i.e., ramping up linearly in [start, ramp_end)
+def _feather_weights(start, end, ramp_end):
+    if ramp_end <= start:
+        return np.ones((end - start,), dtype=np.float32)
+    return np.clip((np.arange(start, end, dtype=np.float32) - start + .5) / (ramp_end - start), 0., 1.)
+
+
+# do super resolution on an image tile by tile w/ the overlaps, and stream the tiles into the output (in its final size) directly,
+# where every tile is sr'd w/ its overlaps, resized to its region in the output, and blended w/ the already-written tiles
+# (the upper & the left ones) by the linearly-feathered weights across the overlaps, hence no seams;
+# the peak memory is bounded by the tiles in flight (plus the source & the output) instead of the whole sr'd image
+# the tiles are sr'd by the backend one at a time unless it is reentrant (its "reentrant" attribute), while their resampling still overlaps
+# is_canceled: checked between the tiles; return False if canceled (the output is partially written then)
+def upscale_tiled(
+        backend,
+        src,
+        out,
+        outscale,
+        tile_size=DEFAULT_SR_TILE_SIZE,
+        overlap=DEFAULT_SR_TILE_OVERLAP,
+        n_workers=DEFAULT_SR_TILE_WORKERS,
+        is_canceled=None,
+):
+    assert 0 < overlap <= tile_size, 'The overlap must be positive and not larger than the tile size.'
+    h, w = src.shape[: 2]
+    out_h, out_w = out.shape[: 2]
+    scale_y, scale_x = out_h / h, out_w / w
+    tiles = [(y0, min(y0 + tile_size, h), x0, min(x0 + tile_size, w),) for y0 in range(0, h, tile_size) for x0 in range(0, w, tile_size)]
+    backend_lock = contextlib.nullcontext() if getattr(backend, 'reentrant', False) else Lock()
+
+    # sr a tile w/ its overlaps & resample it to its region in the output, w/ the pixel centers mapped exactly as resizing the whole
+    # sr'd image (i.e., the regions are aligned in the sub-pixel level even if the scales are not integers)
+    def __upscale(tile):
+        y0, y1, x0, x1 = tile
+        py0, py1, px0, px1 = max(y0 - overlap, 0), min(y1 + overlap, h), max(x0 - overlap, 0), min(x1 + overlap, w)
+        oy0, oy1, ox0, ox1 = round(py0 * scale_y), round(py1 * scale_y), round(px0 * scale_x), round(px1 * scale_x)
+        with backend_lock:
+            sr = backend.upscale(np.ascontiguousarray(src[py0: py1, px0: px1]), outscale)
+        sr_scale_y, sr_scale_x = sr.shape[0] / (py1 - py0), sr.shape[1] / (px1 - px0)
+        mat = np.array([
+            [scale_x / sr_scale_x, 0., (px0 + .5 / sr_scale_x) * scale_x - .5 - ox0],
+            [0., scale_y / sr_scale_y, (py0 + .5 / sr_scale_y) * scale_y - .5 - oy0],
+        ])
+        sr = cv2.warpAffine(sr, mat, (ox1 - ox0, oy1 - oy0,), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        return (oy0, oy1, ox0, ox1,), sr.reshape((oy1 - oy0, ox1 - ox0,) + out.shape[2:])
+
+    # blend a sr'd tile into the output (the overlaps w/ the upper & the left tiles span 2 * overlap around the borders of the tile)
+    def __blend(tile, region, sr):
+        y0, _, x0, _ = tile
+        oy0, oy1, ox0, ox1 = region
+        if y0 == 0 and x0 == 0:
+            out[oy0: oy1, ox0: ox1] = sr
+            return
+        weights_y = _feather_weights(oy0, oy1, round(min(y0 + overlap, h) * scale_y) if y0 > 0 else oy0)
+        weights_x = _feather_weights(ox0, ox1, round(min(x0 + overlap, w) * scale_x) if x0 > 0 else ox0)
+        weights = np.multiply.outer(weights_y, weights_x).reshape((oy1 - oy0, ox1 - ox0,) + (1,) * (sr.ndim - 2))
+        dst = out[oy0: oy1, ox0: ox1]
+        dst[...] = np.clip(dst * (1. - weights) + sr * weights + .5, 0, 255).astype(out.dtype)
+
+    # sr the tiles concurrently, but blend them in order (w/ a bounded number of tiles in flight)
+    with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        futures = deque()
+        tile_iter = iter(tiles)
+        for tile in itertools.islice(tile_iter, 2 * max(n_workers, 1)):
+            futures.append((tile, executor.submit(__upscale, tile),))
+        while futures:
+            if is_canceled is not None and is_canceled():
+                for _, future in futures:
+                    future.cancel()
+                return False
+            tile, future = futures.popleft()
+            __blend(tile, *future.result())
+            for next_tile in itertools.islice(tile_iter, 1):
+                futures.append((next_tile, executor.submit(__upscale, next_tile),))
+    return True
+
+
+# the main loop of the worker process: load the backend once, and then serve the jobs from the pipe until it is closed
+# messages from the client: ('job', job_id, src, out, outscale), ('cancel', job_id), ('stop',)
+# messages to the client: ('ready', warning), ('failed', msg), and ('done' | 'canceled' | 'error', job_id, msg) for every job
+def _serve(conn, backend_name, tile_size, tile_overlap, n_tile_workers):
+    warning = ''
+    try:
+        backend = SR_BACKENDS[backend_name]()
+    except ImportError as e:
+        # the dependencies of Real-ESRGAN are missing, hence the stub stands in
+        backend = StubBackend()
+        warning = f'The super resolution ({backend_name}) is not available ({type(e).__name__}: {e}), hence the stub is used instead.'
+    except BaseException as e:
+        conn.send(('failed', f'{type(e).__name__}: {e}',))
+        return
+    conn.send(('ready', warning,))
+
+    queue = []
+    canceled = set()
+    stopped = False
+
+    # take all arrived messages (w/o blocking), so that the queued jobs are served back to back & the canceled ones are skipped
+    def __receive():
+        nonlocal stopped
+        while not stopped and conn.poll():
+            try:
+                msg = conn.recv()
+            except EOFError:
+                msg = ('stop',)
+            if msg[0] == 'job':
+                queue.append(msg[1:])
+            elif msg[0] == 'cancel':
+                canceled.add(msg[1])
+            else: # elif msg[0] == 'stop'
+                stopped = True
+                canceled.update(job_id for job_id, *_ in queue)
+
+    while not stopped or queue:
+        if not queue and not stopped:
+            conn.poll(None)
+        __receive()
+        if not queue:
+            continue
+
+        job_id, src, out, outscale = queue.pop(0)
+        try:
+            # the job is checked between the tiles as well
+            is_canceled = lambda: __receive() or job_id in canceled
+            if is_canceled() or not upscale_tiled(
+                    backend, get_shared_array(src), get_shared_array(out), outscale,
+                    tile_size=tile_size, overlap=tile_overlap, n_workers=n_tile_workers, is_canceled=is_canceled):
+                canceled.discard(job_id)
+                conn.send(('canceled', job_id, '',))
+            else:
+                conn.send(('done', job_id, '',))
+        except (BrokenPipeError, EOFError):
+            return
+        except BaseException as e:
+            conn.send(('error', job_id, f'{type(e).__name__}: {e}',))
+        finally:
+            release_shared_arrays(src, out)
+
+
+# a job of the super resolution, whose result is written into a shared array of the client
+class SuperResolutionRequest:
+    def __init__(self, job_id, src, out, outscale):
+        self.job_id = job_id
+        self.src = src
+        self.out = out
+        self.outscale = outscale
+        # "done", "canceled", or "error" when finished
+        self.state = None
+        self.error = ''
+        self.cancel_requested = False
+        self._finished = Event()
+
+    # the sr'd image (valid only if done)
+    @property
+    def image(self):
+        return self.out.array
+
+    @property
+    def is_finished(self):
+        return self._finished.is_set()
+
+    # wait until the job is finished; return False if timed out
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def _finish(self, state, error=''):
+        if state == 'done' and self.cancel_requested:
+            state = 'canceled'
+        self.state = state
+        self.error = error
+        # the worker has closed its mappings, and the source is no longer needed
+        release_shared_arrays(self.src)
+        if state != 'done':
+            release_shared_arrays(self.out)
+        self._finished.set()
+
+
+# the client of a long-lived worker process of the super resolution, which loads the model once & serves the jobs over a pipe,
+# w/ the images passed through the shared memory (the worker is started at the first job, and re-started if it died)
+class SuperResolutionWorker:
+    def __init__(self, backend=DEFAULT_SR_BACKEND, tile_size=DEFAULT_SR_TILE_SIZE, tile_overlap=DEFAULT_SR_TILE_OVERLAP, n_tile_workers=DEFAULT_SR_TILE_WORKERS):
+        # an unknown backend (e.g., a mistyped environment variable) falls back to Real-ESRGAN
+        if backend not in SR_BACKENDS:
+            print(f'| Unknown backend of the super resolution: {backend} (either {" or ".join(SR_BACKENDS)}), hence realesrgan is used instead. |')
+            backend = 'realesrgan'
+        self.backend = backend
+        # the settings of the tiling (cf. upscale_tiled)
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.n_tile_workers = n_tile_workers
+        self._process = None
+        self._conn = None
+        self._listener = None
+        self._requests = dict()
+        self._counter = itertools.count()
+        # the lock of the requests & the pipe, and the one of starting the worker process, which is held while the model is loaded (or downloaded),
+        # hence the cancellations & the results of the other requests are not blocked by it
+        self._lock = Lock()
+        self._start_lock = Lock()
+
+    # start the worker process (if not yet) & wait until the backend is ready; raise RuntimeError if failed (called w/ the start lock held)
+    def _ensure_started(self):
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                return
+        ctx = multiprocessing.get_context('spawn')
+        conn, child_conn = ctx.Pipe()
+        process = ctx.Process(
+            target=_serve, args=(child_conn, self.backend, self.tile_size, self.tile_overlap, self.n_tile_workers,), name='sr-worker', daemon=True)
+        process.start()
+        child_conn.close()
+        try:
+            msg = conn.recv()
+        except EOFError:
+            msg = ('failed', 'The worker process exited unexpectedly.',)
+        if msg[0] != 'ready':
+            process.join()
+            raise RuntimeError(f'Failed to start the super resolution ({self.backend}): {msg[1]}')
+        if msg[1]:
+            print(f'| {msg[1]} |')
+        # every worker process has its own pending requests, which fail together if it is gone
+        with self._lock:
+            self._process, self._conn, self._requests = process, conn, dict()
+            self._listener = Thread(target=self._listen, args=(conn, self._requests,), name='sr-listener', daemon=True)
+            self._listener.start()
+
+    # receive the results from the worker process (the pending jobs fail if the worker is gone)
+    def _listen(self, conn, pending_requests):
+        while True:
+            try:
+                state, job_id, error = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                request = pending_requests.pop(job_id, None)
+            if request is not None:
+                request._finish(state, error)
+        with self._lock:
+            requests = list(pending_requests.values())
+            pending_requests.clear()
+        for request in requests:
+            request._finish('error', 'The worker process of the super resolution has exited.')
+
+    # submit an image to be sr'd by outscale & resized into out_shape (tile by tile); return the request
+    def submit(self, im, out_shape, outscale):
+        with self._start_lock:
+            self._ensure_started()
+        with self._lock:
+            if self._conn is None:
+                raise RuntimeError('The super resolution has been shut down.')
+            job_id = next(self._counter)
+            request = SuperResolutionRequest(job_id, SharedArray.from_array(im), SharedArray(out_shape, im.dtype), outscale)
+            self._requests[job_id] = request
+            self._conn.send(('job', job_id, request.src, request.out, outscale,))
+        return request
+
+    # cancel a request (it is skipped if still queued, or stopped at the next tile if being sr'd)
+    def cancel(self, request: SuperResolutionRequest):
+        with self._lock:
+            request.cancel_requested = True
+            if request.job_id in self._requests and self._conn is not None:
+                self._conn.send(('cancel', request.job_id,))
+
+    # stop the worker process after the current job (the queued ones are canceled)
+    def shutdown(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.send(('stop',))
+            except (BrokenPipeError, OSError):
+                pass
+            process, self._process, self._conn = self._process, None, None
+        process.join()
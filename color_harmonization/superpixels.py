@@ -0,0 +1,126 @@
+import numpy as np
+
+
+# the default (approximate) number of superpixels of an image
+DEFAULT_N_SUPERPIXELS = 2000
+# the weight of the spatial distance against the color distance (larger for more compact superpixels)
+DEFAULT_COMPACTNESS = 20.
+DEFAULT_N_ITERS = 8
+# the iterations are done on a sub-sampled image where the grid-interval of superpixels is about this number of pixels
+_ITERATION_STEP = 8
+
+
+# the color features of an image in the hsv space (hues are on a circle; the saturations are the radii), in the range of 0 - 255
+def _get_color_features(hsv):
+    theta = hsv[:, :, 0].astype(np.float32) * np.float32(2. * np.pi / 180.)
+    sats = hsv[:, :, 1].astype(np.float32)
+    return np.stack((sats * np.cos(theta), sats * np.sin(theta), hsv[:, :, 2].astype(np.float32),), axis=0).reshape(3, -1)
+
+
+# the grid of superpixels of an image
+class _SuperpixelGrid:
+    def __init__(self, h, w, n_segments):
+        self.step = max(np.sqrt(h * w / max(n_segments, 1)), 1.)
+        self.ny, self.nx = max(int(round(h / self.step)), 1), max(int(round(w / self.step)), 1)
+        self.cell_h, self.cell_w = h / self.ny, w / self.nx
+
+    @property
+    def n_cells(self):
+        return self.ny * self.nx
+
+    # the candidate centres (of the 3x3 neighbouring grid-cells) of the pixels at (ys, xs), w/ -1 for the ones out of the grid
+    def get_candidates(self, ys, xs):
+        cell_ys = np.minimum((ys / self.cell_h).astype(np.int32), self.ny - 1)
+        cell_xs = np.minimum((xs / self.cell_w).astype(np.int32), self.nx - 1)
+        cands_list = []
+        for dy in (-1, 0, 1,):
+            for dx in (-1, 0, 1,):
+                cand_ys, cand_xs = cell_ys + dy, cell_xs + dx
+                valid = (cand_ys >= 0) & (cand_ys < self.ny) & (cand_xs >= 0) & (cand_xs < self.nx)
+                cands_list.append(np.where(valid, cand_ys * self.nx + cand_xs, -1))
+        return cands_list
+
+
+# assign every pixel to the nearest one of its candidate centres by the slic distance
+def _assign_pixels(feats, ys, xs, cands_list, centre_feats, centre_ys, centre_xs, spatial_weight):
+    best_dis = np.full(ys.shape, np.inf, dtype=np.float32)
+    labels = np.zeros(ys.shape, dtype=np.int32)
+    for cands in cands_list:
+        valid = cands >= 0
+        safe_cands = np.where(valid, cands, 0)
+        dis = np.square(ys - centre_ys[safe_cands])
+        dis += np.square(xs - centre_xs[safe_cands])
+        dis *= spatial_weight
+        for c in range(3):
+            dis += np.square(feats[c] - centre_feats[c][safe_cands])
+        better = valid & (dis < best_dis)
+        best_dis[better] = dis[better]
+        labels[better] = cands[better]
+    return labels
+
+
+# group the pixels of an image in the hsv space into superpixels by slic (simple linear iterative clustering),
+# where every pixel only searches for the centres of the 3x3 neighbouring grid-cells
+# (the iterations are done on a sub-sampled image, and then the pixels of the whole image are assigned once by the converged centres)
+# return the label map in [h, w] w/ labels in 0 - (# superpixels - 1)
+def compute_superpixels(hsv, n_segments=DEFAULT_N_SUPERPIXELS, compactness=DEFAULT_COMPACTNESS, n_iters=DEFAULT_N_ITERS):
+    h, w = hsv.shape[: 2]
+    grid = _SuperpixelGrid(h, w, n_segments)
+    spatial_weight = np.float32((compactness / grid.step) ** 2)
+
+    # the sub-sampled image for the iterations
+    scale = max(int(grid.step // _ITERATION_STEP), 1)
+    sub_hsv = hsv[:: scale, :: scale]
+    sub_h, sub_w = sub_hsv.shape[: 2]
+    feats = _get_color_features(sub_hsv)
+    ys, xs = np.mgrid[: sub_h, : sub_w].astype(np.float32).reshape(2, -1) * scale
+    cands_list = grid.get_candidates(ys, xs)
+
+    # initialize the centres at the centres of grid-cells
+    cys, cxs = np.meshgrid((np.arange(grid.ny) + .5) * grid.cell_h, (np.arange(grid.nx) + .5) * grid.cell_w, indexing='ij')
+    centre_ys, centre_xs = cys.reshape(-1).astype(np.float32), cxs.reshape(-1).astype(np.float32)
+    init_idx = np.minimum((centre_ys / scale).astype(np.int64), sub_h - 1) * sub_w + np.minimum((centre_xs / scale).astype(np.int64), sub_w - 1)
+    centre_feats = feats[:, init_idx].copy()
+
+    for _ in range(n_iters):
+        labels = _assign_pixels(feats, ys, xs, cands_list, centre_feats, centre_ys, centre_xs, spatial_weight)
+        # update the centres (the empty ones are kept)
+        counts = np.bincount(labels, minlength=grid.n_cells)
+        nonempty = counts > 0
+        for arr, values in ((centre_ys, ys,), (centre_xs, xs,), (centre_feats[0], feats[0],), (centre_feats[1], feats[1],), (centre_feats[2], feats[2],),):
+            arr[nonempty] = np.bincount(labels, weights=values, minlength=grid.n_cells)[nonempty] / counts[nonempty]
+
+    if n_iters == 0:
+        labels = _assign_pixels(feats, ys, xs, cands_list, centre_feats, centre_ys, centre_xs, spatial_weight)
+    # assign all pixels of the image: the ones inside superpixels of the sub-sampled image follow them,
+    # and only the ones near the boundaries are re-assigned by the converged centres
+    if scale > 1:
+        sub_labels = labels.reshape(sub_h, sub_w)
+        near_boundary = np.zeros((sub_h, sub_w,), dtype=bool)
+        diff_h = sub_labels[:, 1:] != sub_labels[:, : -1]
+        diff_v = sub_labels[1:, :] != sub_labels[: -1, :]
+        near_boundary[:, 1:] |= diff_h
+        near_boundary[:, : -1] |= diff_h
+        near_boundary[1:, :] |= diff_v
+        near_boundary[: -1, :] |= diff_v
+        row_idx, col_idx = np.minimum(np.arange(h) // scale, sub_h - 1), np.minimum(np.arange(w) // scale, sub_w - 1)
+        labels = sub_labels[np.ix_(row_idx, col_idx)].reshape(-1)
+        pixels = np.flatnonzero(near_boundary[np.ix_(row_idx, col_idx)])
+        feats = _get_color_features(hsv.reshape(1, -1, 3)[:, pixels])
+        ys, xs = (pixels // w).astype(np.float32), (pixels % w).astype(np.float32)
+        labels[pixels] = _assign_pixels(feats, ys, xs, grid.get_candidates(ys, xs), centre_feats, centre_ys, centre_xs, spatial_weight)
+
+    # make the labels compact
+    used = np.bincount(labels, minlength=grid.n_cells) > 0
+    return (np.cumsum(used, dtype=np.int32) - 1)[labels].reshape(h, w)
+
+
+# get the adjacency of superpixels, i.e., the pairs (a[k] < b[k]) of 4-connected superpixels & the lengths of their shared boundaries
+def get_superpixel_adjacency(labels):
+    n = int(labels.max()) + 1
+    a = np.concatenate((labels[:, : -1].reshape(-1), labels[: -1, :].reshape(-1),)).astype(np.int64)
+    b = np.concatenate((labels[:, 1:].reshape(-1), labels[1:, :].reshape(-1),)).astype(np.int64)
+    differ = a != b
+    a, b = np.minimum(a[differ], b[differ]), np.maximum(a[differ], b[differ])
+    pairs, boundary_lens = np.unique(a * n + b, return_counts=True)
+    return pairs // n, pairs % n, boundary_lens
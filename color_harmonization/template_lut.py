@@ -0,0 +1,172 @@
+import os
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+
+from color_harmonization.harmonic_template import HarmonicTemplate_Base
+from utils.harmonization_utils import hut_canonicalize_deg, TEMPL_TYPES_MAPPING
+
+
+# the number of alpha-steps per degree, i.e., alphas are sampled every (1 / resolution) degree(s) in [0, 180)
+DEFAULT_ALPHA_RESOLUTION = 2
+# the directory for persisting the built tables
+DEFAULT_LUT_CACHE_DIR = './outputs/lut_cache/'
+# bump this if the layout of the persisted tables is changed
+_LUT_FILE_VERSION = 1
+
+# all integer hues in the opencv hsv space
+HUES = np.arange(180, dtype=np.int32)
+
+# the in-memory cache of the built tables & the lock for it
+_LUT_CACHE = dict()
+_LUT_CACHE_LOCK = Lock()
+
+
+# the tables of a template w/ a certain alpha for all 180 hues, i.e., a row of the template-lut
+class HueTable:
+    def __init__(self, is_in, sector_idx, min_dis, move_dir, nearest_sector_idx_cw, nearest_sector_idx_ccw):
+        # is the hue in any sectors
+        self.is_in = is_in
+        # the index of the sector containing the hue (-1 if none)
+        self.sector_idx = sector_idx
+        # the minimal distance to any borders of sectors
+        self.min_dis = min_dis
+        # the moving direction to the nearest border (-1: counterclockwise; 1: clockwise)
+        self.move_dir = move_dir
+        # the indices of the nearest sectors when moving clockwisely & counterclockwisely
+        self.nearest_sector_idx_cw = nearest_sector_idx_cw
+        self.nearest_sector_idx_ccw = nearest_sector_idx_ccw
+
+
+# build the hue-table of a template w/ a certain alpha by the array-api of the template
+def _build_hue_table(templ: HarmonicTemplate_Base, alpha):
+    is_in, sector_idx = templ.is_in_array(HUES, alpha)
+    min_dis, move_dir = templ.get_min_dis_array(HUES, alpha)
+    _, nearest_sector_idx_cw = templ.find_nearest_sector_by_certain_dir_array(HUES, alpha, move_dir=1)
+    _, nearest_sector_idx_ccw = templ.find_nearest_sector_by_certain_dir_array(HUES, alpha, move_dir=0)
+    return HueTable(
+        is_in,
+        sector_idx.astype(np.int8),
+        min_dis,
+        move_dir.astype(np.int8),
+        nearest_sector_idx_cw.astype(np.int8),
+        nearest_sector_idx_ccw.astype(np.int8),
+    )
+
+
+# the look-up tables of a template for all (alpha, hue) pairs, where alphas are sampled on a fixed grid
+class TemplateLUT:
+    _TABLE_NAMES = ('is_in', 'sector_idx', 'min_dis', 'move_dir', 'nearest_sector_idx_cw', 'nearest_sector_idx_ccw',)
+
+    def __init__(self, templ: HarmonicTemplate_Base, alpha_resolution, tables):
+        self.templ = templ
+        self.alpha_resolution = alpha_resolution
+        # every table is in the shape of [# alphas, 180]
+        self.tables = tables
+
+    # all sampled alphas
+    @property
+    def alphas(self):
+        return np.arange(180 * self.alpha_resolution, dtype=np.float64) / self.alpha_resolution
+
+    # the table of minimal distances in the shape of [# alphas, 180]
+    @property
+    def min_dis(self):
+        return self.tables['min_dis']
+
+    # get the index of an alpha on the grid, or None if the alpha is not sampled
+    def get_alpha_index(self, alpha):
+        alpha = hut_canonicalize_deg(alpha)
+        idx = round(alpha * self.alpha_resolution)
+        if abs(idx / self.alpha_resolution - alpha) > 1e-9:
+            return None
+        return idx % (180 * self.alpha_resolution)
+
+    # get the minimal distances of all hues w/ a certain alpha (looked up if the alpha is on the grid; otherwise computed on the fly)
+    def get_min_dis_row(self, alpha):
+        idx = self.get_alpha_index(alpha)
+        if idx is None:
+            return self.templ.get_min_dis_array(HUES, alpha)[0]
+        return self.tables['min_dis'][idx]
+
+    # get the hue-table w/ a certain alpha (looked up if the alpha is on the grid; otherwise computed on the fly)
+    def get_hue_table(self, alpha):
+        idx = self.get_alpha_index(alpha)
+        if idx is None:
+            return _build_hue_table(self.templ, alpha)
+        return HueTable(*[self.tables[name][idx] for name in TemplateLUT._TABLE_NAMES])
+
+    # build all tables of a template
+    @classmethod
+    def build(cls, templ: HarmonicTemplate_Base, alpha_resolution):
+        hue_tables = [_build_hue_table(templ, alpha) for alpha in np.arange(180 * alpha_resolution) / alpha_resolution]
+        tables = {
+            name: np.stack([getattr(hue_table, name) for hue_table in hue_tables], axis=0)
+            for name in cls._TABLE_NAMES
+        }
+        return cls(templ, alpha_resolution, tables)
+
+    # save all tables into a file
+    def save(self, fpath):
+        fpath = Path(fpath)
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first and then replace, in case that several processes build the same table at once
+        tmp_fpath = fpath.with_name(f'{fpath.stem}.{os.getpid()}.tmp.npz')
+        np.savez(
+            tmp_fpath,
+            version=_LUT_FILE_VERSION,
+            sector_starts=self.templ.sector_starts,
+            sector_ranges=self.templ.sector_ranges,
+            **self.tables,
+        )
+        os.replace(tmp_fpath, fpath)
+
+    # load all tables from a file; return None if the file is missing or out-of-date
+    @classmethod
+    def load(cls, templ: HarmonicTemplate_Base, alpha_resolution, fpath):
+        if not os.path.isfile(fpath):
+            return None
+        try:
+            with np.load(fpath) as f:
+                if int(f['version']) != _LUT_FILE_VERSION or \
+                        not np.array_equal(f['sector_starts'], templ.sector_starts) or \
+                        not np.array_equal(f['sector_ranges'], templ.sector_ranges):
+                    return None
+                tables = {name: f[name] for name in cls._TABLE_NAMES}
+        except (OSError, KeyError, ValueError):
+            return None
+        if tables['min_dis'].shape != (180 * alpha_resolution, 180,):
+            return None
+        return cls(templ, alpha_resolution, tables)
+
+
+# get the filename of the persisted tables of a template
+def _get_lut_fname(templ: HarmonicTemplate_Base, alpha_resolution):
+    templ_name = str(templ)
+    templ_idx = TEMPL_TYPES_MAPPING.index(templ_name) if templ_name in TEMPL_TYPES_MAPPING else 'x'
+    # the index is prepended since some file systems are case-insensitive (i-type vs. I-type)
+    return f'template_type_{templ_idx}_{templ_name}_res={alpha_resolution}.npz'
+
+
+# get the look-up tables of a template (cached in memory & on disk, so that they are built only once)
+def get_template_lut(templ: HarmonicTemplate_Base, alpha_resolution=DEFAULT_ALPHA_RESOLUTION, cache_dir=DEFAULT_LUT_CACHE_DIR):
+    assert isinstance(alpha_resolution, int) and alpha_resolution > 0, 'The alpha-resolution must be a positive integer.'
+    key = (str(templ), tuple(templ.sector_starts.tolist()), tuple(templ.sector_ranges.tolist()), alpha_resolution,)
+    with _LUT_CACHE_LOCK:
+        if key in _LUT_CACHE:
+            return _LUT_CACHE[key]
+        lut = None
+        fpath = None
+        if cache_dir is not None:
+            fpath = Path(cache_dir, _get_lut_fname(templ, alpha_resolution))
+            lut = TemplateLUT.load(templ, alpha_resolution, fpath)
+        if lut is None:
+            lut = TemplateLUT.build(templ, alpha_resolution)
+            if fpath is not None:
+                try:
+                    lut.save(fpath)
+                except OSError as e:
+                    print(f'| Failed to save the look-up tables of the template {templ}-type: {e} |')
+        _LUT_CACHE[key] = lut
+        return lut
@@ -0,0 +1,159 @@
+from pathlib import Path
+from typing import List
+
+import cv2
+import numpy as np
+
+from color_harmonization.harmonic_template import HarmonicTemplate_Base
+from color_harmonization.harmonize import (
+    _build_hue_remap_table,
+    _calc_hue_histogram,
+    _calc_saturation_weighted_hue_histogram,
+    _choose_template_by_histogram,
+    _find_closest_borders_of_sectors_naively,
+    _solve_min_cut_on_pixels,
+)
+from color_harmonization.template_lut import DEFAULT_ALPHA_RESOLUTION
+from utils.general_utils import gut_load_image
+from utils.harmonization_utils import hut_convert_image_into_hsv_w_resizing
+
+
+# the side length of the tiles (w/o the overlaps)
+DEFAULT_TILE_SIZE = 1024
+# the width of the overlaps around every tile (which must not be larger than the tile size)
+DEFAULT_TILE_OVERLAP = 16
+
+
+# the result of a tiled harmonization process
+class TiledHarmonizationResult:
+    def __init__(self, image, template, alpha, f_val, candidates, alpha_curve, raw_hue_hist, new_hue_hist):
+        # the harmonized image (bgr), which might be a memory-mapped array
+        self.image = image
+        # the chosen template, the rotation (alpha) of it, and the value of the objective function w/ them
+        self.template = template
+        self.alpha = alpha
+        self.f_val = f_val
+        # the (template, alpha, f-value) of all tried templates
+        self.candidates = candidates
+        # the sampled alphas & the values of the objective function of the chosen template (None if not swept)
+        self.alpha_curve = alpha_curve
+        # the histograms of hues of the raw & the harmonized images
+        self.raw_hue_hist = raw_hue_hist
+        self.new_hue_hist = new_hue_hist
+
+
+# open the source image as an array which could be sliced tile by tile (a .npy file is memory-mapped instead of being loaded)
+def _open_source(src):
+    if isinstance(src, (str, Path,)):
+        if Path(src).suffix.lower() == '.npy':
+            return np.load(src, mmap_mode='r')
+        im = gut_load_image(src)
+        if im is None:
+            raise ValueError(f'Not a legal image: {src}')
+        return im
+    return src
+
+
+# open the output array (a .npy file is created as a memory-mapped array; None for an in-memory array)
+def _open_output(out, h, w):
+    if out is None:
+        return np.empty((h, w, 3,), dtype=np.uint8)
+    if isinstance(out, (str, Path,)):
+        Path(out).parent.mkdir(parents=True, exist_ok=True)
+        return np.lib.format.open_memmap(str(out), mode='w+', dtype=np.uint8, shape=(h, w, 3,))
+    assert out.shape[: 2] == (h, w,) and out.shape[-1] == 3, 'The shape of the output array must be [h, w, 3].'
+    return out
+
+
+# iterate all tiles (y0, y1, x0, x1) in the row-major order
+def _iter_tiles(h, w, tile_size):
+    for y0 in range(0, h, tile_size):
+        for x0 in range(0, w, tile_size):
+            yield y0, min(y0 + tile_size, h), x0, min(x0 + tile_size, w)
+
+
+# read a region of the source image and convert it into the hsv space
+def _read_region(src, y0, y1, x0, x1):
+    return hut_convert_image_into_hsv_w_resizing(np.ascontiguousarray(src[y0: y1, x0: x1]))
+
+
+# do color harmonization on an image tile by tile, so that the peak memory is bounded by the tile size (plus the source & the output)
+# the first pass streams the tiles for the histogram of hues and chooses the template & alpha globally;
+# the second pass graph-cuts every tile w/ its overlaps, where the overlaps w/ the already-solved tiles (the upper & the left ones) are fixed
+# to their sides (hence the seams are consistent), and writes the tile into the output incrementally
+# src: an array in [h, w, c] (e.g., a memory-mapped one) or a path (.npy files are memory-mapped); out: None, an array, or a path of a .npy file
+def harmonize_tiled(
+        src,
+        templ_list: List[HarmonicTemplate_Base],
+        out=None,
+        tile_size=DEFAULT_TILE_SIZE,
+        overlap=DEFAULT_TILE_OVERLAP,
+        _lambda=.5,
+        alpha_resolution=DEFAULT_ALPHA_RESOLUTION,
+        alpha_search='sweep',
+        refine_alpha=True,
+):
+    assert len(templ_list) > 0, 'At least one harmonic template is needed.'
+    assert 0 < overlap <= tile_size, 'The overlap must be positive and not larger than the tile size.'
+    src = _open_source(src)
+    h, w = src.shape[: 2]
+
+    ''' pass 1. the histogram of hues & the choice of the template and alpha '''
+
+    weighted_hist = np.zeros((180,), dtype=np.float64)
+    raw_hue_hist = np.zeros((180,), dtype=np.int64)
+    n_pixels = 0
+    for y0, y1, x0, x1 in _iter_tiles(h, w, tile_size):
+        _, hsv = _read_region(src, y0, y1, x0, x1)
+        tile_weighted_hist, tile_n_pixels = _calc_saturation_weighted_hue_histogram(hsv, None)
+        weighted_hist += tile_weighted_hist
+        n_pixels += tile_n_pixels
+        raw_hue_hist += _calc_hue_histogram(hsv, None)
+    (templ, alpha, f_val, alpha_curve,), candidates = _choose_template_by_histogram(
+        weighted_hist, n_pixels, templ_list, alpha_resolution=alpha_resolution, method=alpha_search, refine=refine_alpha)
+
+    ''' pass 2. graph-cut & color-shifting tile by tile '''
+
+    out = _open_output(out, h, w)
+    remap_table = _build_hue_remap_table(templ, alpha, alpha_resolution=alpha_resolution)
+    new_hue_hist = np.zeros((180,), dtype=np.int64)
+    # the sides (True: the S-side) of the last (overlap) rows of the previous row of tiles, and of the last (overlap) columns of the previous tile
+    above_sides = np.ones((overlap, w,), dtype=bool)
+    next_above_sides = np.ones((overlap, w,), dtype=bool)
+    left_sides = None
+    for y0, y1, x0, x1 in _iter_tiles(h, w, tile_size):
+        if x0 == 0 and y0 > 0:
+            above_sides, next_above_sides = next_above_sides, above_sides
+        # the tile w/ its overlaps
+        py0, py1, px0, px1 = max(y0 - overlap, 0), min(y1 + overlap, h), max(x0 - overlap, 0), min(x1 + overlap, w)
+        _, hsv = _read_region(src, py0, py1, px0, px1)
+        V, D = _find_closest_borders_of_sectors_naively(hsv, templ, alpha, alpha_resolution=alpha_resolution)
+
+        # fix the pixels of the already-solved tiles & solve the others
+        sides = np.ones(V.shape, dtype=bool)
+        fixed = np.zeros(V.shape, dtype=bool)
+        cy0, cy1, cx0, cx1 = y0 - py0, y1 - py0, x0 - px0, x1 - px0
+        if cy0 > 0:
+            sides[: cy0, :] = above_sides[overlap - cy0:, px0: px1]
+            fixed[: cy0, :] = True
+        if cx0 > 0:
+            sides[cy0: cy1, : cx0] = left_sides[:, overlap - cx0:]
+            fixed[cy0: cy1, : cx0] = True
+        nodes = np.flatnonzero(~fixed)
+        sides.reshape(-1)[nodes] = _solve_min_cut_on_pixels(hsv, V, D, _lambda, sides, nodes)
+
+        # do color-shifting on the tile (w/o the overlaps) and write it into the output
+        core_sides = sides[cy0: cy1, cx0: cx1]
+        core_hsv = hsv[cy0: cy1, cx0: cx1].copy()
+        core_hsv[:, :, 0] = remap_table[core_hsv[:, :, 0], core_sides.astype(np.uint8)]
+        new_im = cv2.cvtColor(core_hsv, cv2.COLOR_HSV2BGR)
+        out[y0: y1, x0: x1] = new_im
+        new_hue_hist += _calc_hue_histogram(cv2.cvtColor(new_im, cv2.COLOR_BGR2HSV), None)
+
+        # keep the sides of the tile for the next ones
+        left_sides = core_sides[:, -overlap:]
+        next_above_sides[overlap - min(overlap, y1 - y0):, x0: x1] = core_sides[-overlap:, :]
+
+    if isinstance(out, np.memmap):
+        out.flush()
+    return TiledHarmonizationResult(out, templ, alpha, f_val, candidates, alpha_curve, raw_hue_hist, new_hue_hist)
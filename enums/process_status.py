@@ -8,6 +8,7 @@ class ProcessStatus(Enum):
     WAITING = 'Waiting...'
     PROCESSING = 'Processing'
     DONE = 'Done'
+    CANCELED = 'Canceled'
     ERROR = 'ERROR happened'
 
     # get the text-color of the designated process-status
@@ -22,5 +23,7 @@ class ProcessStatus(Enum):
             return 253, 16, 19  # blue
         elif self == ProcessStatus.DONE:
             return 16, 109, 2  # green
+        elif self == ProcessStatus.CANCELED:
+            return 128, 128, 128  # gray
         else:  # ERROR
             return 0, 0, 255  # red
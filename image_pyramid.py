@@ -0,0 +1,140 @@
+from threading import RLock
+
+import cv2
+
+from color_harmonization.harmonize import _calc_hue_histogram
+from utils.harmonization_utils import hut_ensure_bgr_image
+
+
+# the longer side (in pixels) of the preview level, which is built eagerly when the image is loaded
+PYRAMID_PREVIEW_SIZE = 300
+# the maximal number of the levels of the requested (non-dyadic) ratios kept by a pyramid (the least-recently-used ones are dropped beyond it)
+PYRAMID_MAX_REQUESTED_LEVELS = 2
+
+
+# a level of a pyramid, whose bgr & hsv images are kept in the image store (cf. ImagePyramid)
+class _PyramidLevel:
+    def __init__(self, ratio, size, is_requested=False):
+        self.ratio = ratio
+        # the size in (w, h)
+        self.size = size
+        # True if it is built for a requested ratio (rather than a dyadic or the preview one)
+        self.is_requested = is_requested
+        # the histogram of hues (built lazily)
+        self.hue_hist = None
+
+    # True if the level covers the given size, i.e., could be downsized into it
+    def covers(self, size):
+        return self.size[0] >= size[0] and self.size[1] >= size[1]
+
+
+# the resolution pyramid of a loaded image w/ the resized bgr & hsv images (and the hue histograms) of several ratios,
+# i.e., the dyadic ones (1, 1/2, 1/4, ...), the preview one & the recently requested ones, which are all built lazily except the preview one;
+# a requested ratio is served by its own level if any, otherwise by resizing the nearest (the smallest covering) dyadic or preview level
+# instead of the original image
+class ImagePyramid:
+    def __init__(self, store, win_name, orig_key):
+        self.store = store
+        self.win_name = win_name
+        # the key of the original image in the store (the bgr image of the ratio 1 is a view of it)
+        self.orig_key = orig_key
+        w, h = store.get_shape(orig_key)[1::-1]
+        self.orig_size = (w, h,)
+        # key, value: the size (w, h), the level
+        self._levels = dict()
+        self._lock = RLock()
+        # the preview level (w/ the longer side of at most PYRAMID_PREVIEW_SIZE pixels) is built eagerly & directly from the original image
+        base = self._build_level(1., self.orig_size)
+        preview_ratio = min(1., PYRAMID_PREVIEW_SIZE / max(w, h))
+        self.preview_size = self._get_size(preview_ratio)
+        self._get_hsv(base if self.preview_size == self.orig_size else self._build_level(preview_ratio, self.preview_size, source=base))
+
+    # get the resized bgr & hsv images of a ratio (read-only)
+    def get_images(self, ratio=None):
+        with self._lock:
+            level = self._get_level(ratio)
+            return self._get_bgr(level), self._get_hsv(level)
+
+    # get the histogram of hues of a ratio
+    def get_hue_histogram(self, ratio=None):
+        with self._lock:
+            level = self._get_level(ratio)
+            if level.hue_hist is None:
+                level.hue_hist = _calc_hue_histogram(self._get_hsv(level), None)
+            return level.hue_hist
+
+    # remove all levels from the store
+    def clear(self):
+        with self._lock:
+            for level in self._levels.values():
+                self._remove_level(level)
+            self._levels.clear()
+
+    # get the size (w, h) of the image resized by a ratio (the same as gut_resize_by_ratio)
+    def _get_size(self, ratio):
+        if ratio == 1:
+            return self.orig_size
+        return int(self.orig_size[0] * ratio), int(self.orig_size[1] * ratio)
+
+    def _get_key(self, level, kind):
+        return (self.win_name, 'pyramid', level.size, kind,)
+
+    def _get_bgr(self, level):
+        if level.ratio == 1:
+            return hut_ensure_bgr_image(self.store.get(self.orig_key))
+        return self.store.get(self._get_key(level, 'bgr'))
+
+    # get the hsv image of a level (converted at the first time, since the levels used only as the sources do not need it)
+    def _get_hsv(self, level):
+        key = self._get_key(level, 'hsv')
+        if key not in self.store:
+            self.store.put(key, cv2.cvtColor(self._get_bgr(level), cv2.COLOR_BGR2HSV))
+        return self.store.get(key)
+
+    # get the level of a ratio (the preview one if None), built from the nearest level if missing
+    def _get_level(self, ratio):
+        size = self.preview_size if ratio is None else self._get_size(ratio)
+        level = self._levels.get(size, None)
+        if level is None:
+            nearest = self._get_nearest_level(size)
+            level = nearest if nearest.size == size else self._build_level(ratio, size, source=nearest, is_requested=True)
+        elif level.is_requested:
+            # mark it as the most-recently-used one
+            self._levels[size] = self._levels.pop(size)
+        return level
+
+    # get the nearest (the smallest) dyadic or preview level covering the size, where the dyadic ones are built on demand, each from the previous one
+    # (the requested levels are never used as the sources, hence the images of a ratio are always the same regardless of the order of requests)
+    def _get_nearest_level(self, size):
+        nearest = None
+        ratio, dyadic_size = 1., self.orig_size
+        while min(dyadic_size) > 0 and dyadic_size[0] >= size[0] and dyadic_size[1] >= size[1]:
+            nearest = self._levels.get(dyadic_size, None) or self._build_level(ratio, dyadic_size, source=nearest)
+            ratio /= 2.
+            dyadic_size = self._get_size(ratio)
+        preview = self._levels.get(self.preview_size, None)
+        if preview is not None and preview.covers(size) and preview.size[0] < nearest.size[0]:
+            nearest = preview
+        return nearest
+
+    # build a level, whose bgr image is resized from the source level (the nearest one if None)
+    def _build_level(self, ratio, size, source=None, is_requested=False):
+        level = _PyramidLevel(ratio, size, is_requested=is_requested)
+        if ratio != 1:
+            if source is None:
+                source = self._get_nearest_level(size)
+            # the dyadic & the preview levels are shrunk by area (w/o aliasing); the requested ones are resized as gut_resize_by_ratio does,
+            # hence they are exactly the same as the ones resized from the original image if served by the level of the ratio 1
+            interpolation = cv2.INTER_LINEAR if is_requested else cv2.INTER_AREA
+            bgr = cv2.resize(self._get_bgr(source), size, interpolation=interpolation)
+            self.store.put(self._get_key(level, 'bgr'), bgr)
+        self._levels[size] = level
+        # drop the least-recently-used requested levels beyond the limit
+        requested_levels = [lv for lv in self._levels.values() if lv.is_requested]
+        for lv in requested_levels[: max(len(requested_levels) - PYRAMID_MAX_REQUESTED_LEVELS, 0)]:
+            self._remove_level(self._levels.pop(lv.size))
+        return level
+
+    def _remove_level(self, level):
+        for kind in ('bgr', 'hsv',):
+            self.store.remove(self._get_key(level, kind))
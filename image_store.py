@@ -0,0 +1,140 @@
+from collections import OrderedDict
+import itertools
+import os
+from pathlib import Path
+import shutil
+from threading import RLock
+
+import numpy as np
+
+
+# the default budget (in bytes) of the images kept in the memory
+DEFAULT_IMAGE_STORE_BUDGET_BYTES = 1 << 30
+# the directory for the images spilled out of the memory (every session has its own sub-directory)
+DEFAULT_IMAGE_STORE_SPILL_DIR = './outputs/image_store/'
+
+
+# an image in the store, which is either kept in the memory or spilled into a .npy file
+class _StoredImage:
+    def __init__(self, array, buffer=None):
+        self.shape = array.shape
+        self.dtype = array.dtype
+        # the array in the memory (None if spilled) & the shared array backing it (if any)
+        self.array = array
+        self.buffer = buffer
+        # the path of the spilled file & the memory-mapped (read-only) array of it
+        self.spill_path = None
+        self.mapped = None
+
+    @property
+    def n_bytes(self):
+        return 0 if self.array is None else self.array.nbytes
+
+
+# a read-only view of an array, hence the stored images are shared w/o copying (but they must be copied before being modified)
+def _read_only_view(array):
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+# the store of images w/ a budget of the memory: the least-recently-used images are spilled into memory-mapped .npy files beyond it,
+# and reloaded (paged in by the os) on demand; all images are handed out as read-only views instead of copies
+class ImageStore:
+    def __init__(self, budget_bytes=DEFAULT_IMAGE_STORE_BUDGET_BYTES, spill_dir=DEFAULT_IMAGE_STORE_SPILL_DIR):
+        self.budget_bytes = budget_bytes
+        self.spill_dir = Path(spill_dir) / f'session-{os.getpid()}'
+        # the least-recently-used image first
+        self._images = OrderedDict()
+        self._n_bytes = 0
+        self._counter = itertools.count()
+        self._lock = RLock()
+
+    # the number of bytes of the images kept in the memory
+    @property
+    def n_bytes(self):
+        return self._n_bytes
+
+    def __contains__(self, key):
+        return key in self._images
+
+    # put an image (w/ the shared array backing it, if any, which is owned by the store from now on), replacing the old one
+    def put(self, key, array, buffer=None):
+        with self._lock:
+            self.remove(key)
+            self._images[key] = _StoredImage(array, buffer)
+            self._n_bytes += array.nbytes
+            self._evict()
+
+    # get an image as a read-only view (or a read-only memory-mapped array if spilled); return None if missing
+    def get(self, key):
+        with self._lock:
+            image = self._images.get(key, None)
+            if image is None:
+                return None
+            self._images.move_to_end(key)
+            if image.array is not None:
+                return _read_only_view(image.array)
+            if image.mapped is None:
+                image.mapped = np.load(image.spill_path, mmap_mode='r')
+            return image.mapped
+
+    # get the shape of an image w/o loading it; return None if missing
+    def get_shape(self, key):
+        image = self._images.get(key, None)
+        return None if image is None else image.shape
+
+    # remove an image (& its spilled file)
+    def remove(self, key):
+        with self._lock:
+            image = self._images.pop(key, None)
+            if image is not None:
+                self._n_bytes -= image.n_bytes
+                self._release(image)
+
+    # change the budget & spill the images beyond it
+    def set_budget(self, budget_bytes):
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self._evict()
+
+    # remove all images & the spilled files (when the application is closed)
+    def close(self):
+        with self._lock:
+            for image in self._images.values():
+                self._release(image)
+            self._images.clear()
+            self._n_bytes = 0
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    # spill the least-recently-used images until the images in the memory are within the budget
+    # (the most-recently-used one is always kept, even if it alone is beyond the budget)
+    def _evict(self):
+        for key in list(self._images.keys())[: -1]:
+            if self._n_bytes <= self.budget_bytes:
+                break
+            image = self._images[key]
+            if image.array is not None:
+                self._spill(image)
+
+    # spill an image into a .npy file (the arrays viewing it are still valid until they are gone)
+    def _spill(self, image):
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        image.spill_path = self.spill_dir / f'{next(self._counter)}.npy'
+        np.save(image.spill_path, image.array)
+        self._n_bytes -= image.n_bytes
+        image.array = None
+        if image.buffer is not None:
+            image.buffer.release()
+            image.buffer = None
+
+    def _release(self, image):
+        if image.buffer is not None:
+            image.buffer.release()
+        image.array, image.buffer, image.mapped = None, None, None
+        if image.spill_path is not None:
+            try:
+                image.spill_path.unlink(missing_ok=True)
+            except OSError:
+                # still mapped by some arrays (on windows)
+                pass
@@ -1,24 +1,55 @@
-import cv2
+from image_pyramid import ImagePyramid
+from image_store import ImageStore
+from utils.general_utils import gut_load_image
 
 
-# the class for storing some information of a loaded image
-class LoadedImageInfo:
-    def __init__(self, orig_img, processed_img=None):
-        self.processed_img = processed_img
-        self.orig_img = orig_img
+# the kinds of the images of a loaded image in the store
+IMAGE_KIND_ORIGINAL = 'original'
+IMAGE_KIND_PROCESSED = 'processed'
+IMAGE_KIND_SR = 'sr'
 
 
 # the class of a dictionary for all loaded images
 class LoadedImagesDict:
-    # the dictionary of all loaded images
-    # key, value: win_name, loaded-image-info
-    loaded_images = dict()
+    # the store of all images (the original, the processed & the sr'd ones) w/ a memory budget
+    # key, value: (win_name, kind), image
+    store = ImageStore()
+    # the resolution pyramids of the original images (whose levels are kept in the store as well)
+    # key, value: win_name, pyramid
+    pyramids = dict()
     saved_paths = dict()
     sr_out_paths = dict()
+    # the sources of the images decoded at a reduced scale, i.e., their file paths, the reductions (the scales of 1/reduction) & their true sizes (w, h)
+    # key, value: win_name, (fpath, reduction, size)
+    reduced_sources = dict()
 
     def __init__(self):
         pass
 
+    # update the source of an image decoded at the scale of 1/reduction (no source kept if not reduced, i.e., the original image is the source)
+    @classmethod
+    def update_source(self, win_name, fpath, reduction=1, source_size=None):
+        if reduction == 1:
+            self.reduced_sources.pop(win_name, None)
+        else:
+            self.reduced_sources[win_name] = (str(fpath), reduction, tuple(source_size),)
+
+    # get the reduction of decoding an image (1 if decoded at the full scale)
+    @classmethod
+    def get_decoding_reduction(self, win_name):
+        return self.reduced_sources[win_name][1] if win_name in self.reduced_sources else 1
+
+    # get the image at the full scale of its source, i.e., re-decode it if it is loaded at a reduced scale (read-only)
+    @classmethod
+    def get_source_image(self, win_name):
+        if win_name not in self.reduced_sources:
+            return self.get_original_image(win_name)
+        fpath = self.reduced_sources[win_name][0]
+        img = gut_load_image(fpath)
+        if img is None:
+            raise ValueError(f'Failed to re-decode the image {fpath} at the full scale.')
+        return img
+
     @classmethod
     def update_sr_out_path(self, win_name, sr_out_path):
         self.sr_out_paths[win_name] = str(sr_out_path)
@@ -27,6 +58,16 @@ class LoadedImagesDict:
     def get_sr_out_path(self, win_name):
         return self.sr_out_paths.get(win_name, None)
 
+    # update the sr'd image (w/ the shared array backing it, if any, which is owned by the store from now on)
+    @classmethod
+    def update_sr_image(self, win_name, sr_img, buffer=None):
+        self.store.put((win_name, IMAGE_KIND_SR,), sr_img, buffer=buffer)
+
+    # get the sr'd image by its name (read-only)
+    @classmethod
+    def get_sr_image(self, win_name):
+        return self.store.get((win_name, IMAGE_KIND_SR,))
+
     @classmethod
     def update_save_path(self, win_name, save_path):
         self.saved_paths[win_name] = str(save_path)
@@ -38,34 +79,68 @@ class LoadedImagesDict:
     # add a new processed image
     @classmethod
     def add_processed_image(self, win_name, orig_img, new_img=None):
-        info = LoadedImageInfo(orig_img, new_img)
-        self.loaded_images[win_name] = info
+        for kind in (IMAGE_KIND_PROCESSED, IMAGE_KIND_SR,):
+            self.store.remove((win_name, kind,))
+        if win_name in self.pyramids:
+            self.pyramids.pop(win_name).clear()
+        self.reduced_sources.pop(win_name, None)
+        self.store.put((win_name, IMAGE_KIND_ORIGINAL,), orig_img)
+        self.pyramids[win_name] = ImagePyramid(self.store, win_name, (win_name, IMAGE_KIND_ORIGINAL,))
+        if new_img is not None:
+            self.store.put((win_name, IMAGE_KIND_PROCESSED,), new_img)
+
+    # update the processed image (w/ the shared array backing it, if any, which is owned by the store from now on)
+    @classmethod
+    def update_processed_image(self, win_name, updated_img, buffer=None):
+        self.store.put((win_name, IMAGE_KIND_PROCESSED,), updated_img, buffer=buffer)
 
-    # update the processed image
+    # drop all images and release the shared arrays backing them & the spilled files (when the application is closed)
     @classmethod
-    def update_processed_image(self, win_name, updated_img):
-        self.loaded_images[win_name].processed_img = updated_img
+    def release_all_images(self):
+        self.pyramids.clear()
+        self.reduced_sources.clear()
+        self.store.close()
 
-    # get the processed image by its name
+    # get the processed image by its name (read-only)
     @classmethod
     def get_processed_image(self, win_name):
-        if win_name in self.loaded_images:
-            return self.loaded_images[win_name].processed_img
-        else:
-            return None
+        return self.store.get((win_name, IMAGE_KIND_PROCESSED,))
 
-    # get the original image by its name
+    # get the original image by its name (read-only, i.e., copy it before modifying it)
     @classmethod
     def get_original_image(self, win_name):
-        if win_name in self.loaded_images:
-            return cv2.copyMakeBorder(self.loaded_images[win_name].orig_img, 0, 0, 0, 0, cv2.BORDER_REPLICATE)
-        else:
+        return self.store.get((win_name, IMAGE_KIND_ORIGINAL,))
+
+    # get the original image resized by the ratio & its hsv one (read-only), served by the pyramid of the image
+    # (the preview-size ones, w/ the longer side of at most PYRAMID_PREVIEW_SIZE pixels, if the ratio is None)
+    @classmethod
+    def get_resized_image_w_hsv(self, win_name, ratio=None):
+        return self.pyramids[win_name].get_images(ratio)
+
+    # get the histogram of hues of the original image resized by the ratio (the preview-size one if the ratio is None)
+    @classmethod
+    def get_hue_histogram(self, win_name, ratio=None):
+        return self.pyramids[win_name].get_hue_histogram(ratio)
+
+    # get the size of the original image
+    @classmethod
+    def get_size_of_original_image(self, win_name):
+        shape = self.store.get_shape((win_name, IMAGE_KIND_ORIGINAL,))
+        if shape is None:
             return None
+        return shape[1], shape[0]
+
+    # get the size of the source of an image, i.e., the size of the original one unless it is decoded at a reduced scale
+    @classmethod
+    def get_size_of_source_image(self, win_name):
+        if win_name in self.reduced_sources:
+            return self.reduced_sources[win_name][2]
+        return self.get_size_of_original_image(win_name)
 
     # get the current size of the processed image
     @classmethod
     def get_size_of_processed_image(self, win_name):
-        img = self.get_processed_image(win_name)
-        if img is None:
+        shape = self.store.get_shape((win_name, IMAGE_KIND_PROCESSED,))
+        if shape is None:
             return None
-        return img.shape[1], img.shape[0]
+        return shape[1], shape[0]
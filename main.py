@@ -2,6 +2,8 @@ import sys
 
 from PyQt5.QtWidgets import QApplication
 
+from color_harmonization.main_process import shutdown_processes
+from loaded_image_obj import LoadedImagesDict
 from ui.qt_ui.main_window.main_window import MainWindow
 
 
@@ -10,7 +12,11 @@ def start_app():
     app = QApplication([])
     window = MainWindow()
     window.show()
-    sys.exit(app.exec())
+    ret = app.exec()
+    # stop the worker processes & free the shared memory
+    shutdown_processes()
+    LoadedImagesDict.release_all_images()
+    sys.exit(ret)
 
 
 if __name__ == '__main__':
@@ -6,7 +6,8 @@ import numpy as np
 from matplotlib import pyplot as plt
 
 
-def apply_interactive_segmentation(fpath_or_im, mode, win_name='', plotout=False):
+# rect: the bounding box (x, y, w, h) of the foreground; let the user select it interactively if not given
+def apply_interactive_segmentation(fpath_or_im, mode, win_name='', plotout=False, rect=None):
     # img = cv2.imread('./resource/test_img/fig7a.png', -1)
     if isinstance(fpath_or_im, str):
         img = cv2.imread(fpath_or_im, -1)
@@ -19,8 +20,9 @@ def apply_interactive_segmentation(fpath_or_im, mode, win_name='', plotout=False
     
     # let user select the roi
     # rect = (0, 0, img.shape[1] - 1, img.shape[0] - 1,)
-    rect = cv2.selectROI('Select the bounding box of the foreground', img)
-    cv2.destroyWindow('Select the bounding box of the foreground')
+    if rect is None:
+        rect = cv2.selectROI('Select the bounding box of the foreground', img)
+        cv2.destroyWindow('Select the bounding box of the foreground')
 
     bgdModel = np.zeros((1, 65), np.float64)
     fgdModel = np.zeros((1, 65), np.float64)
@@ -29,13 +31,22 @@ def apply_interactive_segmentation(fpath_or_im, mode, win_name='', plotout=False
     mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype(np.uint8)
 
     if plotout:
-        vis = np.tile(np.expand_dims(mask2, axis=2), reps=(1, 1, 3,)) * 255
-        vis = np.hstack([vis, img, (img & (vis if mode == 'background' else 255 - vis)),], dtype=np.uint8)
-        cv2.imshow(f'Segmentation: mode={mode} name={win_name}', vis)
+        cv2.imshow(get_segmentation_window_name(mode, win_name), get_segmentation_visualization(img, mask2, mode))
     
     return mask2
 
 
+# get the visualization of a segmentation, i.e., the mask (of the foreground), the image & the pixels harmonized to by the mode
+def get_segmentation_visualization(img, mask2, mode):
+    img = img[:, :, : 3]
+    vis = np.tile(np.expand_dims(mask2, axis=2), reps=(1, 1, 3,)) * 255
+    return np.hstack([vis, img, (img & (vis if mode == 'background' else 255 - vis)),], dtype=np.uint8)
+
+
+def get_segmentation_window_name(mode, win_name=''):
+    return f'Segmentation: mode={mode} name={win_name}'
+
+
 if __name__ == '__main__':
     apply_interactive_segmentation(
         './resource/test_img/fig7a.png',
@@ -1,22 +1,24 @@
 import os
 
 from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QFont
+from PyQt5.QtGui import QDoubleValidator, QFont, QIntValidator
 from PyQt5.QtWidgets import (
-    QDialog, QHBoxLayout, QLabel, QLineEdit, QPushButton, QVBoxLayout,
+    QCheckBox, QDialog, QHBoxLayout, QLabel, QLineEdit, QPushButton, QVBoxLayout,
 )
 
 from enums.dialog_status import DialogStatus
-
-
-DEFAULT_SAVE_RES_DIR = './outputs/results/'
-DEFAULT_SAVE_VIS_DIR = './outputs/visualizations/'
+from loaded_image_obj import LoadedImagesDict
+from utils.general_utils import DEFAULT_SAVE_RES_DIR, DEFAULT_SAVE_VIS_DIR
 
 
 # the panel (dialog) for the global configurations
 class GlobalConfigPanel(QDialog):
     save_res_dir = DEFAULT_SAVE_RES_DIR
     save_vis_dir = DEFAULT_SAVE_VIS_DIR
+    # the resize ratio initially configured for the newly loaded images
+    default_resize_ratio = 1.
+    # decode the images loaded from local at a reduced scale (1/2, 1/4, or 1/8) if the default resize ratio allows it
+    reduced_decoding = False
 
     def __init__(self):
         super(GlobalConfigPanel, self).__init__()
@@ -39,6 +41,25 @@ class GlobalConfigPanel(QDialog):
         self.hbox_save_vis.addWidget(self.lbl_save_vis_dir, 0)
         self.hbox_save_vis.addWidget(self.txt_save_vis_dir, 1)
 
+        # the memory budget of the loaded images (the least-recently-used ones are spilled into files beyond it)
+        self.lbl_image_budget = QLabel('  Memory budget of loaded images (MB)')
+        self.txt_image_budget = QLineEdit(str(LoadedImagesDict.store.budget_bytes >> 20))
+        self.txt_image_budget.setValidator(QIntValidator(1, 1 << 20))
+        self.hbox_image_budget = QHBoxLayout()
+        self.hbox_image_budget.addWidget(self.lbl_image_budget, 0)
+        self.hbox_image_budget.addWidget(self.txt_image_budget, 1)
+
+        # the default resize ratio of the loaded images & whether to decode them at a reduced scale w/ it
+        self.lbl_default_resize_ratio = QLabel('   Default resize ratio of new images')
+        self.txt_default_resize_ratio = QLineEdit(f'{GlobalConfigPanel.default_resize_ratio:.2f}')
+        self.txt_default_resize_ratio.setValidator(QDoubleValidator(.05, 1., 2))
+        self.hbox_default_resize_ratio = QHBoxLayout()
+        self.hbox_default_resize_ratio.addWidget(self.lbl_default_resize_ratio, 0)
+        self.hbox_default_resize_ratio.addWidget(self.txt_default_resize_ratio, 1)
+        self.chk_reduced_decoding = QCheckBox('Decode the images loaded from local at a reduced scale (1/2, 1/4, or 1/8) if the default resize ratio allows it')
+        self.chk_reduced_decoding.setChecked(GlobalConfigPanel.reduced_decoding)
+        self.chk_reduced_decoding.setToolTip('The full-resolution & the SR\'d outputs still keep the size of the files (re-decoded at the full scale if needed).')
+
         # buttons
         self.btn_apply = QPushButton('Apply')
         self.btn_cancel = QPushButton('Cancel')
@@ -52,6 +73,9 @@ class GlobalConfigPanel(QDialog):
         self.vbox_all.addWidget(QLabel('==================================================================================='), 0)
         self.vbox_all.addLayout(self.hbox_save_res, 0)
         self.vbox_all.addLayout(self.hbox_save_vis, 0)
+        self.vbox_all.addLayout(self.hbox_image_budget, 0)
+        self.vbox_all.addLayout(self.hbox_default_resize_ratio, 0)
+        self.vbox_all.addWidget(self.chk_reduced_decoding, 0)
         self.vbox_all.addLayout(self.hbox_buttons, 0)
         self.setLayout(self.vbox_all)
 
@@ -70,6 +94,12 @@ class GlobalConfigPanel(QDialog):
     def action_apply(self):
         GlobalConfigPanel.save_res_dir = os.path.join('./', self.txt_save_res_dir.text())
         GlobalConfigPanel.save_vis_dir = os.path.join('./', self.txt_save_vis_dir.text())
+        if self.txt_image_budget.hasAcceptableInput():
+            LoadedImagesDict.store.set_budget(int(self.txt_image_budget.text()) << 20)
+        if self.txt_default_resize_ratio.hasAcceptableInput():
+            # in the steps of the slider of the harmonization configuration panel
+            GlobalConfigPanel.default_resize_ratio = max(round(float(self.txt_default_resize_ratio.text()) * 20.), 1) / 20.
+        GlobalConfigPanel.reduced_decoding = self.chk_reduced_decoding.isChecked()
         self.dialog_status = DialogStatus.ACCEPTED
         self.accept()
     
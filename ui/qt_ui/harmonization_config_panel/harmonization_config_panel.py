@@ -2,16 +2,29 @@ import os
 
 import cv2
 from PyQt5.QtCore import QSize, Qt
-from PyQt5.QtGui import QFont, QIcon, QPixmap
+from PyQt5.QtGui import QFont, QIcon, QImage, QPixmap
 from PyQt5.QtWidgets import (
-    QButtonGroup, QDialog, QFileDialog, QGridLayout, QHBoxLayout,
+    QButtonGroup, QCheckBox, QDialog, QFileDialog, QGridLayout, QHBoxLayout,
     QLabel, QPushButton, QRadioButton, QSlider, QVBoxLayout,
 )
 
 from enums.colors import Colors
 from enums.dialog_status import DialogStatus
+from loaded_image_obj import LoadedImagesDict
 from utils.general_utils import gut_load_image
-from utils.harmonization_utils import hut_map_template_type
+from utils.harmonization_utils import hut_draw_ring_shaped_histogram, hut_map_template_type
+
+
+# convert a bgr (or bgra) image into a pixmap
+def _convert_image_into_pixmap(im):
+    if im.shape[-1] == 4:
+        rgb = cv2.cvtColor(im, cv2.COLOR_BGRA2RGBA)
+        fmt = QImage.Format_RGBA8888
+    else:
+        rgb = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+        fmt = QImage.Format_RGB888
+    # copy the q-image since it does not own the buffer of the array
+    return QPixmap.fromImage(QImage(rgb.data, rgb.shape[1], rgb.shape[0], rgb.strides[0], fmt).copy())
 
 
 # the panel (dialog) for the configuration of a harmonization process
@@ -28,6 +41,8 @@ class HarmonizationConfigPanel(QDialog):
         self.resize_ratio = kwargs.get('resize_ratio', 1.)
         self.templ_type = kwargs.get('template_type', 0)
         self.ref_im_fpath = kwargs.get('ref_im_fpath', None)
+        self.full_resolution = kwargs.get('full_resolution', False)
+        self._lambda = kwargs.get('_lambda', .5)
         self.__tmp_ref_im_fpath = kwargs.get('ref_im_fpath', None)
 
         self.dialog_status = DialogStatus.DISPLAYING
@@ -75,6 +90,25 @@ class HarmonizationConfigPanel(QDialog):
         self.hbox_slider.addWidget(self.sld_resize_ratio, 1)
         self.hbox_slider.addWidget(self.lbl_show_slider_value, 0)
 
+        # the slider for lambda (the weight of the data term of the graph-cut)
+        self.lbl_lambda_slider = QLabel('Lambda       ')
+        self.sld_lambda = QSlider(self)
+        self.sld_lambda.setOrientation(1)
+        self.sld_lambda.setTickPosition(QSlider.TicksBelow)
+        self.sld_lambda.setRange(0, 100)
+        self.sld_lambda.setSingleStep(1)
+        self.sld_lambda.setTickInterval(20)
+        self.sld_lambda.setValue(int(round(self._lambda * 20.)))
+        self.lbl_show_lambda_slider_value = QLabel(f' {self._lambda:.2f}')
+        self.hbox_lambda_slider = QHBoxLayout()
+        self.hbox_lambda_slider.addWidget(self.lbl_lambda_slider, 0)
+        self.hbox_lambda_slider.addWidget(self.sld_lambda, 1)
+        self.hbox_lambda_slider.addWidget(self.lbl_show_lambda_slider_value, 0)
+
+        # the check-box for applying the harmonization solved on the resized image to the original one
+        self.chk_full_resolution = QCheckBox('Apply to the full resolution (no super resolution needed)')
+        self.chk_full_resolution.setChecked(self.full_resolution)
+
         # buttons
         self.btn_apply = QPushButton('Apply')
         self.btn_cancel = QPushButton('Cancel')
@@ -82,11 +116,16 @@ class HarmonizationConfigPanel(QDialog):
         self.hbox_buttons.addWidget(self.btn_apply, 1)
         self.hbox_buttons.addWidget(self.btn_cancel, 1)
 
-        # the pixmap for displaying the loaded image
+        # the pixmaps for displaying the loaded image & its histogram of hues (both from the preview level of its pyramid, which is always available)
         self.lbl_display_im = QLabel()
-        pixm_im = QPixmap(win_name)
+        preview_im, _ = LoadedImagesDict.get_resized_image_w_hsv(win_name)
+        pixm_im = _convert_image_into_pixmap(preview_im)
         pixm_im = pixm_im.scaled(300, 300, Qt.KeepAspectRatio)
         self.lbl_display_im.setPixmap(pixm_im)
+        self.lbl_display_hist = QLabel()
+        pixm_hist = _convert_image_into_pixmap(hut_draw_ring_shaped_histogram(LoadedImagesDict.get_hue_histogram(win_name)))
+        pixm_hist = pixm_hist.scaled(300, 300, Qt.KeepAspectRatio)
+        self.lbl_display_hist.setPixmap(pixm_hist)
 
         # for reference image
         self.btn_sel_ref_im = QPushButton('Select a reference image (optional)')
@@ -101,6 +140,7 @@ class HarmonizationConfigPanel(QDialog):
 
         self.hbox_im_and_ref_im = QHBoxLayout()
         self.hbox_im_and_ref_im.addWidget(self.lbl_display_im, 0)
+        self.hbox_im_and_ref_im.addWidget(self.lbl_display_hist, 0)
         self.hbox_im_and_ref_im.addLayout(self.vbox_ref_im, 0)
         
         # display all widgets
@@ -110,6 +150,8 @@ class HarmonizationConfigPanel(QDialog):
         self.vbox_all.addLayout(self.hbox_im_and_ref_im, 0)
         self.vbox_all.addLayout(self.grid_icons, 1)
         self.vbox_all.addLayout(self.hbox_slider, 1)
+        self.vbox_all.addLayout(self.hbox_lambda_slider, 1)
+        self.vbox_all.addWidget(self.chk_full_resolution, 1)
         self.vbox_all.addLayout(self.hbox_buttons, 1)
         self.setLayout(self.vbox_all)
 
@@ -123,6 +165,7 @@ class HarmonizationConfigPanel(QDialog):
     # initialize the events
     def init_events(self):
         self.sld_resize_ratio.valueChanged.connect(self.action_set_resize_ratio)
+        self.sld_lambda.valueChanged.connect(self.action_set_lambda)
         self.btn_apply.clicked.connect(self.action_apply)
         self.btn_cancel.clicked.connect(self.action_cancel)
         self.btn_sel_ref_im.clicked.connect(self.action_select_reference_image)
@@ -132,10 +175,16 @@ class HarmonizationConfigPanel(QDialog):
         self.resize_ratio = ratio
         self.lbl_show_slider_value.setText(f' {ratio:.2f}')
     
+    def action_set_lambda(self):
+        self._lambda = self.sld_lambda.value() / 20.
+        self.lbl_show_lambda_slider_value.setText(f' {self._lambda:.2f}')
+    
     def action_apply(self):
         self.resize_ratio = self.sld_resize_ratio.value() / 20.
+        self._lambda = self.sld_lambda.value() / 20.
         self.templ_type = self.grp_icons.checkedId()
         self.ref_im_fpath = self.__tmp_ref_im_fpath
+        self.full_resolution = self.chk_full_resolution.isChecked()
         self.dialog_status = DialogStatus.ACCEPTED
         self.accept()
     
@@ -1,5 +1,6 @@
 from PyQt5.QtWidgets import QAbstractItemView, QListWidget, QListWidgetItem
 
+from color_harmonization.job_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE
 from ui.qt_ui.loaded_images_list.loaded_images_widget import LoadedImagesWidget
 
 
@@ -10,9 +11,10 @@ class LoadedImagesListWidget(QListWidget):
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
 
     # push an item into this list
-    def push_back(self, win_name, img):
-        if img is not None:
-            widget = LoadedImagesWidget(win_name, img, self.count() + 1, self.log_writer)
+    # source_wh: the size of the source if the image is decoded at a reduced scale
+    def push_back(self, win_name, im_wh, resize_ratio=1., source_wh=None):
+        if im_wh is not None:
+            widget = LoadedImagesWidget(win_name, im_wh, self.count() + 1, self.log_writer, resize_ratio=resize_ratio, source_wh=source_wh)
             item = QListWidgetItem(self)
             item.setSizeHint(widget.sizeHint())
             self.addItem(item)
@@ -23,6 +25,17 @@ class LoadedImagesListWidget(QListWidget):
     def get_all_widgets(self):
         return [self.itemWidget(self.item(i)) for i in range(0, self.count())]
 
+    # start the harmonization processes of all loaded images w/ their own configurations,
+    # where the selected ones go first and the others are queued as the batch ones; return the number of started ones
+    def start_all_processes(self, mode='normal'):
+        n_started = 0
+        for i in range(0, self.count()):
+            item = self.item(i)
+            priority = PRIORITY_INTERACTIVE if item.isSelected() else PRIORITY_BATCH
+            if self.itemWidget(item).action_start_process(mode, priority=priority):
+                n_started += 1
+        return n_started
+
     # get the designated widget by the corresponding window name
     def get_widget_by_win_name(self, win_name):
         # iterate all widgets in the list
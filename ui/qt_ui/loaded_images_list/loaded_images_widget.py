@@ -9,32 +9,40 @@ from PyQt5.QtWidgets import (
     QAction, QFileDialog, QHBoxLayout, QLabel, QMenu, QPushButton, QVBoxLayout, QWidget,
 )
 
-from color_harmonization.main_process import ProcessThread
-from color_harmonization.main_process import do_process as do_color_harmonization_process
-from color_harmonization.main_process import do_super_resolution_process
+from color_harmonization.job_scheduler import PRIORITY_INTERACTIVE
+from color_harmonization.main_process import ProcessSignals, submit_loading_process
+from color_harmonization.main_process import submit_process as submit_color_harmonization_process
+from color_harmonization.main_process import submit_super_resolution_process
 from enums.colors import Colors
 from enums.dialog_status import DialogStatus
 from enums.process_status import ProcessStatus
 from loaded_image_obj import LoadedImagesDict
 from ui.qt_ui.harmonization_config_panel.harmonization_config_panel import HarmonizationConfigPanel
-from utils.general_utils import gut_get_ext, gut_load_image, gut_replace_ext
+from utils.general_utils import gut_get_ext, gut_replace_ext
 from utils.harmonization_utils import hut_add_opaque_channel, hut_map_template_type
 
 
 class LoadedImagesWidget(QWidget):
-    def __init__(self, win_name, img, order, log_writer=None, parent=None):
+    def __init__(self, win_name, im_wh, order, log_writer=None, parent=None, resize_ratio=1., source_wh=None):
         super(LoadedImagesWidget, self).__init__(parent)
         # the configuration for harmonization
         self.process_cfg = {
-            'resize_ratio': 1.,
+            'resize_ratio': resize_ratio,
             'template_type': 0,
             'ref_im_fpath': None,
+            'full_resolution': False,
+            '_lambda': .5,
         }
-        # the window name and the image
+        # the window name and the size of the image (from its header if it is still loading)
         self.win_name = win_name
-        self.im_wh = (img.shape[1], img.shape[0],)
+        self.im_wh = tuple(im_wh)
+        # the size of the source (larger than the image if it is decoded at a reduced scale), i.e., the size of the full-resolution & the sr'd outputs
+        self.source_wh = self.im_wh if source_wh is None else tuple(source_wh)
         # the log writer
         self.log_writer = log_writer
+        # the signals of the harmonization jobs & the current (or the last) job
+        self.process_signals = ProcessSignals(self)
+        self.job = None
 
         # the first row (order, win-name, image-size)
         self.lbl_order = QLabel(f'[{order}] |')
@@ -68,6 +76,7 @@ class LoadedImagesWidget(QWidget):
         self.btn_start_process = QPushButton('Start normal process')
         self.btn_start_background_mode = QPushButton('Start background-mode process')
         self.btn_start_foreground_mode = QPushButton('Start foreground-mode process')
+        self.btn_cancel_process = QPushButton('Cancel')
         self.btn_save_processed = QPushButton('Save the processed image to...')
         self.btn_super_resolution = QPushButton('Super resolution')
         self.btn_save_processed_sr = QPushButton('Save the SR\'d image to...')
@@ -76,6 +85,7 @@ class LoadedImagesWidget(QWidget):
         self.hbox_thr.addWidget(self.btn_start_process, 1)
         self.hbox_thr.addWidget(self.btn_start_background_mode, 1)
         self.hbox_thr.addWidget(self.btn_start_foreground_mode, 1)
+        self.hbox_thr.addWidget(self.btn_cancel_process, 0)
         self.hbox_thr.addWidget(self.btn_save_processed, 1)
         self.hbox_thr.addWidget(QLabel(' | '), 0)
         self.hbox_thr.addWidget(self.btn_super_resolution, 1)
@@ -104,6 +114,7 @@ class LoadedImagesWidget(QWidget):
         self.btn_configurate.setDisabled(True)
         self.btn_show_img.setDisabled(True)
         self.btn_start_process.setDisabled(True)
+        self.btn_cancel_process.setDisabled(True)
         self.btn_save_processed.setDisabled(True)
         self.btn_super_resolution.setDisabled(True)
         self.btn_save_processed_sr.setDisabled(True)
@@ -123,7 +134,7 @@ class LoadedImagesWidget(QWidget):
         self.action_show_orig.triggered.connect(lambda: cv2.imshow(f'|{self.win_name}|', LoadedImagesDict.get_original_image(self.win_name)))
         # show the processed image
         self.action_show_proc.triggered.connect(lambda: cv2.imshow(self.win_name, LoadedImagesDict.get_processed_image(self.win_name)))
-        self.action_show_proc_sr.triggered.connect(lambda: cv2.imshow(self.win_name, gut_load_image(LoadedImagesDict.get_sr_out_path(self.win_name))))
+        self.action_show_proc_sr.triggered.connect(lambda: cv2.imshow(self.win_name, LoadedImagesDict.get_sr_image(self.win_name)))
         self.action_show_comparison_btn.triggered.connect(self.action_show_comparison)
         # open the configuration panel
         self.btn_configurate.clicked.connect(self.action_pop_up_configuration_panel)
@@ -131,6 +142,10 @@ class LoadedImagesWidget(QWidget):
         self.btn_start_process.clicked.connect(lambda: self.action_start_process(mode='normal'))
         self.btn_start_background_mode.clicked.connect(lambda: self.action_start_process(mode='background'))
         self.btn_start_foreground_mode.clicked.connect(lambda: self.action_start_process(mode='foreground'))
+        # cancel the queued or running process
+        self.btn_cancel_process.clicked.connect(self.action_cancel_process)
+        self.process_signals.signal_process_done.connect(self.singal_process_done_emitted)
+        self.process_signals.signal_progress.connect(self.signal_progress_emitted)
         # apply super-resolution on the processed image
         self.btn_super_resolution.clicked.connect(self.action_super_resolution)
         # save the processed image
@@ -145,10 +160,14 @@ class LoadedImagesWidget(QWidget):
         self.lbl_status.setStyleSheet(f'color: rgb{status.get_text_color()[::-1]};')
         self.lbl_status.setText(status.value)
         # enable/disable the buttons, if necessary
-        self.btn_show_img.setEnabled(status == ProcessStatus.DONE or status == ProcessStatus.LOADED)
+        self.btn_show_img.setEnabled(status in (ProcessStatus.DONE, ProcessStatus.LOADED, ProcessStatus.CANCELED,))
         self.btn_save_processed.setEnabled(status == ProcessStatus.DONE)
-        # if the image is just loaded
+        self.btn_cancel_process.setEnabled(status in (ProcessStatus.WAITING, ProcessStatus.PROCESSING,))
+        # if the image is just loaded (w/ the actual size of the decoded image)
         if status == ProcessStatus.LOADED:
+            self.im_wh = LoadedImagesDict.get_size_of_original_image(self.win_name)
+            self.source_wh = LoadedImagesDict.get_size_of_source_image(self.win_name)
+            self.lbl_size.setText(self.im_size_display_text)
             self.btn_configurate.setEnabled(True)
             self.btn_start_process.setEnabled(True)
             self.btn_start_background_mode.setEnabled(True)
@@ -164,13 +183,24 @@ class LoadedImagesWidget(QWidget):
             self.btn_save_processed.setEnabled(False)
             self.action_show_proc.setEnabled(False)
             self.action_show_comparison_btn.setEnabled(False)
+        # if the process is canceled (the previous result, if any, is kept)
+        elif status == ProcessStatus.CANCELED:
+            has_processed = LoadedImagesDict.get_processed_image(self.win_name) is not None
+            self.btn_configurate.setEnabled(True)
+            self.btn_start_process.setEnabled(True)
+            self.btn_start_background_mode.setEnabled(True)
+            self.btn_start_foreground_mode.setEnabled(True)
+            self.btn_save_processed.setEnabled(has_processed)
+            self.action_show_proc.setEnabled(has_processed)
+            self.btn_super_resolution.setEnabled(has_processed and not self.process_cfg['full_resolution'])
         # if the process is done
         elif status == ProcessStatus.DONE:
             self.btn_configurate.setEnabled(True)
             self.btn_start_process.setEnabled(True)
             self.btn_start_background_mode.setEnabled(True)
             self.btn_start_foreground_mode.setEnabled(True)
-            self.btn_super_resolution.setEnabled(True)
+            # the result is already at the full resolution, hence no super resolution needed
+            self.btn_super_resolution.setEnabled(not self.process_cfg['full_resolution'])
             self.btn_save_processed.setEnabled(True)
             self.action_show_proc.setEnabled(True)
             self.action_show_comparison_btn.setEnabled(True)
@@ -193,35 +223,54 @@ class LoadedImagesWidget(QWidget):
             self.process_cfg['resize_ratio'] = cfg_panel.resize_ratio
             self.process_cfg['template_type'] = cfg_panel.templ_type
             self.process_cfg['ref_im_fpath'] = cfg_panel.ref_im_fpath
+            self.process_cfg['full_resolution'] = cfg_panel.full_resolution
+            self.process_cfg['_lambda'] = cfg_panel._lambda
             self.lbl_show_config.setText(self.config_display_text)
             self.lbl_size.setText(self.im_size_display_text)
             self.log_writer(f'Configuration for <i>{self.win_name}</i> is updated.')
         elif cfg_panel.dialog_status == DialogStatus.CANCELED:
             pass
 
-    # start the harmonization process
-    def action_start_process(self, mode):
-        thread = ProcessThread(
-            self,
-            target=do_color_harmonization_process,
-            args=(
-                self.win_name,
-                LoadedImagesDict.get_original_image(self.win_name),
-                self,
-                mode,
-            ),
-            kwargs=self.process_cfg,
+    # start the harmonization process, i.e., submit it to the scheduler (the ones started from the buttons go first)
+    def action_start_process(self, mode, priority=PRIORITY_INTERACTIVE):
+        if self.process_status in (ProcessStatus.ERROR, ProcessStatus.LOADING, ProcessStatus.WAITING, ProcessStatus.PROCESSING,):
+            return False
+        self.notify_status_change(ProcessStatus.WAITING)
+        self.job = submit_color_harmonization_process(
+            self.win_name,
+            LoadedImagesDict.get_original_image(self.win_name),
+            self.process_signals,
+            mode,
+            priority=priority,
+            **self.process_cfg,
         )
-        thread.signal_process_done.connect(self.singal_process_done_emitted)
-        thread.start()
         return True
     
+    # start loading the image from a file in a worker thread (cf. submit_loading_process)
+    def action_start_loading(self, fpath, reduction=1, source_text='local'):
+        self.job = submit_loading_process(self.win_name, fpath, self.process_signals, reduction=reduction, source_text=source_text)
+    
+    # cancel the harmonization process (a running one stops at its next checkpoint)
+    def action_cancel_process(self):
+        if self.job is None:
+            return
+        if self.job.cancel():
+            self.log_writer(f'The process of the loaded image <i>{self.win_name}</i> has been canceled.', Colors.LOG_WARNING)
+            self.notify_status_change(ProcessStatus.CANCELED)
+        else:
+            self.log_writer(f'The process of the loaded image <i>{self.win_name}</i> will be canceled at its next step.', Colors.LOG_WARNING)
+            self.btn_cancel_process.setEnabled(False)
+    
     def singal_process_done_emitted(self, process_status, msg, msg_color, done_callback):
         self.log_writer(msg, msg_color)
         self.notify_status_change(process_status)
         if done_callback is not None:
             done_callback()
     
+    def signal_progress_emitted(self, progress, msg):
+        if self.process_status in (ProcessStatus.LOADING, ProcessStatus.PROCESSING,):
+            self.lbl_status.setText(f'{self.process_status.value} ({progress}%: {msg})')
+    
     # https://github.com/xinntao/Real-ESRGAN
     def action_super_resolution(self):
         # the callback function when the super resolution process is done
@@ -234,14 +283,13 @@ class LoadedImagesWidget(QWidget):
             self.action_show_comparison_btn.setEnabled(True)
         
         self.notify_status_change(ProcessStatus.PROCESSING)
-        thread = ProcessThread(
-            self,
-            target=do_super_resolution_process,
-            args=(self.win_name, __done_callback,),
-            kwargs=self.process_cfg,
+        self.job = submit_super_resolution_process(
+            self.win_name,
+            self.process_signals,
+            __done_callback,
+            priority=PRIORITY_INTERACTIVE,
+            **self.process_cfg,
         )
-        thread.signal_process_done.connect(self.singal_process_done_emitted)
-        thread.start()
         return True
     
     # the action of saving the processed image
@@ -276,14 +324,14 @@ class LoadedImagesWidget(QWidget):
             if file_type == 'All (*)' and gut_get_ext(filename) == '':
                 filename = gut_replace_ext(filename, gut_get_ext(self.win_name))
             # write the image into the file w/ the designated filename
-            cv2.imwrite(filename, gut_load_image(LoadedImagesDict.get_sr_out_path(self.win_name)))
+            cv2.imwrite(filename, LoadedImagesDict.get_sr_image(self.win_name))
             # write a log
             if self.log_writer is not None:
                 self.log_writer(f'The SR\'d image <i>{self.win_name}</i> has been saved to the designated location.', Colors.LOG_IMAGE_SAVED)
     
     def action_show_comparison(self):
         raw = LoadedImagesDict.get_original_image(self.win_name)
-        aft = LoadedImagesDict.get_sr_out_path(self.win_name)
+        aft = LoadedImagesDict.get_sr_image(self.win_name)
         if aft is None:
             aft = LoadedImagesDict.get_processed_image(self.win_name)
             if aft.shape[-1] == 4:
@@ -292,7 +340,6 @@ class LoadedImagesWidget(QWidget):
                 d = raw.shape[0] - aft.shape[0]
                 aft = np.concatenate((aft, np.zeros((d, aft.shape[1], 3,), dtype=np.uint8),), axis=0)
         else:
-            aft = gut_load_image(aft)
             if aft.shape[-1] == 4:
                 aft = cv2.cvtColor(aft, cv2.COLOR_BGRA2BGR)
         line = np.zeros((aft.shape[0], 2, 3,), dtype=np.uint8)
@@ -309,14 +356,21 @@ class LoadedImagesWidget(QWidget):
         return f' {"{"} ' + \
                f'Resize-ratio: <span style="color: red;"><strong>{r:.2f}</strong></span>, ' + \
                f'Template: <span style="color: red;"><strong>{t}</strong></span>{"" if t == "AUTO" else "-type"}, ' + \
+               f'Lambda: <span style="color: red;"><strong>{self.process_cfg["_lambda"]:.2f}</strong></span>, ' + \
                'Ref.: {}'.format('NONE' if ref is None else f'<span style="color: red;"><strong>{ref}</strong></span>') + \
+               (', <span style="color: red;"><strong>Full-res.</strong></span>' if self.process_cfg['full_resolution'] else '') + \
                f' {"}"}'
     
     @property
     def im_size_display_text(self):
+        # the size is unknown until the image is loaded (w/o the metadata of the file)
+        if min(self.im_wh) <= 0:
+            return '| Raw: [? x ?] (known after loading)'
         r = self.process_cfg['resize_ratio']
         new_w = int(self.im_wh[0] * r)
         new_h = int(self.im_wh[1] * r)
-        return f'| Raw: [{self.im_wh[0]:,} x {self.im_wh[1]:,}] -> ' + \
+        return f'| Raw: [{self.im_wh[0]:,} x {self.im_wh[1]:,}]' + \
+               (f' (decoded from [{self.source_wh[0]:,} x {self.source_wh[1]:,}])' if self.source_wh != self.im_wh else '') + ' -> ' + \
                f'Resized: [{new_w:,} x {new_h:,}] ' + \
-               f'(# pixels = <span style="color: red;"><strong>{new_w * new_h:,}</strong></span>)'
+               f'(# pixels = <span style="color: red;"><strong>{new_w * new_h:,}</strong></span>)' + \
+               (f' -> Output: [{self.source_wh[0]:,} x {self.source_wh[1]:,}]' if self.process_cfg['full_resolution'] else '')
@@ -8,6 +8,7 @@ from loaded_image_obj import LoadedImagesDict
 from ui.qt_ui.loaded_images_list.loaded_images_list_widget import LoadedImagesListWidget
 from ui.qt_ui.log_area.log_area import LogArea
 from ui.qt_ui.main_window.main_window_actions import *
+from utils.general_utils import gut_get_decoding_reduction, gut_read_image_metadata
 
 
 class MainWindow(QMainWindow):
@@ -38,15 +39,41 @@ class MainWindow(QMainWindow):
         self.action_open_settings.triggered.connect(action_action_open_settings_triggered(self))
         self.action_open_res_dir.triggered.connect(action_open_res_dir_triggered(self))
         self.action_open_vis_dir.triggered.connect(action_open_vis_dir_triggered(self))
+        self.action_process_all.triggered.connect(action_process_all_triggered(self))
     
     # a callback when image loading is done
     def finish_image_loading(self, win_name, img):
         # win_name = self.lis_imgs.deduplicate_win_name(win_name)
-        widget = self.lis_imgs.push_back(win_name, img)
-        widget.notify_status_change(ProcessStatus.LOADED)
+        if img is None:
+            self.write_log(f'The image <i>{win_name}</i> is not a legal image.', Colors.LOG_ERROR)
+            return False
+        widget = self.lis_imgs.push_back(win_name, (img.shape[1], img.shape[0],), GlobalConfigPanel.default_resize_ratio)
         LoadedImagesDict.add_processed_image(win_name, img)
+        widget.notify_status_change(ProcessStatus.LOADED)
         return True
 
+    # start loading image files, where the list is populated at once by the metadata read from their headers,
+    # and the images are decoded by the worker threads (at a reduced scale if the default resize ratio allows it)
+    def start_image_loading(self, fpaths, source_text='local'):
+        for fpath in fpaths:
+            metadata = gut_read_image_metadata(fpath)
+            resize_ratio = GlobalConfigPanel.default_resize_ratio
+            # w/o the metadata (e.g., a format unknown to pillow), the image is still decoded by cv2 (w/o the reduction),
+            # w/ the size unknown until it is loaded (a failed decoding is reported by the loading job)
+            if metadata is None:
+                widget = self.lis_imgs.push_back(fpath, (0, 0,), resize_ratio)
+                self.write_log(f'Loading the image <i>{fpath}</i> (unknown format) from {source_text}...', Colors.LOG_GENERAL)
+                widget.action_start_loading(fpath, reduction=1, source_text=source_text)
+                continue
+            reduction = gut_get_decoding_reduction(resize_ratio) if GlobalConfigPanel.reduced_decoding else 1
+            # the resize ratio is relative to the decoded image (in the steps of the slider of the harmonization configuration panel)
+            w, h = metadata['size']
+            widget = self.lis_imgs.push_back(
+                fpath, (-(-w // reduction), -(-h // reduction),), round(resize_ratio * reduction * 20.) / 20., source_wh=(w, h,))
+            taken_text = f', taken at {metadata["exif"]["DateTime"]}' if 'DateTime' in metadata['exif'] else ''
+            self.write_log(f'Loading the image <i>{fpath}</i> ({metadata["format"]}, {w:,} x {h:,}{taken_text}) from {source_text}...', Colors.LOG_GENERAL)
+            widget.action_start_loading(fpath, reduction=reduction, source_text=source_text)
+
     # write a single log and the text-color at the log-area (text-browser)
     def write_log(self, text, color=Colors.LOG_GENERAL):
         log = '<span style="color: rgb{};"> &gt; {}</span>'.format(str(color), f'<strong>{text}</strong>')
@@ -62,12 +89,6 @@ class MainWindow(QMainWindow):
     def dropEvent(self, event):
         file_paths = [u.toLocalFile() for u in event.mimeData().urls()]
         for fpath in file_paths:
-            if os.path.isfile(fpath):
-                im = gut_load_image(fpath)
-                if im is not None:
-                    self.write_log(f'The image <i>{fpath}</i> has been loaded from local by drag-and-drop.', Colors.LOG_LOAD_IMAGE)
-                    self.finish_image_loading(fpath, im)
-                else:
-                    self.write_log(f'The file <i>{fpath}</i> is not a legal image.', Colors.LOG_ERROR)
-            else:
+            if not os.path.isfile(fpath):
                 self.write_log(f'The path <i>{fpath}</i> is not a legal image file path.', Colors.LOG_ERROR)
+        self.start_image_loading([fpath for fpath in file_paths if os.path.isfile(fpath)], source_text='local by drag-and-drop')
@@ -39,10 +39,8 @@ def action_load_from_local_triggered(self):
             caption='Open image(s)',
             filter='Image Files (*.jpg *.jpeg *.png *bmp)'
         )
-        # iterate the filenames to do the processes
-        for filename in filename_list:
-            self.write_log(f'The image <i>{filename}</i> has been loaded from local.', Colors.LOG_LOAD_IMAGE)
-            self.finish_image_loading(filename, gut_load_image(filename))
+        # load the images in the worker threads
+        self.start_image_loading(filename_list, source_text='local')
     return load_from_local_triggered
 
 
@@ -188,3 +186,14 @@ def action_open_vis_dir_triggered(self):
         if not gut_open_directory_in_explorer(path):
             self.write_log(f'The visualizations path {path} does not exist at the present time.', Colors.LOG_ERROR)
     return open_vis_dir_triggered
+
+
+# the triggered event for starting the (normal) harmonization processes of all loaded images
+def action_process_all_triggered(self):
+    def process_all_triggered():
+        n_started = self.lis_imgs.start_all_processes('normal')
+        if n_started > 0:
+            self.write_log(f'{n_started} process(es) have been scheduled (the selected images go first).', Colors.LOG_GENERAL)
+        else:
+            self.write_log('No images can be processed at the present time.', Colors.LOG_WARNING)
+    return process_all_triggered
@@ -5,6 +5,18 @@ import subprocess
 
 import cv2
 import numpy as np
+from PIL import ExifTags, Image, UnidentifiedImageError
+
+
+DEFAULT_SAVE_RES_DIR = './outputs/results/'
+DEFAULT_SAVE_VIS_DIR = './outputs/visualizations/'
+# the imread-flags of decoding images at the reduced scales (1/2, 1/4 & 1/8) by their reductions,
+# w/ the exif orientation ignored as the unchanged decoding does (hence the reduced images are never rotated)
+REDUCED_DECODING_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2 | cv2.IMREAD_IGNORE_ORIENTATION,
+    4: cv2.IMREAD_REDUCED_COLOR_4 | cv2.IMREAD_IGNORE_ORIENTATION,
+    8: cv2.IMREAD_REDUCED_COLOR_8 | cv2.IMREAD_IGNORE_ORIENTATION,
+}
 
 
 # resize an image by the given ratio
@@ -17,15 +29,51 @@ def gut_resize_by_ratio(im, ratio):
 
 
 # load an image with in-path unicode supported
-def gut_load_image(fpath, flags=-1):
+# reduction: decode the image at the scale of 1/reduction (2, 4, or 8), which is much faster for jpegs (in the dct domain), w/ the alpha channel dropped
+def gut_load_image(fpath, flags=-1, reduction=1):
+    if reduction != 1:
+        flags = REDUCED_DECODING_FLAGS[reduction]
     return cv2.imdecode(np.fromfile(str(fpath), dtype=np.uint8), flags)
 
 
+# save an image by cv2.imwrite; raise OSError if failed (e.g., an unwritable path or an unsupported extension)
+def gut_save_image(fpath, im):
+    if not cv2.imwrite(str(fpath), im):
+        raise OSError(f'Failed to save the image to {fpath}.')
+
+
+# get the largest reduction of decoding (cf. gut_load_image) not finer than the resize ratio, i.e., 1/reduction >= the ratio
+def gut_get_decoding_reduction(resize_ratio):
+    for reduction in sorted(REDUCED_DECODING_FLAGS.keys(), reverse=True):
+        if 1. / reduction >= resize_ratio:
+            return reduction
+    return 1
+
+
+# read the metadata of an image from its header w/o decoding it, i.e., the size (w, h), the format & the exif tags (by their names);
+# return None if it is not an image
+def gut_read_image_metadata(fpath):
+    try:
+        with Image.open(str(fpath)) as im:
+            exif = {ExifTags.TAGS.get(tag, tag): value for tag, value in im.getexif().items()}
+            return dict(size=im.size, format=im.format, exif=exif)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+
 # get the extension (suffix) of an image by its filename/path
 def gut_get_ext(fpath):
     return Path(fpath).suffix
 
 
+# get the output filename of a harmonization process (shared by the results and the visualizations)
+# tile_size: tagged if harmonized tile by tile (cf. harmonize_tiled), since the result could differ from the whole-image one
+def gut_get_output_fname(win_name, resize_ratio, template_type, full_resolution=False, tile_size=None):
+    full_res_tag = '_full-res' if full_resolution else ''
+    tiled_tag = '' if tile_size is None else f'_tiled{tile_size}'
+    return f'{Path(win_name).stem}_ratio={resize_ratio:.2f}{full_res_tag}{tiled_tag}_type={template_type}{Path(win_name).suffix}'
+
+
 # replace the extension of a filename/path
 def gut_replace_ext(fpath, ext):
     return str(Path(fpath).with_suffix(ext))
@@ -1,7 +1,7 @@
 import cv2
 import numpy as np
 
-from utils.general_utils import gut_resize_by_ratio
+from utils.general_utils import gut_load_image, gut_resize_by_ratio
 
 
 TEMPL_TYPES_MAPPING = ('i', 'V', 'L', 'I', 'T', 'Y', 'X', 'AUTO',)
@@ -14,12 +14,8 @@ def hut_map_template_type(templ_type):
     return templ_type
 
 
-# convert an image into the hsv color space
-def hut_convert_image_into_hsv_w_resizing(im, ratio=1):
-    # do resizing first, if intended
-    im = gut_resize_by_ratio(im, ratio)
-
-    # ensure the image is in the shape of [H, W, 3]
+# ensure an image is in the shape of [H, W, 3], i.e., in the bgr space (the gray ones are tiled & the alpha channel is dropped)
+def hut_ensure_bgr_image(im):
     if im.ndim == 2:
         im = np.tile(np.expand_dims(im, axis=2), reps=(1, 1, 3,))
     if im.shape[-1] == 1:
@@ -27,12 +23,31 @@ def hut_convert_image_into_hsv_w_resizing(im, ratio=1):
     if im.shape[-1] == 4:
         im = im[:, :, : -1]
     assert im.ndim == 3 and im.shape[-1] == 3, 'Unsupported image format.'
+    return im
+
+
+# convert an image into the hsv color space
+def hut_convert_image_into_hsv_w_resizing(im, ratio=1):
+    # do resizing first, if intended
+    im = gut_resize_by_ratio(im, ratio)
+
+    # ensure the image is in the shape of [H, W, 3]
+    im = hut_ensure_bgr_image(im)
 
     # convert the image from bgr space to hsv space
     hsv = cv2.cvtColor(im, cv2.COLOR_BGR2HSV)
     return im, hsv
 
 
+# load a reference image, resize it into the given size (w, h), and convert it into the hsv color space
+def hut_load_reference_image_w_resizing(ref_im_fpath, size):
+    ref_im = gut_load_image(ref_im_fpath)
+    if ref_im is None:
+        raise ValueError(f'Failed to load the reference image {ref_im_fpath}.')
+    ref_im = cv2.resize(ref_im, size)
+    return hut_convert_image_into_hsv_w_resizing(ref_im)
+
+
 # draw the ring-shaped histogram
 def hut_draw_ring_shaped_histogram(hist, templ=None, alpha=0., shape_of_hist='sector'):
     assert shape_of_hist in ('sector', 'line',)
@@ -131,6 +146,7 @@ def hut_visualize_histogram(hist, templ=None, alpha=0., raw_im=None, show=False,
     if show:
         cv2.imshow('histogram', vis)
         cv2.waitKey(0)
+    return vis
 
 
 # calculate the arc-length
@@ -153,6 +169,20 @@ def hut_canonicalize_deg(deg, max_range=180.):
     # return ret
 
 
+# calculate the arc-lengths element-wisely (the array version of hut_calc_arc_len)
+def hut_calc_arc_len_array(deg1, deg2=None, r=10.):
+    deg1 = hut_canonicalize_deg_array(deg1)
+    if deg2 is None:
+        return 2. * np.pi * r * ((np.abs(deg1) % 180) / 180.)
+    deg2 = hut_canonicalize_deg_array(deg2)
+    return 2. * np.pi * r * ((np.abs(deg1 - deg2) % 180) / 180.)
+
+
+# canonicalize angles in degree into a certain range element-wisely (the array version of hut_canonicalize_deg)
+def hut_canonicalize_deg_array(deg, max_range=180.):
+    return np.asarray(deg, dtype=np.float64) % max_range
+
+
 # add the opaque channel to a 3-channel image (and it becomes 4-channel)
 def hut_add_opaque_channel(im):
     if im.ndim == 3 and im.shape[-1] == 3: